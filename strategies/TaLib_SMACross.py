@@ -9,6 +9,7 @@ class TaLib_SMACross(bt.Strategy):
     params = (
         ("maperiodf", 15),
         ("maperiods", 50),
+        ("use_cache", False),
     )
 
     def log(self, txt, dt=None):
@@ -26,8 +27,19 @@ class TaLib_SMACross(bt.Strategy):
         self.buycomm = None
 
         # Add a MovingAverageSimple indicator
-        self.smaf = bt.talib.SMA(self.datas[0], timeperiod=self.params.maperiodf)
-        self.smas = bt.talib.SMA(self.datas[0], timeperiod=self.params.maperiods)
+        if self.params.use_cache:
+            # Computed once per data and period and shared by the runs of a sweep (see utils.indicators)
+            from utils.indicators import cached_indicator
+
+            self.smaf = cached_indicator(
+                self.datas[0], "SMA", timeperiod=self.params.maperiodf
+            )
+            self.smas = cached_indicator(
+                self.datas[0], "SMA", timeperiod=self.params.maperiods
+            )
+        else:
+            self.smaf = bt.talib.SMA(self.datas[0], timeperiod=self.params.maperiodf)
+            self.smas = bt.talib.SMA(self.datas[0], timeperiod=self.params.maperiods)
         self.crossover = bt.ind.CrossOver(self.smaf, self.smas)
 
     def notify_order(self, order):
@@ -3,25 +3,40 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 from datetime import datetime  # For datetime objects
 import os.path  # To manage paths
 import sys  # To find out the script name (in argv[0])
-import requests
-
-import pandas as pd
+import time
 
 sys.path.append("../libraries/backtrader")
-import backtrader as bt
+sys.path.append("../")
 
-sys.path.append("../libraries/quantstats")
-import quantstats as qs
+# pandas, backtrader and the utils modules are imported by the functions that use them, so that importing this
+# module (e.g. only for get_files, or in every worker process of a pool) is instant
 
-sys.path.append("../")
-from utils.testers import TestStrategyComplete
 
-import yfinance as yf
+def load_data(datapath, use_cache=True):
+    """
+    Loads the ohlcv data of an asset as expected by the backtests
+    INPUTS
+    datapath: [Obligatory] path of the csv where the data is. Must contain datetime, open, high, low, close, volume
+    use_cache: [Optional, default = True] whether to load it from its columnar cache (see utils.datastore), which is built on first use and refreshed when the csv changes
+    """
+    import pandas as pd
+
+    from utils.datastore import load_ohlcv
+
+    if use_cache:
+        try:
+            return load_ohlcv(datapath)
+        except OSError as e:
+            print("[WARNING] - Columnar cache not available, parsing csv: %s" % repr(e))
+    df = pd.read_csv(datapath)
+    df["date"] = pd.to_datetime(df["date"])
+    return df
 
 
 def run_backtest_full(
-    strategy=TestStrategyComplete,
+    strategy=None,
     datapath="../data/us/daily/aapl.csv",
+    strategy_params=None,
     analyzers=None,
     custom_log_prefix=None,
     init_cash=100000.0,
@@ -29,34 +44,79 @@ def run_backtest_full(
     margin=None,
     writer=False,
     mult=1.0,
+    exactbars=1,
+    profile=False,
+    resample=None,
+    cache=False,
+    catalog=True,
+    prune=None,
 ):
     """
     Runs a backtest on an asset
     INPUT
-    strategy: [Optional, default = TestStrategyComplete] the strategy to test
+    strategy: [Optional, default = None] the strategy to test. If None utils.testers.TestStrategyComplete
     datapath: [Optional, defalut = "../data/us/daily/aapl.csv"] path of the csv where the backtest data is. Must contain datetime, open, high, low, close, volume
+    strategy_params: [Optional, default = None] dictionary with the parameters to pass to the strategy
     analyzers: [Optional, default = None] The backtest analyzer, usually where the logger that records the results is chosen
     custom_log_prefix: [Optional, default = None] a prefix for the folder where the logger will save the results
     init_cash: [Optional, default = 100000.0] the initial money the trategy starts with
     comission: [Optional, default = 0.00] the comission. It will be a percentage of the operation value if margin == None, and a set value if margin != None (margin is a parameter used when backtesting futures-like contracts)
     mult: [Optional, default = 1.0] the multiplier applied to value of stocks, simulates leverage.
+    exactbars: [Optional, default = 1] backtrader memory saving mode, see Cerebro's exactbars parameter
+    profile: [Optional, default = False] whether to time every strategy, indicator, sizer and analyzer callback and save it in log_path as profile.csv (see utils.profiling)
+    resample: [Optional, default = None] if provided, dictionary with the arguments of cerebro.resampledata (e.g. {"timeframe": bt.TimeFrame.Weeks}) to also add a resampled copy of the data
+    cache: [Optional, default = False] whether to return the log_path of an earlier identical run instead of running again. Runs are identified by the code and parameters of the strategy and analyzers, the contents of the data file and the other arguments (see utils.runcache). Profiled runs are never cached
+    catalog: [Optional, default = True] whether to record the run, its settings, runtime and metrics in ../backtests/catalog.sqlite (see utils.catalog)
+    prune: [Optional, default = None] if provided, dictionary with the pruning rules of utils.risk.RiskMonitor (e.g. {"max_drawdown_frac": 0.4} for a 40% drawdown). The run stops at the first bar that breaks one and is marked as pruned in the catalog
     """
+    import backtrader as bt
+
+    from utils.catalog import record_run
+    from utils.profiling import Profiler
+    from utils.risk import RiskMonitor
+    from utils.runcache import load_entry, run_key, save_entry
+    from utils.testers import TestStrategyComplete
+
+    if strategy is None:
+        strategy = TestStrategyComplete
+    key = None
+    if cache and not profile:
+        key = run_key(
+            strategy,
+            datapath,
+            strategy_params,
+            analyzers,
+            custom_log_prefix=custom_log_prefix,
+            init_cash=init_cash,
+            commission=commission,
+            margin=margin,
+            writer=writer,
+            mult=mult,
+            resample=resample,
+            prune=prune,
+        )
+        entry = load_entry(key)
+        if entry is not None and os.path.exists(entry["log_path"]):
+            print("[LOG] - Identical run found in %s" % entry["log_path"])
+            return entry["log_path"]
+
     # Create a cerebro entity
     cerebro = bt.Cerebro()
 
     # Add a strategy
-    cerebro.addstrategy(strategy)
+    cerebro.addstrategy(strategy, **(strategy_params or {}))
 
-    df = pd.read_csv(datapath)
-    df["date"] = pd.to_datetime(df["date"])
+    df = load_data(datapath)
     # Create a Data Feed
     data = bt.feeds.PandasData(
         dataname=df, datetime=0, open=1, high=2, low=3, close=4, volume=5
     )
 
     # Add the Data Feed to Cerebro
-    cerebro.adddata(data)
-    cerebro.resampledata(data, name=datapath.replace("/", "-").replace("\\", "-"))
+    name = datapath.replace("/", "-").replace("\\", "-")
+    cerebro.adddata(data, name=name)
+    if resample is not None:
+        cerebro.resampledata(data, name=name + "-resampled", **resample)
 
     if custom_log_prefix is not None:
         # chr(92) is the backslash
@@ -67,9 +127,18 @@ def run_backtest_full(
     if analyzers is not None:
         for analyzer in analyzers:
             if "LOGGER" in analyzer.__name__.upper():
-                cerebro.addanalyzer(analyzer, log_path=log_path, data_df=df)
+                kwargs = dict(log_path=log_path, data_df=df)
+                if "catalog" in analyzer.params._getkeys():
+                    # The run is recorded below, with its settings and runtime, or not at all
+                    kwargs["catalog"] = False
+                cerebro.addanalyzer(analyzer, **kwargs)
             else:
                 cerebro.addanalyzer(analyzer)
+    if prune is not None:
+        cerebro.addanalyzer(RiskMonitor, _name="risk", **prune)
+    if profile:
+        # Added last, so that it can instrument the analyzers above
+        cerebro.addanalyzer(Profiler, log_path=log_path)
 
     # Set our desired cash start
     cerebro.broker.setcash(init_cash)
@@ -84,14 +153,332 @@ def run_backtest_full(
     print("Starting Portfolio Value: %.2f" % cerebro.broker.getvalue())
 
     # Run over everything
-    cerebro.run(exactbars=1)
+    start = time.perf_counter()
+    strats = cerebro.run(exactbars=exactbars)
+    runtime = time.perf_counter() - start
 
     # Print out the final result
     print("Final Portfolio Value: %.2f" % cerebro.broker.getvalue())
 
+    risk = strats[0].analyzers.risk.get_analysis() if prune is not None else dict()
+    if risk.get("pruned"):
+        print(
+            "[WARNING] - Run pruned at bar %d: %s" % (risk["pruned_bar"], risk["reason"])
+        )
+
+    if catalog:
+        try:
+            record_run(
+                log_path,
+                params=dict(strats[0].params._getkwargs()),
+                prefix=custom_log_prefix,
+                strategy=strategy.__name__,
+                data=name,
+                init_cash=init_cash,
+                commission=commission,
+                margin=margin,
+                mult=mult,
+                runtime=runtime,
+                run_key=key,
+                final_value=cerebro.broker.getvalue(),
+                pruned=risk.get("pruned"),
+                prune_reason=risk.get("reason"),
+            )
+        except Exception as e:
+            print("[WARNING] - Could not record the run in the catalog: %s" % repr(e))
+
+    if key is not None:
+        save_entry(key, {"log_path": log_path, "final_value": cerebro.broker.getvalue()})
+
+    return log_path
+
+
+def run_backtest_multi(
+    strategy=None,
+    path="../data/stocks/nyse",
+    tickers=None,
+    strategy_params=None,
+    analyzers=None,
+    custom_log_prefix=None,
+    init_cash=100000.0,
+    commission=0.00,
+    margin=None,
+    writer=False,
+    mult=1.0,
+    exactbars=-2,
+    sizer=None,
+    sizer_params=None,
+    resample=None,
+    profile=False,
+):
+    """
+    Runs a backtest on many assets at once, one data feed per ticker
+    INPUT
+    strategy: [Optional, default = None] the strategy to test, it must trade self.datas. If None utils.testers.TestStrategyMulti
+    path: [Optional, default = "../data/stocks/nyse"] folder with the csvs of the tickers. They are loaded into a date-aligned panel (see utils.panel) and every feed reads its columns, without a DataFrame per feed
+    tickers: [Optional, default = None] tickers of the path to use. If None all of them
+    strategy_params: [Optional, default = None] dictionary with the parameters to pass to the strategy
+    analyzers: [Optional, default = None] The backtest analyzers. Logger01 writes a summary per asset
+    custom_log_prefix: [Optional, default = None] a prefix for the folder where the logger will save the results
+    init_cash, commission, margin, writer, mult, profile: [Optional] as in run_backtest_full
+    exactbars: [Optional, default = -2] backtrader memory saving mode. 1 is not supported by backtrader's indicators when the datas start at different dates
+    sizer: [Optional, default = None] the sizer, e.g. utils.sizers.Ludopata
+    sizer_params: [Optional, default = None] dictionary with the parameters to pass to the sizer, e.g. {"split": True}
+    resample: [Optional, default = None] if provided, dictionary with the arguments of cerebro.resampledata to also add a resampled copy of every feed
+    """
+    import numpy as np
+    import pandas as pd
+    import backtrader as bt
+
+    from utils.feeds import ArrayData, dates_to_num
+    from utils.panel import build_panel
+    from utils.profiling import Profiler
+    from utils.testers import TestStrategyMulti
+
+    if strategy is None:
+        strategy = TestStrategyMulti
+    panels = {
+        column: build_panel(path, column=column)
+        for column in ("open", "high", "low", "close", "volume")
+    }
+    close = panels["close"]
+    if tickers is None:
+        tickers = close.tickers
+    missing = [t for t in tickers if t not in close.tickers]
+    if missing:
+        raise ValueError("Tickers not found in %s: %s" % (path, ", ".join(missing)))
+    dates = dates_to_num(close.dates)
+
+    cerebro = bt.Cerebro()
+    cerebro.addstrategy(strategy, **(strategy_params or {}))
+    if sizer is not None:
+        cerebro.addsizer(sizer, **(sizer_params or {}))
+    for ticker in tickers:
+        data = ArrayData(
+            dates=dates,
+            **{column: panel.column(ticker) for column, panel in panels.items()},
+        )
+        cerebro.adddata(data, name=ticker)
+        if resample is not None:
+            cerebro.resampledata(data, name=ticker + "-resampled", **resample)
+
+    name = path.replace("/", "-").replace("\\", "-")
+    if custom_log_prefix is not None:
+        log_path = f"../backtests/{custom_log_prefix}_{strategy.__name__}_{name}_{datetime.now().isoformat()}"
+    else:
+        log_path = f"../backtests/{strategy.__name__}_{name}_{datetime.now().isoformat()}"
+
+    if analyzers is not None:
+        for analyzer in analyzers:
+            if "LOGGER" in analyzer.__name__.upper():
+                if "per_asset" in analyzer.params._getkeys():
+                    cerebro.addanalyzer(analyzer, log_path=log_path, per_asset=True)
+                else:
+                    print(
+                        "[WARNING] - %s does not log per asset, its summary will only have the first one"
+                        % analyzer.__name__
+                    )
+                    # Aligned with the bars of the run, flat before the first ticker starts trading
+                    traded = np.zeros(len(close), dtype=bool)
+                    for ticker in tickers:
+                        traded |= ~np.isnan(close.column(ticker))
+                    first_df = pd.DataFrame(
+                        {c: p.column(tickers[0])[traded] for c, p in panels.items()}
+                    )
+                    first_df = first_df.ffill().bfill()
+                    first_df.insert(0, "date", close.dates[traded])
+                    cerebro.addanalyzer(analyzer, log_path=log_path, data_df=first_df)
+            else:
+                cerebro.addanalyzer(analyzer)
+    if profile:
+        cerebro.addanalyzer(Profiler, log_path=log_path)
+
+    cerebro.broker.setcash(init_cash)
+    cerebro.broker.setcommission(commission=commission, margin=margin, mult=mult)
+    if not os.path.exists(log_path):
+        os.makedirs(log_path)
+    if writer:
+        cerebro.addwriter(bt.WriterFile, csv=True, out=os.path.join(log_path, "writer.csv"))
+
+    print("Starting Portfolio Value: %.2f" % cerebro.broker.getvalue())
+    cerebro.run(exactbars=exactbars)
+    print("Final Portfolio Value: %.2f" % cerebro.broker.getvalue())
+
     return log_path
 
 
+def run_backtest_intraday(
+    strategy=None,
+    symbols=None,
+    root="../data/intraday",
+    start=None,
+    end=None,
+    strategy_params=None,
+    analyzers=None,
+    custom_log_prefix=None,
+    init_cash=100000.0,
+    commission=0.00,
+    margin=None,
+    mult=1.0,
+    exactbars=1,
+    chunk_size=65536,
+    flush_every=10000,
+    timeframe=None,
+    compression=1,
+):
+    """
+    Runs a backtest on intraday bars stored with utils.intraday.write_bars, streaming them from disk chunk by chunk
+    instead of loading them, so that years of minute data fit in memory. Loggers do not get data_df and flush their
+    records every flush_every rows
+    INPUT
+    strategy: [Optional, default = None] the strategy to test. If None utils.testers.TestStrategyComplete
+    symbols: [Obligatory] list of symbols of root, one data feed per symbol
+    root: [Optional, default = "../data/intraday"] root folder of the intraday storage
+    start: [Optional, default = None] first date and time to test. If None from the first bar stored
+    end: [Optional, default = None] last date and time to test. If None until the last bar stored
+    strategy_params, analyzers, custom_log_prefix, init_cash, commission, margin, mult: [Optional] as in run_backtest_full
+    exactbars: [Optional, default = 1] backtrader memory saving mode. 1 only keeps the bars the indicators need
+    chunk_size: [Optional, default = 65536] bars read from disk at a time per symbol
+    flush_every: [Optional, default = 10000] rows the loggers keep in memory before writing them. None keeps them all
+    timeframe: [Optional, default = None] timeframe of the stored bars. If None bt.TimeFrame.Minutes
+    compression: [Optional, default = 1] bars per timeframe unit, e.g. 5 for 5 minute bars
+    """
+    import backtrader as bt
+
+    from utils.intraday import IntradayData
+    from utils.testers import TestStrategyComplete
+
+    if not symbols:
+        raise ValueError("Parameter symbols must be provided")
+    if strategy is None:
+        strategy = TestStrategyComplete
+    if timeframe is None:
+        timeframe = bt.TimeFrame.Minutes
+
+    cerebro = bt.Cerebro()
+    cerebro.addstrategy(strategy, **(strategy_params or {}))
+    for symbol in symbols:
+        data = IntradayData(
+            symbol=symbol,
+            root=root,
+            start=start,
+            end=end,
+            chunk_size=chunk_size,
+            timeframe=timeframe,
+            compression=compression,
+        )
+        cerebro.adddata(data, name=symbol)
+
+    name = root.replace("/", "-").replace("\\", "-") + "-" + "-".join(symbols)
+    if custom_log_prefix is not None:
+        log_path = f"../backtests/{custom_log_prefix}_{strategy.__name__}_{name}_{datetime.now().isoformat()}"
+    else:
+        log_path = f"../backtests/{strategy.__name__}_{name}_{datetime.now().isoformat()}"
+
+    if analyzers is not None:
+        for analyzer in analyzers:
+            if "LOGGER" in analyzer.__name__.upper():
+                kwargs = {"log_path": log_path}
+                if "flush_every" in analyzer.params._getkeys():
+                    kwargs["flush_every"] = flush_every
+                if len(symbols) > 1:
+                    if "per_asset" in analyzer.params._getkeys():
+                        kwargs["per_asset"] = True
+                    else:
+                        print(
+                            "[WARNING] - %s does not log per asset, its summary will only have the first one"
+                            % analyzer.__name__
+                        )
+                cerebro.addanalyzer(analyzer, **kwargs)
+            else:
+                cerebro.addanalyzer(analyzer)
+
+    cerebro.broker.setcash(init_cash)
+    cerebro.broker.setcommission(commission=commission, margin=margin, mult=mult)
+    if not os.path.exists(log_path):
+        os.makedirs(log_path)
+
+    print("Starting Portfolio Value: %.2f" % cerebro.broker.getvalue())
+    cerebro.run(exactbars=exactbars, preload=False)
+    print("Final Portfolio Value: %.2f" % cerebro.broker.getvalue())
+
+    return log_path
+
+
+def run_backtest_metrics(
+    strategy=None,
+    data_df=None,
+    strategy_params=None,
+    init_cash=100000.0,
+    commission=0.00,
+    margin=None,
+    mult=1.0,
+    prune=None,
+):
+    """
+    Runs a backtest on an already loaded DataFrame without writing any log and returns its headline metrics
+    INPUT
+    strategy: [Optional, default = None] the strategy to test. If None utils.testers.TestStrategyComplete
+    data_df: [Obligatory] DataFrame as returned by load_data. It is not copied, so it can be shared between runs
+    strategy_params: [Optional, default = None] dictionary with the parameters to pass to the strategy
+    init_cash: [Optional, default = 100000.0] the initial money the trategy starts with
+    comission: [Optional, default = 0.00] the comission, as in run_backtest_full
+    margin: [Optional, default = None] the margin, as in run_backtest_full
+    mult: [Optional, default = 1.0] the multiplier applied to value of stocks, simulates leverage.
+    prune: [Optional, default = None] if provided, dictionary with the pruning rules of utils.risk.RiskMonitor (e.g. {"max_drawdown_frac": 0.4, "min_equity": 0.8, "min_equity_bar": 252}, fractions: 0.4 is a 40% drawdown). The run stops at the first bar that breaks one
+    OUTPUT
+    dictionary with final_value, sharpe, max_drawdown (percentage, 40 for 40%, unlike the max_drawdown_frac pruning rule), n_trades and runtime (seconds), plus pruned and pruned_bar if prune is provided. The metrics of a pruned run cover its bars until it was stopped
+    """
+    import backtrader as bt
+
+    from utils.risk import RiskMonitor
+    from utils.testers import TestStrategyComplete
+
+    if data_df is None:
+        raise ValueError("Parameter data_df must be provided")
+    if strategy is None:
+        strategy = TestStrategyComplete
+    start = time.perf_counter()
+
+    cerebro = bt.Cerebro(stdstats=False)
+    cerebro.addstrategy(strategy, **(strategy_params or {}))
+    data = bt.feeds.PandasData(
+        dataname=data_df, datetime=0, open=1, high=2, low=3, close=4, volume=5
+    )
+    cerebro.adddata(data)
+
+    cerebro.addanalyzer(
+        bt.analyzers.SharpeRatio,
+        _name="sharpe",
+        timeframe=bt.TimeFrame.Days,
+        annualize=True,
+        riskfreerate=0.0,
+    )
+    cerebro.addanalyzer(bt.analyzers.DrawDown, _name="drawdown")
+    cerebro.addanalyzer(bt.analyzers.TradeAnalyzer, _name="trades")
+    if prune is not None:
+        cerebro.addanalyzer(RiskMonitor, _name="risk", **prune)
+
+    cerebro.broker.setcash(init_cash)
+    cerebro.broker.setcommission(commission=commission, margin=margin, mult=mult)
+
+    strat = cerebro.run(exactbars=1)[0]
+
+    trades = strat.analyzers.trades.get_analysis()
+    metrics = {
+        "final_value": cerebro.broker.getvalue(),
+        "sharpe": strat.analyzers.sharpe.get_analysis().get("sharperatio"),
+        "max_drawdown": strat.analyzers.drawdown.get_analysis()["max"]["drawdown"],
+        "n_trades": trades.get("total", dict()).get("closed", 0),
+        "runtime": time.perf_counter() - start,
+    }
+    if prune is not None:
+        risk = strat.analyzers.risk.get_analysis()
+        metrics["pruned"] = risk["pruned"]
+        metrics["pruned_bar"] = risk["pruned_bar"]
+    return metrics
+
+
 def get_report_complete(log_path, html=True, console=False):
     """
     Creates the quantstats report of a backtrader backtrade
@@ -99,8 +486,13 @@ def get_report_complete(log_path, html=True, console=False):
     log_path: [Obligatory] the path to the folder where the summary.csv is contained
     html: [Optional, default = True] Whether to create and store in the log_path a .html report
     console: [Optional, default = False] Whether to show the report as output
-
+    See utils.metrics.get_report_metrics to get only the statistics, without quantstats
     """
+    import pandas as pd
+
+    sys.path.append("../libraries/quantstats")
+    import quantstats as qs
+
     summary_path = os.path.join(log_path, "summary.csv")
     df = pd.read_csv(summary_path, index_col=0)
     df = df.fillna(0).set_index(pd.to_datetime(df["date"])).drop("date", axis=1)
@@ -109,6 +501,7 @@ def get_report_complete(log_path, html=True, console=False):
         qs.reports.html(
             df.loc[:, "value_returns"],
             benchmark=df.loc[:, "close_returns"],
+            output=html_path,
             download_filename=html_path,
         )
     if console:
@@ -129,7 +522,10 @@ def get_stock_data(
     date_end: [Optional, default = None] last data date as 'YYYY-MM-DD'. If None the maximum will be chosen
     period: [Optional, default = None] dates range, alternative to date_start and date_end. valid periods: 1d,5d,1mo,3mo,6mo,1y,2y,5y,10y,ytd,max. Alternative to data
     in_conflict_keep: [Optional, default = "old"] "old" or "new". If data already exists por a same date point, whether to keep the old or new data, as the file will be overwritten
+    See utils.downloader.update_stock_data for concurrent and incremental updates
     """
+    import pandas as pd
+    import yfinance as yf
 
     if not os.path.exists(path):
         os.makedirs(path)
@@ -150,6 +546,8 @@ def get_stock_data(
                     raise ValueError(
                         'Parameter in_conflict_keep can only have two values: "old" or "new"'
                     )
+            else:
+                final = data
             final.to_csv(data_path, index_label="date")
     elif period is not None:
         for ticker in tickers:
@@ -167,6 +565,8 @@ def get_stock_data(
                     raise ValueError(
                         'Parameter in_conflict_keep can only have two values: "old" or "new"'
                     )
+            else:
+                final = data
             final.to_csv(data_path, index_label="date")
     else:
         print("[WARNING] - Either start and end date or period must be specified")
@@ -179,7 +579,10 @@ def save_download_file(path, url, name):
     path: [Obligatory] the path where the file is to be saved
     url: [Obligatory] the URL where the file is located
     name: [Obligatory] name to be given to the file
+    See utils.fetcher.fetch_files to download many files at once
     """
+    import requests
+
     if not os.path.exists(path):
         os.makedirs(path)
     req = requests.get(url)
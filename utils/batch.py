@@ -0,0 +1,108 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import multiprocessing as mp
+import os
+import sys
+import time
+from datetime import datetime
+
+import pandas as pd
+
+sys.path.append("../")
+from utils.basic import get_files, load_data, run_backtest_metrics
+from utils.testers import TestStrategyComplete
+
+
+def _run_ticker(task):
+    strategy, ticker, datapath, strategy_params, broker_kwargs = task
+    row = {"ticker": ticker, "datapath": datapath}
+    start = time.perf_counter()
+    try:
+        df = load_data(datapath)
+        row["n_bars"] = len(df)
+        row.update(
+            run_backtest_metrics(
+                strategy=strategy,
+                data_df=df,
+                strategy_params=strategy_params,
+                **broker_kwargs,
+            )
+        )
+        row["error"] = None
+    except Exception as e:
+        row["runtime"] = time.perf_counter() - start
+        row["error"] = repr(e)
+    return row
+
+
+def run_batch(
+    strategy=TestStrategyComplete,
+    path="../data/stocks/nyse",
+    tickers=None,
+    strategy_params=None,
+    processes=None,
+    maxtasksperchild=50,
+    init_cash=100000.0,
+    commission=0.00,
+    margin=None,
+    mult=1.0,
+    results_path=None,
+    verbose_every=50,
+):
+    """
+    Runs a strategy over every ticker of a universe in parallel and saves one consolidated results file
+    INPUTS
+    strategy: [Optional, default = TestStrategyComplete] the strategy to test
+    path: [Optional, default = "../data/stocks/nyse"] folder with one .csv per ticker, as saved by get_stock_data
+    tickers: [Optional, default = None] list of tickers to run, looked up as path/TICKER.csv. If None every .csv in path is run
+    strategy_params: [Optional, default = None] dictionary with the parameters to pass to the strategy
+    processes: [Optional, default = None] number of worker processes. If None the number of cores is used
+    maxtasksperchild: [Optional, default = 50] tickers a worker runs before being replaced, keeps memory bounded on long universes
+    init_cash, commission, margin, mult: [Optional] broker settings, as in run_backtest_full
+    results_path: [Optional, default = None] path of the results .csv. If None it is saved under ../backtests/
+    verbose_every: [Optional, default = 50] print the progress every this many tickers. None to disable
+    OUTPUT
+    DataFrame with one row per ticker, failed tickers have the error column filled
+    """
+    if tickers is None:
+        files = sorted(f for f in get_files(path) if f.lower().endswith(".csv"))
+        tickers = [os.path.splitext(f)[0] for f in files]
+    else:
+        files = [t.upper() + ".csv" for t in tickers]
+    broker_kwargs = dict(
+        init_cash=init_cash, commission=commission, margin=margin, mult=mult
+    )
+    tasks = [
+        (strategy, ticker, os.path.join(path, f), strategy_params, broker_kwargs)
+        for ticker, f in zip(tickers, files)
+    ]
+
+    if results_path is None:
+        results_path = f'../backtests/batch_{strategy.__name__}_{path.replace("/","-").replace(chr(92),"-")}_{datetime.now().isoformat()}.csv'
+    results_dir = os.path.dirname(results_path)
+    if results_dir and not os.path.exists(results_dir):
+        os.makedirs(results_dir)
+
+    rows = list()
+    start = time.perf_counter()
+    with mp.Pool(processes, maxtasksperchild=maxtasksperchild) as pool:
+        for row in pool.imap_unordered(_run_ticker, tasks):
+            rows.append(row)
+            if row["error"] is not None:
+                print("[WARNING] - %s failed: %s" % (row["ticker"], row["error"]))
+            if verbose_every and len(rows) % verbose_every == 0:
+                print(
+                    "[LOG] - %d/%d tickers run in %.2f seconds"
+                    % (len(rows), len(tasks), time.perf_counter() - start)
+                )
+
+    df = pd.DataFrame(rows)
+    if len(df):
+        df = df.sort_values("ticker").reset_index(drop=True)
+    df.to_csv(results_path)
+    n_errors = df["error"].notna().sum() if len(df) else 0
+    print(
+        "[LOG] - %d tickers run, %d failed. Results saved in %s"
+        % (len(df), n_errors, results_path)
+    )
+    return df
@@ -0,0 +1,407 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import argparse
+import importlib
+import itertools
+import json
+import multiprocessing as mp
+import os
+import platform
+import queue as queue_module
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# Run from a folder next to utils/ (e.g. research/): python ../utils/benchmarks.py --help
+DEFAULT_STRATEGIES = (
+    "utils.testers:TestStrategyComplete",
+    "strategies.TaLib_SMACross:TaLib_SMACross",
+)
+DEFAULT_LOGGERS = (
+    None,
+    "utils.loggers:Logger01",
+    "utils.loggers:LoggerMicro",
+    "utils.loggers:LoggerColumnar",
+)
+# utils.basic is imported by every worker process, utils.cli by every quant command
+IMPORT_MODULES = ("utils.basic", "utils.cli")
+# Modules that must only be imported by the functions that use them, checked by check_imports
+_HEAVY = ("quantstats", "yfinance", "requests", "scipy.optimize", "pandas", "numpy", "backtrader")
+LAZY_IMPORTS = {
+    "utils.basic": _HEAVY
+    + ("utils.testers", "utils.datastore", "utils.feeds", "utils.profiling", "utils.runcache", "utils.catalog", "utils.risk"),
+    "utils.cli": _HEAVY,
+}
+
+
+def make_synthetic_data(n_bars, path=None, seed=0):
+    """
+    Creates random-walk ohlcv data in the format of the data/ csvs
+    INPUTS
+    n_bars: [Obligatory] number of bars. Up to 50000 they are business days, above that minute bars
+    path: [Optional, default = None] if provided, path of the .csv where the data is also saved
+    seed: [Optional, default = 0] seed of the random generator
+    """
+    rng = np.random.default_rng(seed)
+    freq = "B" if n_bars <= 50000 else "min"
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, n_bars)))
+    open_ = np.empty(n_bars)
+    open_[0] = 100
+    open_[1:] = close[:-1] * (1 + rng.normal(0, 0.002, n_bars - 1))
+    spread = np.abs(rng.normal(0, 0.005, n_bars))
+    df = pd.DataFrame(
+        {
+            "date": pd.date_range("2000-01-03", periods=n_bars, freq=freq),
+            "open": open_,
+            "high": np.maximum(open_, close) * (1 + spread),
+            "low": np.minimum(open_, close) * (1 - spread),
+            "close": close,
+            "volume": rng.integers(1000, 1000000, n_bars),
+        }
+    )
+    if path is not None:
+        df.to_csv(path, index=False)
+    return df
+
+
+def _resolve(name):
+    """Imports a "module:Class" name"""
+    if name is None:
+        return None
+    module, attr = name.split(":")
+    return getattr(importlib.import_module(module), attr)
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024.0 * 1024.0) if sys.platform == "darwin" else rss / 1024.0
+
+
+def _run_case(case, datapath, workdir, queue):
+    """Runs one benchmark case. It is executed in a fresh process so that the peak RSS is the case's own"""
+    try:
+        stage = case["stage"]
+        if stage in ("load_csv", "load_cached"):
+            from utils.basic import load_data
+
+            use_cache = stage == "load_cached"
+            if use_cache:
+                load_data(datapath)  # builds the cache, not timed
+            start = time.perf_counter()
+            load_data(datapath, use_cache=use_cache)
+            wall = time.perf_counter() - start
+        elif stage == "backtest":
+            from utils.basic import run_backtest_full
+
+            strategy = _resolve(case["strategy"])
+            logger = _resolve(case["logger"])
+            os.chdir(workdir)  # run_backtest_full logs into ../backtests
+            start = time.perf_counter()
+            log_path = run_backtest_full(
+                strategy=strategy,
+                datapath=datapath,
+                analyzers=[logger] if logger is not None else None,
+                custom_log_prefix="benchmark",
+                writer=case["writer"],
+                exactbars=case["exactbars"],
+            )
+            wall = time.perf_counter() - start
+            shutil.rmtree(log_path, ignore_errors=True)
+        elif stage in ("report_metrics", "report_html"):
+            from utils.basic import get_report_complete
+            from utils.metrics import get_report_metrics
+
+            df = pd.read_csv(datapath)
+            log_path = os.path.join(workdir, "report")
+            os.makedirs(log_path, exist_ok=True)
+            summary = df[["open", "high", "low", "close", "volume"]].copy()
+            summary["value"] = 100000 * df["close"] / df["close"].iloc[0]
+            summary["date"] = df["date"]
+            summary["close_returns"] = summary["close"].pct_change()
+            summary["value_returns"] = summary["value"].pct_change()
+            summary.to_csv(os.path.join(log_path, "summary.csv"))
+            start = time.perf_counter()
+            if stage == "report_metrics":
+                get_report_metrics(log_path)
+            else:
+                get_report_complete(log_path, html=True)
+            wall = time.perf_counter() - start
+        else:
+            raise ValueError("Unknown stage %s" % stage)
+        queue.put({"wall": wall, "peak_rss_mb": _peak_rss_mb(), "error": None})
+    except Exception as e:
+        queue.put({"wall": None, "peak_rss_mb": _peak_rss_mb(), "error": repr(e)})
+
+
+def measure_import_time(module="utils.basic", repeat=3):
+    """
+    Measures the time to import a module in a fresh interpreter, the best of several runs
+    INPUTS
+    module: [Optional, default = "utils.basic"] module to import
+    repeat: [Optional, default = 3] number of runs
+    """
+    code = (
+        "import sys, time; sys.path.append('../'); t = time.perf_counter(); "
+        "import %s; print(time.perf_counter() - t)" % module
+    )
+    times = list()
+    for _ in range(repeat):
+        out = subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True, check=True
+        )
+        times.append(float(out.stdout.strip().splitlines()[-1]))
+    return min(times)
+
+
+def check_imports(lazy_imports=None):
+    """
+    Imports every module in a fresh interpreter and lists the heavy dependencies it loaded although they should be
+    imported lazily. Unlike the import times, it does not depend on the machine or its load
+    INPUTS
+    lazy_imports: [Optional, default = None] dictionary of module to the modules it must not import. If None LAZY_IMPORTS
+    OUTPUT
+    dictionary of module to the forbidden modules found in sys.modules after importing it, empty if there are none
+    """
+    found = dict()
+    for module, forbidden in (lazy_imports or LAZY_IMPORTS).items():
+        code = (
+            "import sys, json; sys.path.append('../'); import %s; "
+            "print(json.dumps([m for m in %r if m in sys.modules]))" % (module, list(forbidden))
+        )
+        out = subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True, check=True
+        )
+        loaded = json.loads(out.stdout.strip().splitlines()[-1])
+        if loaded:
+            found[module] = loaded
+    return found
+
+
+def _wait_result(process, queue, timeout=None, poll=1.0):
+    """
+    Waits for the result of a case process. If it exits without posting one (e.g. killed for running out of memory)
+    or runs for longer than timeout seconds, an error result is returned instead of waiting forever
+    """
+    start = time.perf_counter()
+    while True:
+        try:
+            return queue.get(timeout=poll)
+        except queue_module.Empty:
+            pass
+        if not process.is_alive():
+            try:
+                # It may have posted its result right before exiting
+                return queue.get(timeout=poll)
+            except queue_module.Empty:
+                error = "case process exited with code %s without a result" % process.exitcode
+                break
+        if timeout is not None and time.perf_counter() - start > timeout:
+            process.terminate()
+            error = "case timed out after %.0f seconds" % timeout
+            break
+    return {"wall": None, "peak_rss_mb": None, "error": error}
+
+
+def _case_name(case):
+    parts = [case["stage"]]
+    if case["stage"] == "backtest":
+        parts.append(case["strategy"].split(":")[-1])
+        parts.append(case["logger"].split(":")[-1] if case["logger"] else "no-logger")
+        parts.append("exactbars=%s" % case["exactbars"])
+        parts.append("writer" if case["writer"] else "no-writer")
+    return "/".join(parts)
+
+
+def run_benchmarks(
+    n_bars=(10000, 100000),
+    strategies=DEFAULT_STRATEGIES,
+    loggers=DEFAULT_LOGGERS,
+    exactbars=(1, 0),
+    writers=(False, True),
+    html_max_bars=100000,
+    output_path=None,
+    case_timeout=None,
+):
+    """
+    Benchmarks every stage of the backtest pipeline on synthetic data. Each case runs in its own process
+    INPUTS
+    n_bars: [Optional, default = (10000, 100000)] data lengths to test
+    strategies: [Optional] strategies to test as "module:Class" names
+    loggers: [Optional] loggers to test as "module:Class" names, None for no logger
+    exactbars: [Optional, default = (1, 0)] exactbars modes to test
+    writers: [Optional, default = (False, True)] whether to test with and without the csv writer
+    html_max_bars: [Optional, default = 100000] the quantstats html report is only benchmarked up to this length
+    output_path: [Optional, default = None] if provided, path of the .json where the results are saved
+    case_timeout: [Optional, default = None] if provided, seconds after which a case is stopped and recorded as an error. A case whose process dies without a result is always recorded as an error
+    OUTPUT
+    dictionary with the machine metadata and one result per case: wall time, bars per second and peak RSS
+    """
+    ctx = mp.get_context("spawn")
+    results = list()
+    workdir = tempfile.mkdtemp(prefix="quant-benchmark-")
+    try:
+        for module in IMPORT_MODULES:
+            results.append(
+                {
+                    "case": "import/%s" % module,
+                    "n_bars": None,
+                    "wall": measure_import_time(module),
+                    "bars_per_second": None,
+                    "peak_rss_mb": None,
+                    "error": None,
+                }
+            )
+            print("[LOG] - import/%s: %.3fs" % (module, results[-1]["wall"]))
+        for n in n_bars:
+            datapath = os.path.join(workdir, "synthetic_%d.csv" % n)
+            make_synthetic_data(n, path=datapath)
+            cases = [{"stage": "load_csv"}, {"stage": "load_cached"}]
+            for strategy, logger, eb, writer in itertools.product(
+                strategies, loggers, exactbars, writers
+            ):
+                cases.append(
+                    {
+                        "stage": "backtest",
+                        "strategy": strategy,
+                        "logger": logger,
+                        "exactbars": eb,
+                        "writer": writer,
+                    }
+                )
+            cases.append({"stage": "report_metrics"})
+            if n <= html_max_bars:
+                cases.append({"stage": "report_html"})
+
+            for case in cases:
+                case_dir = tempfile.mkdtemp(dir=workdir)
+                os.makedirs(os.path.join(case_dir, "run"))
+                queue = ctx.Queue()
+                process = ctx.Process(
+                    target=_run_case,
+                    args=(case, datapath, os.path.join(case_dir, "run"), queue),
+                )
+                process.start()
+                result = _wait_result(process, queue, timeout=case_timeout)
+                process.join()
+                shutil.rmtree(case_dir, ignore_errors=True)
+                result.update(
+                    case=_case_name(case),
+                    n_bars=n,
+                    bars_per_second=n / result["wall"] if result["wall"] else None,
+                )
+                results.append(result)
+                print(
+                    "[LOG] - %s, %d bars: %s"
+                    % (
+                        result["case"],
+                        n,
+                        result["error"]
+                        or "%.3fs, %.0f bars/s, %.0f MB"
+                        % (result["wall"], result["bars_per_second"], result["peak_rss_mb"]),
+                    )
+                )
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count(),
+        },
+        "results": results,
+    }
+    if output_path is not None:
+        with open(output_path, "w") as f:
+            json.dump(report, f, indent=1)
+    return report
+
+
+def compare_benchmarks(current, baseline, threshold=0.2):
+    """
+    Compares two benchmark runs and flags the cases that got slower or use more memory
+    INPUTS
+    current: [Obligatory] results of run_benchmarks, or the path of its .json
+    baseline: [Obligatory] results to compare against, or the path of its .json
+    threshold: [Optional, default = 0.2] relative increase of wall time or peak RSS considered a regression
+    OUTPUT
+    DataFrame with both measures, their ratio and a regression flag per case
+    """
+    runs = list()
+    for run in (current, baseline):
+        if isinstance(run, str):
+            with open(run, "r") as f:
+                run = json.load(f)
+        df = pd.DataFrame(run["results"])
+        df["n_bars"] = df["n_bars"].fillna(0).astype(int)
+        runs.append(df.set_index(["case", "n_bars"])[["wall", "peak_rss_mb"]])
+    df = runs[0].join(runs[1], lsuffix="", rsuffix="_baseline", how="inner")
+    df["wall_ratio"] = df["wall"] / df["wall_baseline"]
+    df["rss_ratio"] = df["peak_rss_mb"] / df["peak_rss_mb_baseline"]
+    df["regression"] = (df["wall_ratio"] > 1 + threshold) | (
+        df["rss_ratio"] > 1 + threshold
+    )
+    return df
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the backtest pipeline")
+    parser.add_argument("--bars", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--strategies", nargs="+", default=list(DEFAULT_STRATEGIES))
+    parser.add_argument(
+        "--loggers",
+        nargs="+",
+        default=["none"] + [l for l in DEFAULT_LOGGERS if l is not None],
+    )
+    parser.add_argument("--exactbars", type=int, nargs="+", default=[1, 0])
+    parser.add_argument("--writer", choices=["both", "on", "off"], default="both")
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--baseline", default=None)
+    parser.add_argument("--threshold", type=float, default=0.2)
+    parser.add_argument("--case-timeout", type=float, default=None, help="seconds before a case is stopped")
+    parser.add_argument(
+        "--check-imports", action="store_true", help="only check that heavy dependencies are imported lazily"
+    )
+    args = parser.parse_args(argv)
+
+    eager = check_imports()
+    for module, loaded in eager.items():
+        print("[WARNING] - Importing %s imports %s" % (module, ", ".join(loaded)))
+    if args.check_imports:
+        if not eager:
+            print("[LOG] - Heavy dependencies are imported lazily")
+        return 1 if eager else 0
+
+    writers = {"both": (False, True), "on": (True,), "off": (False,)}[args.writer]
+    report = run_benchmarks(
+        n_bars=args.bars,
+        strategies=args.strategies,
+        loggers=[None if l == "none" else l for l in args.loggers],
+        exactbars=args.exactbars,
+        writers=writers,
+        output_path=args.output,
+        case_timeout=args.case_timeout,
+    )
+    print("[LOG] - Results saved in %s" % args.output)
+    if args.baseline is not None:
+        df = compare_benchmarks(report, args.baseline, threshold=args.threshold)
+        print(df.to_string())
+        if df["regression"].any():
+            print("[WARNING] - %d regressions found" % df["regression"].sum())
+            return 1
+    return 1 if eager else 0
+
+
+if __name__ == "__main__":
+    sys.path.append("../")
+    sys.exit(main())
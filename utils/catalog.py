@@ -0,0 +1,395 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import argparse
+import glob
+import json
+import os
+import re
+import sqlite3
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+sys.path.append("../")
+from utils.metrics import compute_metrics
+
+CATALOG_FILE = "catalog.sqlite"
+CATALOG_PATH = os.path.join("../backtests", CATALOG_FILE)
+
+METRIC_COLUMNS = (
+    "total_return",
+    "cagr",
+    "volatility",
+    "sharpe",
+    "sortino",
+    "max_drawdown",
+    "max_drawdown_duration",
+    "calmar",
+    "hit_rate",
+    "exposure",
+    "benchmark_total_return",
+    "benchmark_cagr",
+)
+
+RUN_COLUMNS = (
+    ("log_path", "TEXT PRIMARY KEY"),
+    ("folder", "TEXT"),
+    ("prefix", "TEXT"),
+    ("strategy", "TEXT"),
+    ("data", "TEXT"),
+    ("created_at", "TEXT"),
+    ("params", "TEXT"),
+    ("init_cash", "REAL"),
+    ("commission", "REAL"),
+    ("margin", "REAL"),
+    ("mult", "REAL"),
+    ("runtime", "REAL"),
+    ("run_key", "TEXT"),
+    ("final_value", "REAL"),
+    ("n_bars", "INTEGER"),
+    ("n_trades", "INTEGER"),
+    ("start_date", "TEXT"),
+    ("end_date", "TEXT"),
+    ("summary_mtime", "INTEGER"),
+    ("pruned", "INTEGER"),
+    ("prune_reason", "TEXT"),
+) + tuple((c, "REAL") for c in METRIC_COLUMNS)
+
+_COLUMN_NAMES = tuple(c for c, _ in RUN_COLUMNS)
+
+_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS runs (%s)" % ", ".join("%s %s" % c for c in RUN_COLUMNS),
+    "CREATE TABLE IF NOT EXISTS run_params (log_path TEXT, name TEXT, value TEXT, num REAL, PRIMARY KEY (log_path, name))",
+    "CREATE INDEX IF NOT EXISTS runs_strategy_data ON runs (strategy, data)",
+    "CREATE INDEX IF NOT EXISTS runs_strategy_sharpe ON runs (strategy, sharpe)",
+    "CREATE INDEX IF NOT EXISTS runs_sharpe ON runs (sharpe)",
+    "CREATE INDEX IF NOT EXISTS runs_created_at ON runs (created_at)",
+    "CREATE INDEX IF NOT EXISTS run_params_num ON run_params (name, num)",
+    "CREATE INDEX IF NOT EXISTS run_params_value ON run_params (name, value)",
+]
+
+
+def connect(catalog_path=CATALOG_PATH):
+    """
+    Opens the catalog, creating it if it does not exist. It can be written by many processes at once
+    INPUTS
+    catalog_path: [Optional, default = "../backtests/catalog.sqlite"] path of the SQLite file
+    """
+    folder = os.path.dirname(catalog_path)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder, exist_ok=True)
+    con = sqlite3.connect(catalog_path, timeout=30)
+    con.execute("PRAGMA journal_mode=WAL")
+    with con:
+        for statement in _SCHEMA:
+            con.execute(statement)
+        # Columns added after the catalog was created
+        existing = set(row[1] for row in con.execute("PRAGMA table_info(runs)"))
+        for name, kind in RUN_COLUMNS:
+            if name not in existing:
+                con.execute("ALTER TABLE runs ADD COLUMN %s %s" % (name, kind))
+    return con
+
+
+def _to_sql(value):
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.floating):
+        value = float(value)
+    if isinstance(value, float) and not np.isfinite(value):
+        return None
+    return value
+
+
+def _upsert(con, rows, params=None):
+    """Inserts or updates runs, keeping the stored value of the columns a row does not provide"""
+    for row in rows:
+        columns = [c for c in _COLUMN_NAMES if c in row]
+        con.execute(
+            "INSERT INTO runs (%s) VALUES (%s) ON CONFLICT(log_path) DO UPDATE SET %s"
+            % (
+                ", ".join(columns),
+                ", ".join("?" * len(columns)),
+                ", ".join("%s = COALESCE(excluded.%s, runs.%s)" % (c, c, c) for c in columns),
+            ),
+            [_to_sql(row[c]) for c in columns],
+        )
+        if params is not None and row["log_path"] in params:
+            con.execute("DELETE FROM run_params WHERE log_path = ?", (row["log_path"],))
+            con.executemany(
+                "INSERT INTO run_params VALUES (?, ?, ?, ?)",
+                [
+                    (
+                        row["log_path"],
+                        k,
+                        json.dumps(v, default=repr),
+                        float(v) if isinstance(v, (int, float, np.number)) else None,
+                    )
+                    for k, v in params[row["log_path"]].items()
+                ],
+            )
+
+
+def _summary_fields(log_path):
+    """Headline metrics, length and dates of the summary.csv of a run, empty if it has none"""
+    path = os.path.join(log_path, "summary.csv")
+    if not os.path.exists(path):
+        return dict()
+    df = pd.read_csv(path, usecols=lambda c: c in ("value", "date", "close_returns", "value_returns"))
+    fields = compute_metrics(
+        df["value_returns"].values, df["close_returns"].values
+    ).to_dict()
+    fields["n_bars"] = len(df)
+    fields["summary_mtime"] = os.stat(path).st_mtime_ns
+    if len(df):
+        fields["final_value"] = df["value"].values[-1]
+        fields["start_date"] = str(df["date"].values[0])[:10]
+        fields["end_date"] = str(df["date"].values[-1])[:10]
+    return fields
+
+
+def record_run(log_path, params=None, catalog_path=None, **fields):
+    """
+    Adds a run to the catalog or updates it. The metrics are computed from its summary.csv if it has one.
+    Fields not provided keep the value recorded before, so a run can be recorded in steps (by its logger and by run_backtest_full)
+    INPUTS
+    log_path: [Obligatory] the folder of the run, its key in the catalog
+    params: [Optional, default = None] dictionary with the parameters of the strategy, indexed for filtering
+    catalog_path: [Optional, default = None] path of the catalog. If None catalog.sqlite in the parent folder of log_path
+    fields: [Optional] other columns of RUN_COLUMNS, e.g. strategy, data, init_cash, runtime
+    """
+    if catalog_path is None:
+        catalog_path = os.path.join(os.path.dirname(os.path.normpath(log_path)), CATALOG_FILE)
+    row = dict(_parse_folder(log_path), **_summary_fields(log_path))
+    row.update((k, v) for k, v in fields.items() if v is not None)
+    row["log_path"] = os.path.normpath(log_path)
+    if params is not None:
+        row["params"] = json.dumps(params, default=repr, sort_keys=True)
+    con = connect(catalog_path)
+    try:
+        with con:
+            _upsert(con, [row], {row["log_path"]: params} if params is not None else None)
+    finally:
+        con.close()
+
+
+def _known_strategies():
+    """Names of the classes defined in strategies/ and utils/testers.py, used to split the folder names"""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    names = set()
+    for path in glob.glob(os.path.join(root, "strategies", "*.py")) + [
+        os.path.join(root, "utils", "testers.py")
+    ]:
+        try:
+            with open(path, "r") as f:
+                names.update(re.findall(r"^class (\w+)", f.read(), re.MULTILINE))
+        except OSError:
+            pass
+    return sorted(names, key=len, reverse=True)
+
+
+def _parse_folder(log_path, strategies=None):
+    """
+    Splits a folder name as created by run_backtest_full, [prefix_]strategy_data_isodate, into its parts.
+    The strategy is looked up among the known ones since names, prefixes and dates can all contain underscores
+    """
+    folder = os.path.basename(os.path.normpath(log_path))
+    parsed = {"folder": folder}
+    head, _, stamp = folder.rpartition("_")
+    try:
+        # Folders copied from Windows have their colons replaced by U+F03A
+        parsed["created_at"] = datetime.fromisoformat(stamp.replace("\uf03a", ":")).isoformat()
+    except ValueError:
+        return parsed
+    for strategy in strategies if strategies is not None else _known_strategies():
+        start = ("_" + head).find("_" + strategy + "_")
+        if start >= 0:
+            parsed["prefix"] = head[: max(start - 1, 0)] or None
+            parsed["strategy"] = strategy
+            parsed["data"] = head[start + len(strategy) + 1 :]
+            return parsed
+    # Unknown strategy: assume it has no underscores and the data name neither
+    parts = head.split("_")
+    if len(parts) >= 2:
+        parsed["data"] = parts[-1]
+        parsed["strategy"] = parts[-2]
+        parsed["prefix"] = "_".join(parts[:-2]) or None
+    return parsed
+
+
+def _count_lines(path):
+    try:
+        with open(path, "rb") as f:
+            return max(sum(block.count(b"\n") for block in iter(lambda: f.read(1 << 20), b"")) - 1, 0)
+    except OSError:
+        return None
+
+
+def backfill(backtests_path="../backtests", catalog_path=None, rebuild=False, batch_size=500):
+    """
+    Indexes the existing run folders of a backtests folder: the parts of their names and the metrics of their summary.csv.
+    Folders already in the catalog are skipped unless their summary.csv changed
+    INPUTS
+    backtests_path: [Optional, default = "../backtests"] folder with the runs
+    catalog_path: [Optional, default = None] path of the catalog. If None backtests_path/catalog.sqlite
+    rebuild: [Optional, default = False] whether to index again all the folders
+    batch_size: [Optional, default = 500] runs whose metrics are computed in a single vectorized pass and written in one transaction
+    OUTPUT
+    number of runs indexed
+    """
+    start = time.perf_counter()
+    if catalog_path is None:
+        catalog_path = os.path.join(backtests_path, CATALOG_FILE)
+    con = connect(catalog_path)
+    indexed = dict(con.execute("SELECT log_path, summary_mtime FROM runs").fetchall())
+    strategies = _known_strategies()
+
+    pending = list()
+    for folder in sorted(os.listdir(backtests_path)):
+        log_path = os.path.normpath(os.path.join(backtests_path, folder))
+        if folder.startswith(".") or not os.path.isdir(log_path):
+            continue
+        summary = os.path.join(log_path, "summary.csv")
+        mtime = os.stat(summary).st_mtime_ns if os.path.exists(summary) else None
+        if not rebuild and log_path in indexed and indexed[log_path] == mtime:
+            continue
+        pending.append((log_path, mtime))
+
+    n = 0
+    for i in range(0, len(pending), batch_size):
+        rows, value_returns, close_returns = list(), list(), list()
+        for log_path, mtime in pending[i : i + batch_size]:
+            row = dict(_parse_folder(log_path, strategies), log_path=log_path)
+            row["n_trades"] = _count_lines(os.path.join(log_path, "trades.csv"))
+            returns = (np.empty(0), np.empty(0))
+            if mtime is not None:
+                try:
+                    df = pd.read_csv(
+                        os.path.join(log_path, "summary.csv"),
+                        usecols=lambda c: c in ("value", "date", "close_returns", "value_returns"),
+                    )
+                    returns = (df["value_returns"].values, df["close_returns"].values)
+                    row.update(n_bars=len(df), summary_mtime=mtime)
+                    if len(df):
+                        row["final_value"] = df["value"].values[-1]
+                        row["start_date"] = str(df["date"].values[0])[:10]
+                        row["end_date"] = str(df["date"].values[-1])[:10]
+                except (ValueError, KeyError, pd.errors.ParserError) as e:
+                    print("[WARNING] - Could not read the summary of %s: %s" % (log_path, repr(e)))
+            rows.append(row)
+            value_returns.append(returns[0])
+            close_returns.append(returns[1])
+
+        length = max([len(v) for v in value_returns] + [1])
+        values = np.full((length, len(rows)), np.nan)
+        closes = np.full((length, len(rows)), np.nan)
+        for j, (v, c) in enumerate(zip(value_returns, close_returns)):
+            values[: len(v), j] = v
+            closes[: len(c), j] = c
+        metrics = compute_metrics(values, closes)
+        for j, row in enumerate(rows):
+            if len(value_returns[j]):
+                row.update(metrics.iloc[j].to_dict())
+        with con:
+            _upsert(con, rows)
+        n += len(rows)
+    con.close()
+    print(
+        "[LOG] - %d runs indexed in %.2f seconds" % (n, time.perf_counter() - start)
+    )
+    return n
+
+
+def query_runs(
+    strategy=None,
+    data=None,
+    params=None,
+    where=None,
+    args=(),
+    order_by="sharpe",
+    ascending=False,
+    limit=None,
+    catalog_path=CATALOG_PATH,
+):
+    """
+    Finds and ranks runs of the catalog, e.g. query_runs("TaLib_SMACross", "aapl", limit=10) for the 10 best Sharpe ratios
+    INPUTS
+    strategy: [Optional, default = None] name of the strategy
+    data: [Optional, default = None] part of the data name, e.g. "aapl"
+    params: [Optional, default = None] dictionary of strategy parameters the runs must have, e.g. {"maperiod": 15}
+    where: [Optional, default = None] extra SQL condition on the columns of RUN_COLUMNS, e.g. "n_trades > ?"
+    args: [Optional, default = ()] values of the ? of where
+    order_by: [Optional, default = "sharpe"] column to rank by. Runs without it go last
+    ascending: [Optional, default = False] whether to rank ascending
+    limit: [Optional, default = None] maximum number of runs returned
+    catalog_path: [Optional, default = "../backtests/catalog.sqlite"] path of the catalog
+    OUTPUT
+    DataFrame with one row per run
+    """
+    if order_by not in _COLUMN_NAMES:
+        raise ValueError("Parameter order_by must be one of %s" % ", ".join(_COLUMN_NAMES))
+    conditions, values = list(), list()
+    if strategy is not None:
+        conditions.append("strategy = ?")
+        values.append(strategy)
+    if data is not None:
+        conditions.append("data LIKE ?")
+        values.append("%" + data + "%")
+    for name, value in (params or {}).items():
+        if isinstance(value, (int, float, np.number)):
+            match, value = "num = ?", float(value)
+        else:
+            match, value = "value = ?", json.dumps(value, default=repr)
+        conditions.append(
+            "log_path IN (SELECT log_path FROM run_params WHERE name = ? AND %s)" % match
+        )
+        values.extend([name, value])
+    if where is not None:
+        conditions.append("(%s)" % where)
+        values.extend(args)
+    sql = "SELECT * FROM runs"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += " ORDER BY %s IS NULL, %s %s" % (order_by, order_by, "ASC" if ascending else "DESC")
+    if limit is not None:
+        sql += " LIMIT %d" % limit
+    con = connect(catalog_path)
+    try:
+        return pd.read_sql_query(sql, con, params=values)
+    finally:
+        con.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Index and query the backtests catalog")
+    parser.add_argument("command", choices=["backfill", "query"])
+    parser.add_argument("--path", default="../backtests", help="backtests folder")
+    parser.add_argument("--rebuild", action="store_true")
+    parser.add_argument("--strategy", default=None)
+    parser.add_argument("--data", default=None)
+    parser.add_argument("--order-by", default="sharpe")
+    parser.add_argument("--ascending", action="store_true")
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    catalog_path = os.path.join(args.path, CATALOG_FILE)
+    if args.command == "backfill":
+        backfill(args.path, catalog_path=catalog_path, rebuild=args.rebuild)
+    else:
+        df = query_runs(
+            args.strategy,
+            args.data,
+            order_by=args.order_by,
+            ascending=args.ascending,
+            limit=args.limit,
+            catalog_path=catalog_path,
+        )
+        print(df[["folder", "strategy", "data", args.order_by, "final_value"]].to_string())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
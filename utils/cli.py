@@ -0,0 +1,268 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import argparse
+import importlib
+import json
+import os
+import sys
+
+# Only the standard library is imported here, every command imports what it needs when it runs,
+# so that `quant --help` and argument errors are instant
+
+
+def _path(value):
+    """Paths given in the command line are relative to the folder it is run from"""
+    return os.path.abspath(value)
+
+
+def _json(value):
+    try:
+        return json.loads(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError("invalid JSON %r: %s" % (value, e))
+
+
+def resolve(name, default_module="strategies"):
+    """
+    Imports a strategy or analyzer given as "module:Class", or as the name of a file of strategies/ defining a class
+    of the same name (e.g. TaLib_SMACross), or as a class of utils.testers or utils.loggers
+    """
+    if ":" in name:
+        module, attr = name.split(":")
+        return getattr(importlib.import_module(module), attr)
+    for module in ("%s.%s" % (default_module, name), "utils.testers", "utils.loggers"):
+        try:
+            return getattr(importlib.import_module(module), name)
+        except (ImportError, AttributeError):
+            continue
+    raise ValueError("%s not found, use module:Class" % name)
+
+
+def class_name(cls):
+    """
+    "module:Class" name of a strategy or analyzer, the inverse of resolve. Names are returned as they are
+    """
+    if isinstance(cls, str):
+        return cls
+    if cls.__module__ == "__main__":
+        raise ValueError(
+            "%s is defined in __main__, other processes can not import it. Move it to a module" % cls.__name__
+        )
+    return "%s:%s" % (cls.__module__, cls.__name__)
+
+
+def _backtest(args):
+    from utils.basic import get_report_complete, run_backtest_full
+
+    log_path = run_backtest_full(
+        strategy=resolve(args.strategy),
+        datapath=args.data or "../data/us/daily/aapl.csv",
+        strategy_params=args.params,
+        analyzers=[resolve(a) for a in args.analyzers] or None,
+        custom_log_prefix=args.prefix,
+        init_cash=args.cash,
+        commission=args.commission,
+        exactbars=args.exactbars,
+        profile=args.profile,
+        cache=args.cache,
+        catalog=not args.no_catalog,
+        prune=args.prune,
+    )
+    print("[LOG] - Results in %s" % os.path.abspath(log_path))
+    if args.report:
+        get_report_complete(log_path, html=True)
+    return 0
+
+
+def _sweep(args):
+    from utils.sweeps import run_sweep
+
+    results = run_sweep(
+        strategy=resolve(args.strategy),
+        param_grid=args.grid,
+        datapath=args.data or "../data/us/daily/aapl.csv",
+        processes=args.processes,
+        chunksize=args.chunksize,
+        init_cash=args.cash,
+        commission=args.commission,
+        results_path=args.output,
+        cache=args.cache,
+        prune=args.prune,
+    )
+    if args.sort_by in results.columns:
+        results = results.sort_values(args.sort_by, ascending=False)
+    print(results.head(args.top).to_string())
+    return 0
+
+
+def _report(args):
+    if args.html or args.console:
+        from utils.basic import get_report_complete
+
+        get_report_complete(args.log_path, html=args.html, console=args.console)
+        if args.html:
+            print("[LOG] - Report saved in %s" % os.path.join(args.log_path, "full_report.html"))
+    else:
+        from utils.metrics import get_report_metrics
+
+        metrics = get_report_metrics(args.log_path, periods=args.periods, rf=args.rf)
+        print(metrics.to_string())
+    return 0
+
+
+def _fetch(args):
+    path = args.path or "../data/us/daily"
+    if args.period is not None:
+        from utils.basic import get_stock_data
+
+        get_stock_data(args.tickers, path, period=args.period, in_conflict_keep=args.keep)
+    else:
+        from utils.downloader import update_stock_data
+
+        update_stock_data(
+            args.tickers,
+            path,
+            date_start=args.start,
+            date_end=args.end,
+            in_conflict_keep=args.keep,
+            max_workers=args.workers,
+        )
+    return 0
+
+
+def _jobs(args):
+    from utils import jobqueue
+
+    queue_path = args.queue or jobqueue.QUEUE_PATH
+    if args.action == "enqueue":
+        if args.strategy is None:
+            raise ValueError("enqueue needs --strategy")
+        settings = dict(init_cash=args.cash, commission=args.commission)
+        if args.prune is not None:
+            settings["prune"] = args.prune
+        jobqueue.enqueue(
+            class_name(resolve(args.strategy)),
+            param_grid=args.grid,
+            datapath=args.data or ["../data/us/daily/aapl.csv"],
+            sweep=args.sweep,
+            kind=args.kind,
+            analyzers=args.analyzers if args.kind == "full" else None,
+            max_attempts=args.max_attempts,
+            queue_path=queue_path,
+            **settings
+        )
+    elif args.action == "work":
+        jobqueue.run_workers(
+            args.workers,
+            queue_path=queue_path,
+            sweep=args.sweep,
+            lease=args.lease,
+            exit_when_empty=not args.wait,
+        )
+    elif args.action == "progress":
+        print(jobqueue.progress(args.sweep, queue_path=queue_path).to_string())
+    elif args.action == "results":
+        if args.sweep is None:
+            raise ValueError("results needs --sweep")
+        df = jobqueue.results(args.sweep, queue_path=queue_path)
+        if args.output is not None:
+            df.to_csv(args.output)
+        print(df.to_string())
+    else:
+        n = jobqueue.retry(args.sweep, queue_path=queue_path)
+        print("[LOG] - %d failed jobs sent back to pending" % n)
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="quant", description="Run backtests, parameter sweeps, reports and downloads"
+    )
+    commands = parser.add_subparsers(dest="command", metavar="command")
+    commands.required = True
+
+    def add_run_arguments(p):
+        p.add_argument("strategy", help="module:Class, a file of strategies/ or a class of utils.testers")
+        p.add_argument("--data", type=_path, default=None, help="csv of the asset, ../data/us/daily/aapl.csv by default")
+        p.add_argument("--cash", type=float, default=100000.0)
+        p.add_argument("--commission", type=float, default=0.0)
+        p.add_argument("--cache", action="store_true", help="reuse identical earlier runs (see utils.runcache)")
+        p.add_argument("--prune", type=_json, default=None, help='RiskMonitor rules, e.g. \'{"max_drawdown_frac": 0.4}\' for 40%')
+
+    p = commands.add_parser("backtest", help="run a backtest, see utils.basic.run_backtest_full")
+    add_run_arguments(p)
+    p.add_argument("--params", type=_json, default=None, help='strategy parameters, e.g. \'{"maperiodf": 10}\'')
+    p.add_argument("--analyzers", nargs="*", default=["Logger01"], help="Logger01 by default")
+    p.add_argument("--prefix", default=None, help="prefix of the results folder")
+    p.add_argument("--exactbars", type=int, default=1)
+    p.add_argument("--profile", action="store_true")
+    p.add_argument("--no-catalog", action="store_true", help="do not record the run in the catalog")
+    p.add_argument("--report", action="store_true", help="also build the quantstats html report")
+    p.set_defaults(func=_backtest)
+
+    p = commands.add_parser("sweep", help="run a parameter grid in parallel, see utils.sweeps.run_sweep")
+    add_run_arguments(p)
+    p.add_argument("--grid", type=_json, required=True, help='e.g. \'{"maperiodf": [5, 10, 20]}\'')
+    p.add_argument("--processes", type=int, default=None)
+    p.add_argument("--chunksize", type=int, default=1)
+    p.add_argument("--output", type=_path, default=None, help="csv where the results are also saved")
+    p.add_argument("--sort-by", default="sharpe")
+    p.add_argument("--top", type=int, default=20, help="rows printed")
+    p.set_defaults(func=_sweep)
+
+    p = commands.add_parser("report", help="statistics or quantstats report of a backtest")
+    p.add_argument("log_path", type=_path, help="folder of the backtest, with its summary.csv")
+    p.add_argument("--html", action="store_true", help="quantstats html report, saved in log_path")
+    p.add_argument("--console", action="store_true", help="quantstats report in the console")
+    p.add_argument("--periods", type=int, default=252)
+    p.add_argument("--rf", type=float, default=0.0)
+    p.set_defaults(func=_report)
+
+    p = commands.add_parser("fetch", help="download or update ticker csvs")
+    p.add_argument("tickers", nargs="+")
+    p.add_argument("--path", type=_path, default=None, help="../data/us/daily by default")
+    p.add_argument("--start", default=None, help="YYYY-MM-DD, after the last date on disk by default")
+    p.add_argument("--end", default=None)
+    p.add_argument("--period", default=None, help="yfinance period (1y, 5y, max...) instead of dates")
+    p.add_argument("--keep", choices=["old", "new"], default="old", help="bar kept when a date is already on disk")
+    p.add_argument("--workers", type=int, default=8)
+    p.set_defaults(func=_fetch)
+
+    p = commands.add_parser("jobs", help="queue backtests for workers on any node, see utils.jobqueue")
+    p.add_argument("action", choices=["enqueue", "work", "progress", "results", "retry"])
+    p.add_argument("--queue", type=_path, default=None, help="../backtests/jobs.sqlite by default")
+    p.add_argument("--sweep", default=None, help="name of the group of jobs")
+    p.add_argument("--strategy", default=None, help="enqueue: as in backtest")
+    p.add_argument("--grid", type=_json, default=None, help="enqueue: as in sweep, one job per combination")
+    p.add_argument("--data", type=_path, nargs="+", default=None, help="enqueue: csvs, the grid is added for each one")
+    p.add_argument("--kind", choices=["full", "metrics"], default="full")
+    p.add_argument("--analyzers", nargs="*", default=["Logger01"], help="enqueue: analyzers of full jobs")
+    p.add_argument("--cash", type=float, default=100000.0)
+    p.add_argument("--commission", type=float, default=0.0)
+    p.add_argument("--prune", type=_json, default=None)
+    p.add_argument("--max-attempts", type=int, default=3)
+    p.add_argument("--workers", type=int, default=1, help="work: local worker processes")
+    p.add_argument("--lease", type=float, default=600, help="work: seconds before a silent worker's job is retried")
+    p.add_argument("--wait", action="store_true", help="work: keep waiting for jobs when the queue is empty")
+    p.add_argument("--output", type=_path, default=None, help="results: csv where they are saved")
+    p.set_defaults(func=_jobs)
+    return parser
+
+
+def main(argv=None, workdir=None):
+    """
+    Entry point of the quant script
+    INPUTS
+    argv: [Optional, default = None] command line arguments. If None sys.argv
+    workdir: [Optional, default = None] folder the commands run from, where the default ../ paths resolve. Paths in
+    argv are resolved before moving there
+    """
+    args = build_parser().parse_args(argv)
+    if workdir is not None:
+        os.chdir(workdir)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.path.append("../")
+    sys.exit(main())
@@ -0,0 +1,164 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import json
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+CACHE_FOLDER = ".columnar"
+META_FILE = "meta.json"
+DATE_COLUMN = "date"
+
+
+def get_cache_path(datapath):
+    """
+    Returns the folder where the columnar cache of a csv is stored. It lives next to the csv, in a .columnar folder
+    INPUTS
+    datapath: [Obligatory] path of the source csv
+    """
+    folder, name = os.path.split(os.path.abspath(datapath))
+    return os.path.join(folder, CACHE_FOLDER, os.path.splitext(name)[0])
+
+
+def _source_signature(datapath):
+    stat = os.stat(datapath)
+    return {"source_size": stat.st_size, "source_mtime_ns": stat.st_mtime_ns}
+
+
+def _read_meta(cache_path):
+    try:
+        with open(os.path.join(cache_path, META_FILE), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _atomic_write(path, write):
+    folder = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(dir=folder, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def is_cache_valid(datapath):
+    """
+    Whether the columnar cache of a csv exists and was built from its current version
+    INPUTS
+    datapath: [Obligatory] path of the source csv
+    """
+    meta = _read_meta(get_cache_path(datapath))
+    if meta is None:
+        return False
+    signature = _source_signature(datapath)
+    return all(meta.get(k) == v for k, v in signature.items())
+
+
+def build_cache(datapath):
+    """
+    Parses a csv once and stores every column as a typed binary array. The date column is stored as int64 nanoseconds
+    INPUTS
+    datapath: [Obligatory] path of the source csv. Must contain a date column
+    """
+    signature = _source_signature(datapath)
+    df = pd.read_csv(datapath)
+    cache_path = get_cache_path(datapath)
+    if not os.path.exists(cache_path):
+        os.makedirs(cache_path, exist_ok=True)
+
+    columns = list()
+    for i, column in enumerate(df.columns):
+        if column == DATE_COLUMN:
+            values = pd.to_datetime(df[column]).values.astype("datetime64[ns]")
+            values = values.view(np.int64)
+        elif df[column].dtype.kind in "biuf":
+            values = df[column].values
+        else:
+            values = df[column].astype(str).values.astype(str)
+        file_name = "%d.npy" % i
+        _atomic_write(
+            os.path.join(cache_path, file_name),
+            lambda f, values=values: np.save(f, values, allow_pickle=False),
+        )
+        columns.append({"name": column, "file": file_name, "dtype": str(values.dtype)})
+
+    meta = dict(signature, columns=columns, n_rows=len(df))
+    # Written last, so a cache is only valid once all its columns are in place
+    _atomic_write(
+        os.path.join(cache_path, META_FILE),
+        lambda f: f.write(json.dumps(meta).encode("utf-8")),
+    )
+    return cache_path
+
+
+def load_columns(datapath, rebuild=True):
+    """
+    Returns the columns of a csv as memory-mapped arrays, building or refreshing the cache when needed
+    INPUTS
+    datapath: [Obligatory] path of the source csv
+    rebuild: [Optional, default = True] whether to rebuild the cache if it is missing or stale. If False a stale cache raises an error
+    OUTPUT
+    dictionary of column name to read-only array, in the order of the csv. The date column holds int64 nanoseconds
+    """
+    if not is_cache_valid(datapath):
+        if not rebuild:
+            raise FileNotFoundError("No valid columnar cache for %s" % datapath)
+        build_cache(datapath)
+    cache_path = get_cache_path(datapath)
+    meta = _read_meta(cache_path)
+    return {
+        c["name"]: np.load(os.path.join(cache_path, c["file"]), mmap_mode="r")
+        for c in meta["columns"]
+    }
+
+
+def load_ohlcv(datapath, rebuild=True):
+    """
+    Loads a csv as a DataFrame from its columnar cache, with the date column already converted to datetime
+    INPUTS
+    datapath: [Obligatory] path of the source csv
+    rebuild: [Optional, default = True] whether to rebuild the cache if it is missing or stale
+    """
+    columns = load_columns(datapath, rebuild=rebuild)
+    data = dict()
+    for name, values in columns.items():
+        if name == DATE_COLUMN:
+            data[name] = pd.DatetimeIndex(np.asarray(values).view("datetime64[ns]"))
+        else:
+            data[name] = np.asarray(values)
+    return pd.DataFrame(data)
+
+
+def build_store(path="../data", verbose=True):
+    """
+    Builds or refreshes the columnar cache of every csv under a folder
+    INPUTS
+    path: [Optional, default = "../data"] root folder to search recursively
+    verbose: [Optional, default = True] whether to print the files that were rebuilt
+    OUTPUT
+    list with the paths of the csvs whose cache was rebuilt
+    """
+    rebuilt = list()
+    for root, dirs, files in os.walk(path):
+        dirs[:] = [d for d in dirs if d != CACHE_FOLDER]
+        for f in sorted(files):
+            if not f.lower().endswith(".csv"):
+                continue
+            datapath = os.path.join(root, f)
+            if is_cache_valid(datapath):
+                continue
+            try:
+                build_cache(datapath)
+                rebuilt.append(datapath)
+                if verbose:
+                    print("[LOG] - Cached %s" % datapath)
+            except Exception as e:
+                print("[WARNING] - Could not cache %s: %s" % (datapath, repr(e)))
+    return rebuilt
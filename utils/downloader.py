@@ -0,0 +1,314 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+
+class DataProvider(object):
+    """
+    Interface of the market data sources used by update_stock_data
+    """
+
+    def fetch(self, ticker, start=None, end=None):
+        """
+        Returns the ohlcv data of a ticker as a DataFrame indexed by date, with lowercase column names
+        INPUTS
+        ticker: [Obligatory] ticker to download
+        start: [Optional, default = None] first date as 'YYYY-MM-DD'. If None the whole history is returned
+        end: [Optional, default = None] date as 'YYYY-MM-DD' up to which (excluded) data is returned. If None up to the latest
+        """
+        raise NotImplementedError
+
+
+class YahooProvider(DataProvider):
+    """
+    Downloads data from Yahoo Finance with yfinance
+    """
+
+    def __init__(self, interval="1d", period="max"):
+        """
+        INPUTS
+        interval: [Optional, default = "1d"] bar size, as accepted by yfinance
+        period: [Optional, default = "max"] range downloaded when no start date is given
+        """
+        self.interval = interval
+        self.period = period
+
+    def fetch(self, ticker, start=None, end=None):
+        import yfinance as yf
+
+        if start is None:
+            data = yf.download(
+                tickers=ticker,
+                period=self.period,
+                interval=self.interval,
+                progress=False,
+                threads=False,
+            )
+        else:
+            data = yf.download(
+                tickers=ticker,
+                start=start,
+                end=end,
+                interval=self.interval,
+                progress=False,
+                threads=False,
+            )
+        if isinstance(data.columns, pd.MultiIndex):
+            data.columns = data.columns.get_level_values(0)
+        data.columns = [c.lower() for c in data.columns]
+        data.index.name = "date"
+        return data
+
+
+class CsvProvider(DataProvider):
+    """
+    Serves data from a folder of local csvs (path/TICKER.csv). Stand-in of a remote provider for tests and offline work
+    """
+
+    def __init__(self, path):
+        """
+        INPUTS
+        path: [Obligatory] folder with the csvs, which must have a date column
+        """
+        self.path = path
+
+    def fetch(self, ticker, start=None, end=None):
+        data = pd.read_csv(
+            os.path.join(self.path, ticker.upper() + ".csv"), index_col=0
+        )
+        data.index = pd.to_datetime(data.index)
+        data.index.name = "date"
+        if start is not None:
+            data = data[data.index >= pd.Timestamp(start)]
+        if end is not None:
+            data = data[data.index < pd.Timestamp(end)]
+        return data
+
+
+class _RateLimiter(object):
+    """Spaces out calls so that at most rate of them start per second, across threads"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.lock = threading.Lock()
+        self.next_time = 0.0
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            wait = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+def _read_header(data_path):
+    with open(data_path, "r") as f:
+        return f.readline().strip().split(",")
+
+
+def _last_date(data_path):
+    """
+    Last date of a csv, read from its tail without parsing the whole file. None if it has no rows, ValueError if the
+    last one does not start with a date
+    """
+    with open(data_path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        offset = max(0, size - 4096)
+        f.seek(offset)
+        lines = f.read().splitlines()
+    for i in range(len(lines) - 1, -1, -1):
+        line = lines[i].strip()
+        if not line:
+            continue
+        if offset == 0 and i == 0:
+            # Only the header
+            return None
+        return _naive(pd.Timestamp(line.split(b",")[0].decode("utf-8")))
+    return None
+
+
+def _naive(dates):
+    """Dates, or a date, without their timezone, keeping the local time. Files and providers may have it or not"""
+    return dates.tz_localize(None) if dates.tz is not None else dates
+
+
+def _atomic_replace(data_path, write):
+    """Writes a file through a temporary file in the same folder, so readers never see it half written"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(data_path) or ".", suffix=".tmp")
+    os.close(fd)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, data_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _fetch_with_retries(provider, ticker, start, end, retries, backoff, limiter):
+    for attempt in range(retries + 1):
+        limiter.wait()
+        try:
+            return provider.fetch(ticker, start=start, end=end)
+        except Exception:
+            if attempt == retries:
+                raise
+            time.sleep(backoff * 2**attempt)
+
+
+def _update_ticker(
+    ticker, path, provider, date_start, date_end, in_conflict_keep, retries, backoff, limiter
+):
+    data_path = os.path.join(path, ticker.upper() + ".csv")
+    exists = os.path.exists(data_path)
+    merge = False
+    try:
+        last = _last_date(data_path) if exists else None
+    except ValueError as e:
+        # Without the last date the new rows can not be told apart, the whole file is parsed and merged instead
+        print(
+            "[WARNING] - Could not read the last date of %s, it will be rewritten: %s"
+            % (data_path, repr(e))
+        )
+        last, merge = None, True
+
+    start = date_start
+    if last is not None and (start is None or pd.Timestamp(start) <= last):
+        start = (last + timedelta(days=1)).strftime("%Y-%m-%d")
+    if start is not None and date_end is not None and start >= date_end:
+        return {"ticker": ticker, "status": "up-to-date", "new_rows": 0}
+
+    data = _fetch_with_retries(provider, ticker, start, date_end, retries, backoff, limiter)
+    data.index = _naive(pd.DatetimeIndex(data.index, name="date"))
+    if last is not None:
+        data = data[data.index > last]
+    if len(data) == 0:
+        return {"ticker": ticker, "status": "up-to-date", "new_rows": 0}
+
+    if not exists:
+        _atomic_replace(data_path, lambda p: data.to_csv(p, index_label="date"))
+        return {"ticker": ticker, "status": "created", "new_rows": len(data)}
+
+    header = _read_header(data_path)
+    if not merge and set(header[1:]) <= set(data.columns):
+        # Only new dates: copy the old file and append, no need to parse it
+        data = data.reindex(columns=header[1:])
+        new_rows = len(data)
+
+        def write(tmp_path):
+            shutil.copyfile(data_path, tmp_path)
+            with open(tmp_path, "rb+") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    f.write(b"\n")
+            data.to_csv(tmp_path, mode="a", header=False)
+
+    else:
+        old_df = pd.read_csv(data_path, index_col=0)
+        # Rows without a valid date (e.g. a truncated last line) are dropped
+        old_df.index = pd.to_datetime(old_df.index, errors="coerce")
+        old_df = old_df[old_df.index.notna()]
+        old_df.index = _naive(old_df.index)
+        if in_conflict_keep == "old":
+            final = old_df.combine_first(data)
+        else:
+            final = data.combine_first(old_df)
+        new_rows = len(final) - len(old_df)
+
+        def write(tmp_path):
+            final.to_csv(tmp_path, index_label="date")
+
+    _atomic_replace(data_path, write)
+    return {"ticker": ticker, "status": "updated", "new_rows": new_rows}
+
+
+def update_stock_data(
+    tickers,
+    path,
+    provider=None,
+    date_start=None,
+    date_end=None,
+    in_conflict_keep="old",
+    max_workers=8,
+    retries=3,
+    backoff=1.0,
+    rate_limit=None,
+):
+    """
+    Incrementally updates a folder of ticker csvs, downloading for each one only the dates after the last one on disk
+    INPUTS
+    tickers: [Obligatory] array of tickers to update
+    path: [Obligatory] folder path where the csvs are saved as TICKER.csv, existing or not
+    provider: [Optional, default = None] the DataProvider to download from. If None YahooProvider() is used
+    date_start: [Optional, default = None] first data date as 'YYYY-MM-DD' for tickers without a csv yet. If None the maximum will be chosen
+    date_end: [Optional, default = None] date as 'YYYY-MM-DD' up to which (excluded) data is downloaded. If None up to the latest
+    in_conflict_keep: [Optional, default = "old"] "old" or "new". If the existing csv has columns the provider does not return, the files are merged and this decides which data is kept
+    max_workers: [Optional, default = 8] number of concurrent downloads
+    retries: [Optional, default = 3] times a failed download is retried, with exponential backoff
+    backoff: [Optional, default = 1.0] seconds waited before the first retry
+    rate_limit: [Optional, default = None] maximum number of requests started per second. None for no limit
+    OUTPUT
+    DataFrame with the status ("created", "updated", "up-to-date" or "failed"), new rows and error of every ticker
+    """
+    if in_conflict_keep not in ("old", "new"):
+        raise ValueError(
+            'Parameter in_conflict_keep can only have two values: "old" or "new"'
+        )
+    if provider is None:
+        provider = YahooProvider()
+    if not os.path.exists(path):
+        os.makedirs(path)
+    if date_end is None:
+        date_end = (datetime.now() + timedelta(days=1)).strftime("%Y-%m-%d")
+    limiter = _RateLimiter(rate_limit)
+
+    rows = list()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(
+                _update_ticker,
+                ticker,
+                path,
+                provider,
+                date_start,
+                date_end,
+                in_conflict_keep,
+                retries,
+                backoff,
+                limiter,
+            ): ticker
+            for ticker in tickers
+        }
+        for future in as_completed(futures):
+            try:
+                row = future.result()
+                row["error"] = None
+            except Exception as e:
+                row = {
+                    "ticker": futures[future],
+                    "status": "failed",
+                    "new_rows": 0,
+                    "error": repr(e),
+                }
+                print("[WARNING] - %s failed: %s" % (row["ticker"], row["error"]))
+            rows.append(row)
+
+    df = pd.DataFrame(rows, columns=["ticker", "status", "new_rows", "error"])
+    print(
+        "[LOG] - %d tickers updated in %.2f seconds, %d failed"
+        % (len(df), time.perf_counter() - start, (df["status"] == "failed").sum())
+    )
+    return df.sort_values("ticker").reset_index(drop=True)
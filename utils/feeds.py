@@ -0,0 +1,60 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import sys
+
+import numpy as np
+
+sys.path.append("../libraries/backtrader")
+import backtrader as bt
+
+
+def dates_to_num(dates):
+    """
+    Converts datetimes (DatetimeIndex or datetime64 array) into backtrader date numbers, for all the bars at once
+    """
+    # backtrader date numbers are proleptic Gregorian ordinals, 719163 is 1970-01-01
+    ns = np.asarray(dates, dtype="datetime64[ns]").astype(np.int64)
+    return 719163 + ns / 86400e9
+
+
+class ArrayData(bt.feed.DataBase):
+    """
+    Data feed reading its bars straight from arrays, e.g. the columns of a utils.panel.Panel, without building a DataFrame.
+    Bars with a NaN close (dates in which the asset did not trade) are skipped
+    """
+
+    params = (
+        ("dates", None),
+        ("open", None),
+        ("high", None),
+        ("low", None),
+        ("close", None),
+        ("volume", None),
+    )
+
+    def start(self):
+        super(ArrayData, self).start()
+        if self.p.dates is None or self.p.close is None:
+            raise ValueError("Parameters dates and close must be provided")
+        close = self.p.close
+        self._rows = np.flatnonzero(~np.isnan(close))
+        self._i = -1
+        # Missing ohlv columns default to the close, missing volume to 0
+        self._open = self.p.open if self.p.open is not None else close
+        self._high = self.p.high if self.p.high is not None else close
+        self._low = self.p.low if self.p.low is not None else close
+        self._volume = self.p.volume
+
+    def _load(self):
+        self._i += 1
+        if self._i >= len(self._rows):
+            return False
+        row = self._rows[self._i]
+        self.lines.datetime[0] = self.p.dates[row]
+        self.lines.open[0] = self._open[row]
+        self.lines.high[0] = self._high[row]
+        self.lines.low[0] = self._low[row]
+        self.lines.close[0] = self.p.close[row]
+        self.lines.volume[0] = self._volume[row] if self._volume is not None else 0.0
+        self.lines.openinterest[0] = 0.0
+        return True
@@ -0,0 +1,191 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+MANIFEST_FILE = ".fetch-manifest.json"
+PART_SUFFIX = ".part"
+
+
+def make_session(pool_size=8):
+    """
+    Returns a requests session whose connection pool is shared by all the downloads
+    INPUTS
+    pool_size: [Optional, default = 8] connections kept open per host, should match the number of workers
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def _load_manifest(path):
+    try:
+        with open(os.path.join(path, MANIFEST_FILE), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return dict()
+
+
+def _save_manifest(path, manifest):
+    fd, tmp_path = tempfile.mkstemp(dir=path, suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, os.path.join(path, MANIFEST_FILE))
+
+
+def _is_unchanged(session, url, file_path, record, timeout):
+    """Whether the remote file is the one already on disk, by ETag/Last-Modified or else by size"""
+    if record is None or record.get("url") != url or not os.path.exists(file_path):
+        return False
+    headers = dict()
+    if record.get("etag"):
+        headers["If-None-Match"] = record["etag"]
+    if record.get("last_modified"):
+        headers["If-Modified-Since"] = record["last_modified"]
+    response = session.head(url, headers=headers, timeout=timeout, allow_redirects=True)
+    if response.status_code == 304:
+        return True
+    if response.status_code != 200:
+        return False
+    etag = response.headers.get("ETag")
+    if etag and record.get("etag"):
+        return etag == record["etag"]
+    size = response.headers.get("Content-Length")
+    return size is not None and int(size) == os.path.getsize(file_path) == record.get(
+        "size"
+    )
+
+
+def _fetch_one(session, url, name, path, record, chunk_size, timeout, on_partial):
+    file_path = os.path.join(path, name)
+    if _is_unchanged(session, url, file_path, record, timeout):
+        return "unchanged", record
+
+    part_path = file_path + PART_SUFFIX
+    headers = dict()
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    # A partial download is only resumed if it was for the same url, and with a validator (If-Range): the server
+    # then sends the whole file again (200) instead of the rest (206) if it changed. Without one it restarts
+    if offset and record is not None and record.get("partial_url") == url:
+        validator = record.get("partial_etag") or record.get("partial_last_modified")
+        if validator:
+            headers["Range"] = "bytes=%d-" % offset
+            headers["If-Range"] = validator
+
+    with session.get(url, headers=headers, stream=True, timeout=timeout) as response:
+        if response.status_code == 416:
+            # The range is not satisfiable, the partial file is not usable
+            response.close()
+            return _fetch_one(
+                session, url, name, path, None, chunk_size, timeout, on_partial
+            )
+        response.raise_for_status()
+        resumed = response.status_code == 206
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        on_partial(
+            {"partial_url": url, "partial_etag": etag, "partial_last_modified": last_modified}
+        )
+        with open(part_path, "ab" if resumed else "wb") as f:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                if chunk:
+                    f.write(chunk)
+
+    os.replace(part_path, file_path)
+    record = {
+        "url": url,
+        "etag": etag,
+        "last_modified": last_modified,
+        "size": os.path.getsize(file_path),
+    }
+    return ("resumed" if resumed else "downloaded"), record
+
+
+def fetch_files(
+    files,
+    path,
+    max_workers=8,
+    chunk_size=1 << 16,
+    retries=3,
+    backoff=1.0,
+    timeout=30,
+    session=None,
+):
+    """
+    Downloads many files concurrently over pooled connections, streaming them to disk in chunks.
+    Files unchanged since the last fetch are skipped and interrupted downloads are resumed
+    INPUTS
+    files: [Obligatory] dictionary of file name to URL, or list of (url, name) tuples
+    path: [Obligatory] the folder where the files are to be saved, existing or not
+    max_workers: [Optional, default = 8] number of concurrent downloads
+    chunk_size: [Optional, default = 65536] bytes written to disk at a time
+    retries: [Optional, default = 3] times a failed download is retried, resuming from where it stopped
+    backoff: [Optional, default = 1.0] seconds waited before the first retry, doubled on each one
+    timeout: [Optional, default = 30] seconds to wait for the server
+    session: [Optional, default = None] the requests session to use. If None one is created with make_session
+    OUTPUT
+    DataFrame with the status ("downloaded", "resumed", "unchanged" or "failed"), size and error of every file
+    """
+    if isinstance(files, dict):
+        files = [(url, name) for name, url in files.items()]
+    if not os.path.exists(path):
+        os.makedirs(path)
+    if session is None:
+        session = make_session(max_workers)
+    manifest = _load_manifest(path)
+    lock = threading.Lock()
+
+    def task(url, name):
+        def on_partial(partial):
+            # Remember what a partial file belongs to, so that it can be resumed even after a crash
+            with lock:
+                manifest[name] = dict(manifest.get(name) or dict(), **partial)
+                _save_manifest(path, manifest)
+
+        for attempt in range(retries + 1):
+            with lock:
+                record = manifest.get(name)
+            try:
+                status, record = _fetch_one(
+                    session, url, name, path, record, chunk_size, timeout, on_partial
+                )
+                with lock:
+                    manifest[name] = record
+                return status
+            except Exception:
+                if attempt == retries:
+                    raise
+                time.sleep(backoff * 2**attempt)
+
+    rows = list()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(task, url, name): name for url, name in files}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                rows.append({"name": name, "status": future.result(), "error": None})
+            except Exception as e:
+                rows.append({"name": name, "status": "failed", "error": repr(e)})
+                print("[WARNING] - %s failed: %s" % (name, repr(e)))
+    _save_manifest(path, manifest)
+
+    df = pd.DataFrame(rows, columns=["name", "status", "error"])
+    df["size"] = [
+        manifest.get(name, dict()).get("size") for name in df["name"]
+    ]
+    print(
+        "[LOG] - %d files fetched in %.2f seconds, %d failed"
+        % (len(df), time.perf_counter() - start, (df["status"] == "failed").sum())
+    )
+    return df.sort_values("name").reset_index(drop=True)
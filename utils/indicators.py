@@ -0,0 +1,260 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+sys.path.append("../libraries/backtrader")
+import backtrader as bt
+
+sys.path.append("../")
+from utils.feeds import ArrayData
+from utils.vectorized import sma
+
+
+def _ema(values, timeperiod):
+    """EMA as TA-Lib computes it: seeded with the SMA of the first timeperiod values"""
+    from scipy.signal import lfilter
+
+    out = np.full(len(values), np.nan)
+    if timeperiod > len(values):
+        return out
+    alpha = 2.0 / (timeperiod + 1)
+    seed = values[:timeperiod].mean()
+    out[timeperiod - 1] = seed
+    if len(values) > timeperiod:
+        out[timeperiod:] = lfilter(
+            [alpha], [1, alpha - 1], values[timeperiod:], zi=[(1 - alpha) * seed]
+        )[0]
+    return out
+
+
+# NumPy versions of the TA-Lib functions, used when TA-Lib is not installed
+NUMPY_INDICATORS = {
+    "SMA": lambda values, timeperiod: sma(values, timeperiod),
+    "EMA": _ema,
+}
+
+
+def compute_indicator(values, name, **params):
+    """
+    Computes a TA-Lib function of one input series (e.g. SMA, EMA, RSI) over a whole array at once.
+    SMA and EMA fall back to NumPy if TA-Lib is not installed
+    INPUTS
+    values: [Obligatory] 1-D array, usually the close prices
+    name: [Obligatory] TA-Lib function name
+    params: [Optional] parameters of the function, e.g. timeperiod=15
+    """
+    values = np.ascontiguousarray(values, dtype=np.float64)
+    try:
+        import talib
+    except ImportError:
+        if name not in NUMPY_INDICATORS:
+            raise
+        return NUMPY_INDICATORS[name](values, **params)
+    return getattr(talib, name)(values, **params)
+
+
+def data_fingerprint(values):
+    """
+    Hash of the contents of an array, the key of its data in the cache
+    """
+    values = np.ascontiguousarray(values)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str(values.dtype).encode())
+    digest.update(values.data)
+    return digest.hexdigest()
+
+
+def _params_key(name, params):
+    return name + "_" + hashlib.blake2b(
+        json.dumps(params, sort_keys=True).encode(), digest_size=8
+    ).hexdigest()
+
+
+class IndicatorCache(object):
+    """
+    Least recently used cache of indicator series keyed by (data fingerprint, indicator, params), with a memory budget.
+    If a path is given the series are also saved there as .npy and memory-mapped when read, so that the processes of a
+    sweep share them through the operating system's page cache instead of computing them once each
+    """
+
+    def __init__(self, max_bytes=256 * 1024**2, path=None):
+        """
+        INPUTS
+        max_bytes: [Optional, default = 256 MB] memory budget of the series held by the cache
+        path: [Optional, default = None] folder where the series are stored on disk. If None they are only kept in memory
+        """
+        self.max_bytes = max_bytes
+        self.path = path
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def _file(self, fingerprint, key):
+        return os.path.join(self.path, fingerprint, key + ".npy")
+
+    def _load(self, fingerprint, key):
+        if self.path is None:
+            return None
+        try:
+            return np.load(self._file(fingerprint, key), mmap_mode="r")
+        except (OSError, ValueError):
+            return None
+
+    def _save(self, fingerprint, key, series):
+        folder = os.path.join(self.path, fingerprint)
+        if not os.path.exists(folder):
+            os.makedirs(folder, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=folder, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, series)
+        os.replace(tmp_path, self._file(fingerprint, key))
+
+    def get(self, values, name, fingerprint=None, **params):
+        """
+        Returns the indicator of the values, computing it only if it is neither in memory nor on disk
+        INPUTS
+        values: [Obligatory] 1-D input array
+        name: [Obligatory] TA-Lib function name, see compute_indicator
+        fingerprint: [Optional, default = None] data_fingerprint(values), if already known
+        params: [Optional] parameters of the function
+        """
+        fingerprint = fingerprint or data_fingerprint(values)
+        key = (fingerprint, _params_key(name, params))
+        with self.lock:
+            series = self.entries.get(key)
+            if series is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return series
+        series = self._load(*key)
+        if series is None:
+            self.misses += 1
+            series = compute_indicator(values, name, **params)
+            series.setflags(write=False)
+            if self.path is not None:
+                self._save(fingerprint, key[1], series)
+        else:
+            self.hits += 1
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = series
+                self.nbytes += series.nbytes
+            while self.nbytes > self.max_bytes and len(self.entries) > 1:
+                _, evicted = self.entries.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+                self.evictions += 1
+        return series
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        """Dictionary with hits, misses, evictions, entries and bytes held"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self.entries),
+            "nbytes": self.nbytes,
+        }
+
+
+# Cache of the current process, used by cached_indicator
+_default_cache = IndicatorCache()
+
+
+def configure_cache(max_bytes=None, path=None):
+    """
+    Replaces the cache of the current process, e.g. in the initializer of the workers of a sweep
+    INPUTS
+    max_bytes: [Optional, default = None] memory budget. If None 256 MB
+    path: [Optional, default = None] folder to share the series on disk
+    """
+    global _default_cache
+    _default_cache = IndicatorCache(
+        max_bytes=max_bytes if max_bytes is not None else 256 * 1024**2, path=path
+    )
+    return _default_cache
+
+
+def get_cache():
+    return _default_cache
+
+
+def _feed_values(data, line="close"):
+    """
+    The values of a line of a data feed as they will be loaded, read from the feed's source before the backtest starts
+    """
+    if isinstance(data, bt.feeds.PandasData):
+        df = data.p.dataname
+        # Mapping as resolved by the feed: autodetected (negative) ones are already column names, None is no column
+        column = data._colmapping.get(line)
+        if column is None:
+            raise ValueError("The %s line of the data is not mapped to a column of its DataFrame" % line)
+        if isinstance(column, str):
+            names = [str(c) for c in df.columns]
+            if data.p.nocase:
+                names = [c.lower() for c in names]
+                column = column.lower()
+            if column not in names:
+                raise ValueError("Column %s not found in the DataFrame of the data" % column)
+            column = names.index(column)
+        return df.iloc[:, column].values
+    if isinstance(data, ArrayData):
+        # The NaN bars are skipped by the feed
+        values = np.asarray(getattr(data.p, line))
+        return values[~np.isnan(np.asarray(data.p.close))]
+    raise TypeError("Can not read the values of a %s in advance" % type(data).__name__)
+
+
+class PrecomputedLine(bt.Indicator):
+    """
+    Indicator whose values were computed before the backtest, e.g. by an IndicatorCache. Value i is given at bar i
+    """
+
+    lines = ("value",)
+    params = (("values", None), ("minperiod", 1))
+
+    def __init__(self):
+        self.addminperiod(self.p.minperiod)
+
+    def next(self):
+        self.lines.value[0] = self.p.values[len(self) - 1]
+
+    def once(self, start, end):
+        dst = self.lines.value.array
+        values = self.p.values
+        for i in range(start, end):
+            dst[i] = values[i]
+
+
+def cached_indicator(data, name, line="close", cache=None, **params):
+    """
+    Drop-in replacement of bt.talib.<name>(data, **params) inside a strategy's __init__: the series is taken from the
+    cache, or computed once over the whole data, and fed to the strategy as a PrecomputedLine
+    INPUTS
+    data: [Obligatory] the data feed, a PandasData (as in run_backtest_full) or ArrayData (as in run_backtest_multi)
+    name: [Obligatory] TA-Lib function name, e.g. "SMA"
+    line: [Optional, default = "close"] the line of the data used as input
+    cache: [Optional, default = None] the IndicatorCache. If None the one of the current process
+    params: [Optional] parameters of the function, e.g. timeperiod=15
+    """
+    cache = cache or _default_cache
+    values = np.asarray(_feed_values(data, line), dtype=np.float64)
+    series = cache.get(values, name, **params)
+    valid = np.flatnonzero(~np.isnan(series))
+    minperiod = int(valid[0]) + 1 if len(valid) else len(series) + 1
+    return PrecomputedLine(data, values=series, minperiod=minperiod)
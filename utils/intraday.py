@@ -0,0 +1,208 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.append("../libraries/backtrader")
+import backtrader as bt
+
+sys.path.append("../")
+from utils.datastore import _atomic_write
+from utils.feeds import dates_to_num
+
+INTRADAY_PATH = "../data/intraday"
+COLUMNS = ("open", "high", "low", "close", "volume")
+
+
+def bar_dtype(dtype=np.float64):
+    """
+    Record type of the stored bars: the date as int64 nanoseconds (UTC) and the ohlcv columns as dtype
+    """
+    return np.dtype([("date", np.int64)] + [(c, dtype) for c in COLUMNS])
+
+
+def _to_records(df, dtype):
+    df = df.rename(columns=str.lower)
+    if "date" in df.columns:
+        dates = pd.DatetimeIndex(df["date"])
+    else:
+        dates = pd.DatetimeIndex(df.index)
+    if dates.tz is not None:
+        dates = dates.tz_convert("UTC").tz_localize(None)
+    records = np.empty(len(df), dtype=bar_dtype(dtype))
+    records["date"] = dates.values.astype("datetime64[ns]").view(np.int64)
+    for c in COLUMNS:
+        records[c] = df[c].values if c in df.columns else (0 if c == "volume" else np.nan)
+    return records[np.argsort(records["date"], kind="stable")]
+
+
+def _partition_path(root, symbol, month):
+    return os.path.join(root, symbol, "%s.npy" % month)
+
+
+def write_bars(df, symbol, root=INTRADAY_PATH, dtype=np.float64, in_conflict_keep="new"):
+    """
+    Saves bars of any frequency in per-month binary files, root/SYMBOL/YYYY-MM.npy, merging them with the ones already stored
+    INPUTS
+    df: [Obligatory] DataFrame with open, high, low, close, volume and a date column or DatetimeIndex. Timezone-aware dates are stored in UTC
+    symbol: [Obligatory] name of the symbol, the folder of its files
+    root: [Optional, default = "../data/intraday"] root folder of the storage
+    dtype: [Optional, default = np.float64] dtype of the ohlcv columns, np.float32 takes 28 instead of 48 bytes per bar
+    in_conflict_keep: [Optional, default = "new"] "old" or "new". Which bar to keep when a date is already stored
+    OUTPUT
+    number of bars in the months written
+    """
+    if in_conflict_keep not in ("old", "new"):
+        raise ValueError('Parameter in_conflict_keep can only have two values: "old" or "new"')
+    records = _to_records(df, dtype)
+    if not len(records):
+        return 0
+    folder = os.path.join(root, symbol)
+    if not os.path.exists(folder):
+        os.makedirs(folder, exist_ok=True)
+    months = records["date"].view("datetime64[ns]").astype("datetime64[M]")
+    bounds = np.flatnonzero(np.diff(months.astype(np.int64))) + 1
+    n = 0
+    for part in np.split(records, bounds):
+        month = str(part["date"][:1].view("datetime64[ns]").astype("datetime64[M]")[0])
+        path = _partition_path(root, symbol, month)
+        if os.path.exists(path):
+            old = np.load(path).astype(part.dtype)
+            combined = np.concatenate([part, old] if in_conflict_keep == "new" else [old, part])
+        else:
+            combined = part
+        # np.unique keeps the first occurrence of each date, and sorts them
+        _, first = np.unique(combined["date"], return_index=True)
+        combined = combined[first]
+        _atomic_write(path, lambda f, a=combined: np.save(f, a, allow_pickle=False))
+        n += len(combined)
+    return n
+
+
+def list_partitions(symbol, root=INTRADAY_PATH, start=None, end=None):
+    """
+    Paths of the monthly files of a symbol, in order, optionally only those overlapping [start, end]
+    """
+    folder = os.path.join(root, symbol)
+    if not os.path.exists(folder):
+        return list()
+    months = sorted(f[:-4] for f in os.listdir(folder) if f.endswith(".npy"))
+    if start is not None:
+        months = [m for m in months if m >= pd.Timestamp(start).strftime("%Y-%m")]
+    if end is not None:
+        months = [m for m in months if m <= pd.Timestamp(end).strftime("%Y-%m")]
+    return [_partition_path(root, symbol, m) for m in months]
+
+
+def iter_chunks(symbol, root=INTRADAY_PATH, start=None, end=None, chunk_size=65536):
+    """
+    Yields the bars of a symbol between two dates in chunks of at most chunk_size records, reading only the months
+    needed through memory maps, so that only one chunk is in memory at a time
+    INPUTS
+    symbol: [Obligatory] name of the symbol
+    root: [Optional, default = "../data/intraday"] root folder of the storage
+    start: [Optional, default = None] first date (inclusive). If None from the first bar
+    end: [Optional, default = None] last date (inclusive). If None until the last bar
+    chunk_size: [Optional, default = 65536] maximum records per chunk
+    """
+    start_ns = pd.Timestamp(start).value if start is not None else None
+    end_ns = pd.Timestamp(end).value if end is not None else None
+    for path in list_partitions(symbol, root, start, end):
+        bars = np.load(path, mmap_mode="r")
+        lo, hi = 0, len(bars)
+        if start_ns is not None or end_ns is not None:
+            dates = bars["date"]
+            if start_ns is not None:
+                lo = np.searchsorted(dates, start_ns, side="left")
+            if end_ns is not None:
+                hi = np.searchsorted(dates, end_ns, side="right")
+        for i in range(lo, hi, chunk_size):
+            yield np.array(bars[i : min(i + chunk_size, hi)])
+
+
+def read_bars(symbol, root=INTRADAY_PATH, start=None, end=None):
+    """
+    Loads the bars of a symbol between two dates as a DataFrame with date, open, high, low, close and volume columns,
+    as load_data. Meant for ranges that fit in memory, IntradayData streams them instead
+    """
+    chunks = list(iter_chunks(symbol, root, start, end))
+    bars = np.concatenate(chunks) if chunks else np.empty(0, dtype=bar_dtype())
+    df = pd.DataFrame({c: bars[c] for c in COLUMNS})
+    df.insert(0, "date", pd.DatetimeIndex(bars["date"].view("datetime64[ns]")))
+    return df
+
+
+def get_intraday_data(tickers, root=INTRADAY_PATH, period="7d", interval="1m", dtype=np.float64):
+    """
+    Downloads intraday bars with yfinance (see utils.downloader.YahooProvider) and adds them to the storage. yfinance only serves the last days of minute
+    data, so calling it periodically builds the history
+    INPUTS
+    tickers: [Obligatory] array of tickers
+    root: [Optional, default = "../data/intraday"] root folder of the storage
+    period: [Optional, default = "7d"] range of dates to download, as in yfinance
+    interval: [Optional, default = "1m"] bar length, as in yfinance (1m, 2m, 5m, 15m, 30m, 60m, 90m)
+    dtype: [Optional, default = np.float64] dtype of the stored ohlcv columns
+    """
+    from utils.downloader import YahooProvider
+
+    provider = YahooProvider(interval=interval, period=period)
+    for ticker in tickers:
+        data = provider.fetch(ticker)
+        n = write_bars(data, ticker.upper(), root=root, dtype=dtype)
+        print("[LOG] - %s stored, %d bars in the months downloaded" % (ticker.upper(), n))
+
+
+class IntradayData(bt.feed.DataBase):
+    """
+    Data feed streaming the bars of a symbol from the monthly files written by write_bars, one chunk at a time.
+    Run it with exactbars = 1 (or preload = False) so that backtrader does not load it all in memory either
+    """
+
+    params = (
+        ("symbol", None),
+        ("root", INTRADAY_PATH),
+        ("start", None),
+        ("end", None),
+        ("chunk_size", 65536),
+        ("timeframe", bt.TimeFrame.Minutes),
+        ("compression", 1),
+    )
+
+    def start(self):
+        super(IntradayData, self).start()
+        if self.p.symbol is None:
+            raise ValueError("Parameter symbol must be provided")
+        self._chunks = iter_chunks(
+            self.p.symbol, self.p.root, self.p.start, self.p.end, self.p.chunk_size
+        )
+        self._i = 0
+        self._n = 0
+
+    def _next_chunk(self):
+        for chunk in self._chunks:
+            if not len(chunk):
+                continue
+            self._dates = dates_to_num(chunk["date"].view("datetime64[ns]"))
+            self._columns = [chunk[c] for c in COLUMNS]
+            self._i = 0
+            self._n = len(chunk)
+            return True
+        return False
+
+    def _load(self):
+        if self._i >= self._n and not self._next_chunk():
+            return False
+        i = self._i
+        self._i += 1
+        o, h, l, c, v = self._columns
+        self.lines.datetime[0] = self._dates[i]
+        self.lines.open[0] = o[i]
+        self.lines.high[0] = h[i]
+        self.lines.low[0] = l[i]
+        self.lines.close[0] = c[i]
+        self.lines.volume[0] = v[i]
+        self.lines.openinterest[0] = 0.0
+        return True
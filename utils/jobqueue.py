@@ -0,0 +1,565 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import argparse
+import json
+import math
+import multiprocessing as mp
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import traceback
+from datetime import datetime
+
+import pandas as pd
+
+sys.path.append("../")
+from utils.cli import class_name, resolve
+from utils.sweeps import expand_grid
+
+QUEUE_FILE = "jobs.sqlite"
+QUEUE_PATH = os.path.join("../backtests", QUEUE_FILE)
+
+STATUSES = ("pending", "running", "done", "failed")
+
+_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        sweep TEXT,
+        kind TEXT,
+        strategy TEXT,
+        datapath TEXT,
+        params TEXT,
+        settings TEXT,
+        priority INTEGER DEFAULT 0,
+        status TEXT DEFAULT 'pending',
+        attempts INTEGER DEFAULT 0,
+        max_attempts INTEGER DEFAULT 3,
+        worker TEXT,
+        lease_until REAL,
+        created_at TEXT,
+        started_at TEXT,
+        finished_at TEXT,
+        result TEXT,
+        error TEXT
+    )""",
+    "CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, priority, id)",
+    "CREATE INDEX IF NOT EXISTS jobs_sweep ON jobs (sweep, status)",
+]
+
+# Data loaded once per worker process for the metrics jobs, by path
+_worker_data = dict()
+
+
+def connect(queue_path=QUEUE_PATH):
+    """
+    Opens the job queue, creating it if it does not exist. Transactions are explicit, so that a job can be claimed
+    by exactly one worker: claims take the write lock with BEGIN IMMEDIATE before looking for a job
+    INPUTS
+    queue_path: [Optional, default = "../backtests/jobs.sqlite"] path of the SQLite file. Workers on other hosts must
+    see it, and the backtests folder, on a shared filesystem with working file locks
+    """
+    folder = os.path.dirname(queue_path)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder, exist_ok=True)
+    con = sqlite3.connect(queue_path, timeout=60, isolation_level=None)
+    con.row_factory = sqlite3.Row
+    con.execute("PRAGMA journal_mode=WAL")
+    for statement in _SCHEMA:
+        con.execute(statement)
+    return con
+
+
+def _now():
+    return datetime.now().isoformat()
+
+
+def _json_default(value):
+    # numpy scalars in the metrics
+    return value.item() if hasattr(value, "item") else repr(value)
+
+
+def _finite(value):
+    """
+    The result with NaN and infinite floats (e.g. the sharpe of a run without trades) as None, they are not valid JSON
+    and SQLite's json_extract fails on them
+    """
+    if isinstance(value, dict):
+        return {k: _finite(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_finite(v) for v in value]
+    if hasattr(value, "item") and getattr(value, "shape", None) == ():
+        value = value.item()
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+
+def enqueue(
+    strategy,
+    param_grid=None,
+    datapath="../data/us/daily/aapl.csv",
+    sweep=None,
+    kind="full",
+    analyzers=None,
+    priority=0,
+    max_attempts=3,
+    queue_path=QUEUE_PATH,
+    **settings
+):
+    """
+    Adds one job per parameter combination to the queue
+    INPUTS
+    strategy: [Obligatory] the strategy class, or its "module:Class" name. It must be importable by the workers
+    param_grid: [Optional, default = None] parameters as in utils.sweeps.run_sweep. If None one job with the default parameters
+    datapath: [Optional, default = "../data/us/daily/aapl.csv"] path of the csv of the data, as seen by the workers. A list of paths adds the grid for each one
+    sweep: [Optional, default = None] name grouping the jobs, used to follow their progress and get their results. If None one is created
+    kind: [Optional, default = "full"] "full" runs run_backtest_full, which writes the logs of the analyzers and records the run in the catalog. "metrics" runs run_backtest_metrics, which only returns the headline metrics, as run_sweep
+    analyzers: [Optional, default = None] analyzers of the "full" jobs, as classes or "module:Class" names, e.g. [Logger01]
+    priority: [Optional, default = 0] jobs with a higher priority are claimed first
+    max_attempts: [Optional, default = 3] times a job is run before it is marked as failed, counting the runs whose lease expired
+    queue_path: [Optional, default = "../backtests/jobs.sqlite"] path of the queue
+    settings: [Optional] other arguments of run_backtest_full or run_backtest_metrics, e.g. init_cash, commission, prune
+    OUTPUT
+    name of the sweep
+    """
+    if kind not in ("full", "metrics"):
+        raise ValueError('Parameter kind can only have two values: "full" or "metrics"')
+    if sweep is None:
+        sweep = "%s_%s" % (class_name(strategy).split(":")[-1], datetime.now().strftime("%Y%m%dT%H%M%S%f"))
+    if analyzers is not None:
+        settings["analyzers"] = [class_name(a) for a in analyzers]
+    combinations = expand_grid(param_grid) if param_grid is not None else [dict()]
+    datapaths = [datapath] if isinstance(datapath, str) else list(datapath)
+    created_at = _now()
+    rows = [
+        (
+            sweep,
+            kind,
+            class_name(strategy),
+            path,
+            json.dumps(params, sort_keys=True),
+            json.dumps(settings, sort_keys=True),
+            priority,
+            max_attempts,
+            created_at,
+        )
+        for path in datapaths
+        for params in combinations
+    ]
+    con = connect(queue_path)
+    try:
+        con.execute("BEGIN IMMEDIATE")
+        con.executemany(
+            "INSERT INTO jobs (sweep, kind, strategy, datapath, params, settings, priority, max_attempts, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+        con.execute("COMMIT")
+    finally:
+        con.close()
+    print("[LOG] - %d jobs added to %s" % (len(rows), sweep))
+    return sweep
+
+
+def _expire(con, now):
+    """Returns the running jobs whose lease expired to pending, or marks them failed if they have no attempts left"""
+    con.execute(
+        "UPDATE jobs SET status = 'failed', worker = NULL, lease_until = NULL, finished_at = ?, "
+        "error = COALESCE(error, 'lease expired') "
+        "WHERE status = 'running' AND lease_until < ? AND attempts >= max_attempts",
+        (_now(), now),
+    )
+    con.execute(
+        "UPDATE jobs SET status = 'pending', worker = NULL, lease_until = NULL "
+        "WHERE status = 'running' AND lease_until < ?",
+        (now,),
+    )
+
+
+def claim(worker, lease=600, sweep=None, queue_path=QUEUE_PATH, con=None):
+    """
+    Takes the next pending job, giving the worker a lease on it. A job whose lease expires (its worker died or hung)
+    goes back to pending, so that another worker runs it
+    INPUTS
+    worker: [Obligatory] name of the worker
+    lease: [Optional, default = 600] seconds the job belongs to the worker, extended by heartbeat
+    sweep: [Optional, default = None] if provided, only jobs of this sweep are claimed
+    queue_path: [Optional, default = "../backtests/jobs.sqlite"] path of the queue
+    OUTPUT
+    dictionary with the job, or None if there are no pending jobs
+    """
+    own = con is None
+    if own:
+        con = connect(queue_path)
+    try:
+        now = time.time()
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            _expire(con, now)
+            sql = "SELECT * FROM jobs WHERE status = 'pending'"
+            args = list()
+            if sweep is not None:
+                sql += " AND sweep = ?"
+                args.append(sweep)
+            row = con.execute(sql + " ORDER BY priority DESC, id LIMIT 1", args).fetchone()
+            if row is not None:
+                con.execute(
+                    "UPDATE jobs SET status = 'running', worker = ?, lease_until = ?, attempts = attempts + 1, "
+                    "started_at = ?, error = NULL WHERE id = ?",
+                    (worker, now + lease, _now(), row["id"]),
+                )
+            con.execute("COMMIT")
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+    finally:
+        if own:
+            con.close()
+    if row is None:
+        return None
+    job = dict(row)
+    job["params"] = json.loads(job["params"])
+    job["settings"] = json.loads(job["settings"])
+    job["attempts"] += 1
+    return job
+
+
+def heartbeat(job_id, worker, lease=600, queue_path=QUEUE_PATH, con=None):
+    """
+    Extends the lease of a running job. Returns False if the worker lost it, because it expired and it was claimed again
+    """
+    own = con is None
+    if own:
+        con = connect(queue_path)
+    try:
+        cursor = con.execute(
+            "UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND status = 'running'",
+            (time.time() + lease, job_id, worker),
+        )
+        return cursor.rowcount == 1
+    finally:
+        if own:
+            con.close()
+
+
+def complete(job_id, worker, result, queue_path=QUEUE_PATH, con=None):
+    """
+    Marks a job as done with its result. It is ignored, returning False, if the worker no longer holds the job
+    """
+    own = con is None
+    if own:
+        con = connect(queue_path)
+    try:
+        cursor = con.execute(
+            "UPDATE jobs SET status = 'done', result = ?, finished_at = ?, lease_until = NULL, error = NULL "
+            "WHERE id = ? AND worker = ? AND status = 'running'",
+            (
+                json.dumps(_finite(result), default=_json_default, allow_nan=False),
+                _now(),
+                job_id,
+                worker,
+            ),
+        )
+        return cursor.rowcount == 1
+    finally:
+        if own:
+            con.close()
+
+
+def fail(job_id, worker, error, queue_path=QUEUE_PATH, con=None):
+    """
+    Records the error of a job. It goes back to pending while it has attempts left, and is marked failed otherwise
+    """
+    own = con is None
+    if own:
+        con = connect(queue_path)
+    try:
+        cursor = con.execute(
+            "UPDATE jobs SET status = CASE WHEN attempts < max_attempts THEN 'pending' ELSE 'failed' END, "
+            "error = ?, finished_at = ?, worker = NULL, lease_until = NULL "
+            "WHERE id = ? AND worker = ? AND status = 'running'",
+            (error, _now(), job_id, worker),
+        )
+        return cursor.rowcount == 1
+    finally:
+        if own:
+            con.close()
+
+
+def retry(sweep=None, queue_path=QUEUE_PATH):
+    """
+    Sends the failed jobs back to pending with their attempts reset, e.g. after fixing the cause of the errors
+    OUTPUT
+    number of jobs sent back
+    """
+    con = connect(queue_path)
+    try:
+        sql = "UPDATE jobs SET status = 'pending', attempts = 0 WHERE status = 'failed'"
+        args = list()
+        if sweep is not None:
+            sql += " AND sweep = ?"
+            args.append(sweep)
+        return con.execute(sql, args).rowcount
+    finally:
+        con.close()
+
+
+def run_job(job):
+    """
+    Runs a claimed job and returns its result: the metrics of run_backtest_metrics, or the log_path, final_value,
+    runtime and metrics of the summary.csv of run_backtest_full. In both max_drawdown is a positive percentage (40 for 40%)
+    """
+    strategy = resolve(job["strategy"])
+    settings = dict(job["settings"])
+    if job["kind"] == "metrics":
+        from utils.basic import load_data, run_backtest_metrics
+
+        if job["datapath"] not in _worker_data:
+            _worker_data[job["datapath"]] = load_data(job["datapath"])
+        return run_backtest_metrics(
+            strategy=strategy,
+            data_df=_worker_data[job["datapath"]],
+            strategy_params=job["params"],
+            **settings
+        )
+
+    from utils.basic import run_backtest_full
+    from utils.metrics import get_report_metrics
+
+    analyzers = [resolve(a) for a in settings.pop("analyzers", None) or ()]
+    settings.setdefault("custom_log_prefix", job["sweep"])
+    start = time.perf_counter()
+    log_path = run_backtest_full(
+        strategy=strategy,
+        datapath=job["datapath"],
+        strategy_params=job["params"],
+        analyzers=analyzers or None,
+        **settings
+    )
+    result = {"log_path": os.path.abspath(log_path), "runtime": time.perf_counter() - start}
+    if os.path.exists(os.path.join(log_path, "summary.csv")):
+        summary = pd.read_csv(os.path.join(log_path, "summary.csv"), usecols=["value"])
+        result["final_value"] = summary["value"].values[-1] if len(summary) else None
+        result.update(get_report_metrics(log_path).to_dict())
+        # As run_backtest_metrics, so that sweeps mixing both kinds of jobs are comparable: get_report_metrics gives
+        # a negative fraction, backtrader a positive percentage
+        result["max_drawdown"] = -100 * result["max_drawdown"]
+    return result
+
+
+class _Heartbeat(threading.Thread):
+    """Extends the lease of the running job every lease / 3 seconds, from its own connection"""
+
+    def __init__(self, job_id, worker, lease, queue_path):
+        super(_Heartbeat, self).__init__(daemon=True)
+        self.args = (job_id, worker, lease, queue_path)
+        self.interval = lease / 3.0
+        self.finished = threading.Event()
+        self.lost = False
+
+    def run(self):
+        while not self.finished.wait(self.interval):
+            try:
+                if not heartbeat(*self.args):
+                    self.lost = True
+                    return
+            except sqlite3.Error as e:
+                print("[WARNING] - Heartbeat of job %d failed: %s" % (self.args[0], repr(e)))
+
+    def stop(self):
+        self.finished.set()
+        self.join()
+
+
+def work(
+    queue_path=QUEUE_PATH,
+    worker=None,
+    sweep=None,
+    lease=600,
+    poll=5.0,
+    max_jobs=None,
+    exit_when_empty=True,
+):
+    """
+    Worker loop: claims jobs, runs them and posts their results until the queue is empty. Run it on any node that sees
+    the queue and the data, e.g. python ../utils/jobqueue.py work, or several of them with start_workers
+    INPUTS
+    queue_path: [Optional, default = "../backtests/jobs.sqlite"] path of the queue
+    worker: [Optional, default = None] name of the worker. If None host-pid
+    sweep: [Optional, default = None] if provided, only jobs of this sweep are run
+    lease: [Optional, default = 600] seconds after which a job whose worker stopped sending heartbeats is run again elsewhere
+    poll: [Optional, default = 5.0] seconds between checks when there are no pending jobs
+    max_jobs: [Optional, default = None] if provided, the worker stops after this many jobs
+    exit_when_empty: [Optional, default = True] whether to stop when no job is pending or running. If False it waits for new ones
+    OUTPUT
+    number of jobs run
+    """
+    if worker is None:
+        worker = "%s-%d" % (socket.gethostname(), os.getpid())
+    con = connect(queue_path)
+    n = 0
+    try:
+        while max_jobs is None or n < max_jobs:
+            job = claim(worker, lease=lease, sweep=sweep, con=con)
+            if job is None:
+                if exit_when_empty and not _has_work(con, sweep):
+                    break
+                time.sleep(poll)
+                continue
+            beat = _Heartbeat(job["id"], worker, lease, queue_path)
+            beat.start()
+            try:
+                result = run_job(job)
+                error = None
+            except Exception:
+                error = traceback.format_exc()
+            finally:
+                beat.stop()
+            if error is None:
+                posted = complete(job["id"], worker, result, con=con)
+            else:
+                print("[WARNING] - Job %d failed (attempt %d): %s" % (job["id"], job["attempts"], error.strip().splitlines()[-1]))
+                posted = fail(job["id"], worker, error, con=con)
+            if not posted:
+                print("[WARNING] - Lease of job %d lost, its result was discarded" % job["id"])
+            n += 1
+    finally:
+        con.close()
+    print("[LOG] - Worker %s finished, %d jobs run" % (worker, n))
+    return n
+
+
+def _has_work(con, sweep=None):
+    """Whether jobs are pending or running, the running ones may still expire and be claimed again"""
+    sql = "SELECT COUNT(*) FROM jobs WHERE status IN ('pending', 'running')"
+    args = list()
+    if sweep is not None:
+        sql += " AND sweep = ?"
+        args.append(sweep)
+    return con.execute(sql, args).fetchone()[0] > 0
+
+
+def start_workers(n=None, **kwargs):
+    """
+    Starts n local worker processes running work(**kwargs) and returns them
+    INPUTS
+    n: [Optional, default = None] number of workers. If None the number of cores
+    kwargs: [Optional] arguments of work
+    """
+    processes = list()
+    for _ in range(n or os.cpu_count() or 1):
+        process = mp.Process(target=work, kwargs=kwargs)
+        process.start()
+        processes.append(process)
+    return processes
+
+
+def run_workers(n=None, **kwargs):
+    """
+    Runs n local workers until the queue is empty, as start_workers, and waits for them
+    """
+    for process in start_workers(n, **kwargs):
+        process.join()
+
+
+def progress(sweep=None, queue_path=QUEUE_PATH):
+    """
+    Progress of the sweeps in the queue
+    INPUTS
+    sweep: [Optional, default = None] if provided, only this sweep
+    queue_path: [Optional, default = "../backtests/jobs.sqlite"] path of the queue
+    OUTPUT
+    DataFrame with one row per sweep: the jobs in each status, the total, the fraction finished, the retries and the
+    mean runtime of the jobs done
+    """
+    con = connect(queue_path)
+    try:
+        sql = (
+            "SELECT sweep, status, COUNT(*) AS jobs, SUM(MAX(attempts - 1, 0)) AS retries, "
+            "AVG(json_extract(result, '$.runtime')) AS runtime FROM jobs"
+        )
+        args = list()
+        if sweep is not None:
+            sql += " WHERE sweep = ?"
+            args.append(sweep)
+        df = pd.read_sql_query(sql + " GROUP BY sweep, status", con, params=args)
+    finally:
+        con.close()
+    table = df.pivot(index="sweep", columns="status", values="jobs").reindex(columns=list(STATUSES))
+    table = table.fillna(0).astype(int)
+    table["total"] = table.sum(axis=1)
+    table["finished"] = (table["done"] + table["failed"]) / table["total"]
+    table["retries"] = df.groupby("sweep")["retries"].sum()
+    table["runtime"] = df[df["status"] == "done"].set_index("sweep")["runtime"]
+    return table
+
+
+def results(sweep, queue_path=QUEUE_PATH):
+    """
+    Results of the jobs of a sweep, in the format of utils.sweeps.run_sweep
+    INPUTS
+    sweep: [Obligatory] name of the sweep
+    queue_path: [Optional, default = "../backtests/jobs.sqlite"] path of the queue
+    OUTPUT
+    DataFrame with one row per job: its parameters, datapath, result, status, attempts, worker and error
+    """
+    con = connect(queue_path)
+    try:
+        rows = con.execute(
+            "SELECT id, datapath, params, result, status, attempts, worker, error FROM jobs WHERE sweep = ? ORDER BY id",
+            (sweep,),
+        ).fetchall()
+    finally:
+        con.close()
+    records = list()
+    for row in rows:
+        record = dict(json.loads(row["params"]))
+        record["datapath"] = row["datapath"]
+        record.update(json.loads(row["result"]) if row["result"] else dict())
+        record.update(
+            (k, row[k]) for k in ("status", "attempts", "worker", "error", "id")
+        )
+        records.append(record)
+    return pd.DataFrame(records)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Work on and follow the backtest job queue")
+    parser.add_argument("command", choices=["work", "progress", "results", "retry"])
+    parser.add_argument("--queue", default=QUEUE_PATH, help="path of the queue")
+    parser.add_argument("--sweep", default=None)
+    parser.add_argument("--workers", type=int, default=1, help="local worker processes")
+    parser.add_argument("--lease", type=float, default=600)
+    parser.add_argument("--poll", type=float, default=5.0)
+    parser.add_argument("--wait", action="store_true", help="keep waiting for jobs when the queue is empty")
+    parser.add_argument("--output", default=None, help="csv where the results are saved")
+    args = parser.parse_args(argv)
+
+    if args.command == "work":
+        run_workers(
+            args.workers,
+            queue_path=args.queue,
+            sweep=args.sweep,
+            lease=args.lease,
+            poll=args.poll,
+            exit_when_empty=not args.wait,
+        )
+    elif args.command == "progress":
+        print(progress(args.sweep, queue_path=args.queue).to_string())
+    elif args.command == "results":
+        if args.sweep is None:
+            parser.error("results needs --sweep")
+        df = results(args.sweep, queue_path=args.queue)
+        if args.output is not None:
+            df.to_csv(args.output)
+        print(df.to_string())
+    else:
+        print("[LOG] - %d failed jobs sent back to pending" % retry(args.sweep, queue_path=args.queue))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
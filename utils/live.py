@@ -0,0 +1,475 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import argparse
+import asyncio
+import json
+import multiprocessing as mp
+import queue
+import sys
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+sys.path.append("../libraries/backtrader")
+import backtrader as bt
+from backtrader import Order
+from backtrader.brokers import BackBroker
+
+sys.path.append("../")
+from utils.basic import load_data
+from utils.profiling import CallProfiler
+from utils.testers import TestStrategyComplete
+
+# Latency paths checked against the per-bar budget: the strategy's decision path
+DECISION_PATHS = ("bar_to_decision", "tick_to_order")
+
+
+def _encode(msg):
+    msg["sent"] = time.time()
+    return (json.dumps(msg) + "\n").encode("utf-8")
+
+
+class SimulatedExchange(object):
+    """
+    Local exchange replaying the bars of a csv to each client that connects, over TCP with one json message per line.
+    Market orders are acknowledged when received and filled at the open of the next bar (as backtrader does in a
+    backtest), or at the close of the current bar with fill = "close". Other order types are rejected.
+    With interval = None the replay runs in lockstep with the client, which sends "ready" after each bar, so a live run
+    takes the same decisions as a backtest. With an interval in seconds the bars are published on a clock and orders
+    that arrive late are filled at a later bar, as in a real venue
+    """
+
+    def __init__(self, datapath, interval=None, fill="next_open", start=None, end=None):
+        """
+        INPUTS
+        datapath: [Obligatory] path of the csv to replay, as in run_backtest_full
+        interval: [Optional, default = None] seconds between bars. If None lockstep with the client
+        fill: [Optional, default = "next_open"] "next_open" or "close", the price at which market orders are filled
+        start: [Optional, default = None] first date replayed
+        end: [Optional, default = None] last date replayed
+        """
+        if fill not in ("next_open", "close"):
+            raise ValueError('Parameter fill can only be "next_open" or "close"')
+        df = load_data(datapath)
+        dates = pd.DatetimeIndex(df["date"])
+        mask = np.ones(len(df), dtype=bool)
+        if start is not None:
+            mask &= dates >= pd.Timestamp(start)
+        if end is not None:
+            mask &= dates <= pd.Timestamp(end)
+        self.symbol = datapath.replace("/", "-").replace("\\", "-")
+        self.dates = dates[mask].strftime("%Y-%m-%dT%H:%M:%S").tolist()
+        self.bars = df.loc[mask, ["open", "high", "low", "close", "volume"]].values
+        self.interval = interval
+        self.fill = fill
+
+    async def handle(self, reader, writer):
+        """Replays the bars to one client"""
+        pending = list()
+        ready = asyncio.Event()
+        current = {"bar": None}
+
+        def send(msg):
+            writer.write(_encode(msg))
+
+        def fill(order, price, date):
+            send(
+                {
+                    "type": "fill",
+                    "id": order["id"],
+                    "price": float(price),
+                    "size": order["size"],
+                    "date": date,
+                }
+            )
+
+        async def receive():
+            async for line in reader:
+                msg = json.loads(line)
+                if msg["type"] == "ready":
+                    ready.set()
+                elif msg["type"] == "order":
+                    if msg["exectype"] != "market":
+                        send({"type": "reject", "id": msg["id"], "reason": "only market orders"})
+                        continue
+                    send({"type": "ack", "id": msg["id"]})
+                    if self.fill == "close" and current["bar"] is not None:
+                        i = current["bar"]
+                        fill(msg, self.bars[i, 3], self.dates[i])
+                    else:
+                        pending.append(msg)
+            # The client is gone, do not wait for it
+            ready.set()
+
+        receiver = asyncio.create_task(receive())
+        send({"type": "hello", "symbol": self.symbol, "bars": len(self.dates)})
+        for i in range(len(self.dates)):
+            if receiver.done():
+                break
+            # Orders received up to now are filled at this bar's open, before the bar is published
+            for order in pending:
+                fill(order, self.bars[i, 0], self.dates[i])
+            pending.clear()
+            current["bar"] = i
+            o, h, l, c, v = self.bars[i]
+            send(
+                {
+                    "type": "bar",
+                    "date": self.dates[i],
+                    "open": o,
+                    "high": h,
+                    "low": l,
+                    "close": c,
+                    "volume": v,
+                }
+            )
+            await writer.drain()
+            if self.interval is None:
+                await ready.wait()
+                ready.clear()
+            else:
+                await asyncio.sleep(self.interval)
+        if not receiver.done():
+            send({"type": "end"})
+            await writer.drain()
+        writer.close()
+        receiver.cancel()
+
+
+async def serve_exchange(datapath, host="127.0.0.1", port=8765, port_queue=None, **kwargs):
+    """
+    Runs a SimulatedExchange server until cancelled. kwargs are passed to SimulatedExchange
+    INPUTS
+    datapath: [Obligatory] path of the csv to replay
+    host: [Optional, default = "127.0.0.1"] address to listen on
+    port: [Optional, default = 8765] port to listen on. 0 picks a free one
+    port_queue: [Optional, default = None] queue where the port is put once listening
+    """
+    exchange = SimulatedExchange(datapath, **kwargs)
+    server = await asyncio.start_server(exchange.handle, host, port)
+    port = server.sockets[0].getsockname()[1]
+    print("[LOG] - Simulated exchange replaying %s on %s:%d" % (datapath, host, port))
+    if port_queue is not None:
+        port_queue.put(port)
+    async with server:
+        await server.serve_forever()
+
+
+def _exchange_process(port_queue, datapath, host, port, kwargs):
+    asyncio.run(serve_exchange(datapath, host, port, port_queue=port_queue, **kwargs))
+
+
+def start_exchange(datapath="../data/us/daily/aapl.csv", host="127.0.0.1", port=0, **kwargs):
+    """
+    Starts a SimulatedExchange in its own process, so that it does not share the interpreter with the strategy
+    INPUTS
+    datapath: [Optional, default = "../data/us/daily/aapl.csv"] path of the csv to replay
+    host: [Optional, default = "127.0.0.1"] address to listen on
+    port: [Optional, default = 0] port to listen on. 0 picks a free one
+    kwargs: [Optional] interval, fill, start, end, see SimulatedExchange
+    OUTPUT
+    (process, port). Stop it with process.terminate()
+    """
+    port_queue = mp.Queue()
+    process = mp.Process(
+        target=_exchange_process,
+        args=(port_queue, datapath, host, port, kwargs),
+        daemon=True,
+    )
+    process.start()
+    return process, port_queue.get(timeout=60)
+
+
+class ExchangeConnection(object):
+    """
+    Client side of the connection to an exchange, shared by the live feed, the broker and the event loop.
+    Messages can be sent from the backtrader thread, they are written by the event loop
+    """
+
+    def __init__(self, loop, writer, latency):
+        self.loop = loop
+        self.writer = writer
+        self.latency = latency
+
+    def send(self, msg):
+        self.loop.call_soon_threadsafe(self.writer.write, _encode(msg))
+
+
+class LiveFeed(bt.feed.DataBase):
+    """
+    Live data feed fed bar by bar from a queue, by the event loop reading the exchange. A None in the queue ends it.
+    The time each bar was received is kept in received, to measure the latency of the decisions taken on it
+    """
+
+    params = (("qcheck", 0.5),)
+
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.received = None
+
+    def islive(self):
+        return True
+
+    def haslivedata(self):
+        return not self.queue.empty()
+
+    def _load(self):
+        try:
+            msg = self.queue.get(timeout=self._qcheck)
+        except queue.Empty:
+            return None
+        if msg is None:
+            return False
+        if self._laststatus != self.LIVE:
+            self.put_notification(self.LIVE)
+        self.lines.datetime[0] = bt.date2num(datetime.fromisoformat(msg["date"]))
+        self.lines.open[0] = msg["open"]
+        self.lines.high[0] = msg["high"]
+        self.lines.low[0] = msg["low"]
+        self.lines.close[0] = msg["close"]
+        self.lines.volume[0] = msg["volume"]
+        self.lines.openinterest[0] = 0.0
+        self.received = msg["received"]
+        return True
+
+
+class ExchangeBroker(BackBroker):
+    """
+    Broker adapter that sends the orders to an exchange as soon as the strategy creates them and executes them with
+    the fills it returns. Cash, positions, commissions and notifications are kept as in the backtest broker
+    """
+
+    params = (("connection", None),)
+
+    def init(self):
+        super(ExchangeBroker, self).init()
+        self.lock = threading.Lock()
+        self.fills = dict()
+        self.sent = dict()
+
+    def transmit(self, order, check=True):
+        # The cash is checked now instead of at the next bar, since the order leaves right away
+        if check and self.p.checksubmit:
+            position = self.positions[order.data].clone()
+            cash = self._execute(order, cash=self.cash, position=position)
+            if cash < 0.0:
+                order.submit()
+                order.margin()
+                self.notify(order)
+                return order
+        self.submit_accept(order)
+        self._send(order)
+        return order
+
+    def _send(self, order):
+        now = time.perf_counter()
+        self.sent[order.ref] = now
+        received = getattr(order.data, "received", None)
+        if received is not None:
+            self.p.connection.latency.record("tick_to_order", now - received)
+        self.p.connection.send(
+            {
+                "type": "order",
+                "id": order.ref,
+                "side": "buy" if order.isbuy() else "sell",
+                "size": abs(order.size),
+                "exectype": Order.ExecTypes[order.exectype].lower(),
+            }
+        )
+
+    def on_message(self, msg):
+        """Receives the ack, fill and reject messages, in the event loop's thread"""
+        sent = self.sent.get(msg["id"])
+        if msg["type"] == "ack":
+            if sent is not None:
+                self.p.connection.latency.record("order_to_ack", time.perf_counter() - sent)
+            return
+        if sent is not None and msg["type"] == "fill":
+            self.p.connection.latency.record("order_to_fill", time.perf_counter() - sent)
+        with self.lock:
+            self.fills[msg["id"]] = msg
+
+    def _try_exec(self, order):
+        with self.lock:
+            msg = self.fills.pop(order.ref, None)
+        if msg is None:
+            return
+        if msg["type"] == "reject":
+            order.reject(self)
+            self.notify(order)
+            return
+        self._execute(order, ago=0, price=msg["price"])
+
+
+class _LatencyProbe(bt.Analyzer):
+    """Measures the decision latency of each bar and tells the exchange the bar was processed"""
+
+    params = (("connection", None),)
+
+    def next(self):
+        received = self.data.received
+        if received is not None:
+            self.p.connection.latency.record("bar_to_decision", time.perf_counter() - received)
+        self.p.connection.send({"type": "ready"})
+
+
+def latency_report(latency, budget=None):
+    """
+    Statistics (seconds) of the latency paths of a live run:
+    - exchange_to_client: from the exchange sending a bar to the client receiving it
+    - bar_to_decision: from a bar being received to the strategy and analyzers having processed it
+    - tick_to_order: from a bar being received to an order being sent on it
+    - order_to_ack and order_to_fill: from an order being sent to its ack and its fill being received
+    INPUTS
+    latency: [Obligatory] the CallProfiler where the run recorded them
+    budget: [Optional, default = None] per-bar latency budget (seconds). If given, within_budget tells whether the p99 of
+        the decision paths is below it
+    """
+    df = latency.to_frame().rename(columns={"callback": "path"})
+    if budget is not None:
+        decision = df["path"].isin(DECISION_PATHS)
+        df["within_budget"] = (df["p99"] <= budget).where(decision)
+        for path in df.loc[decision & (df["p99"] > budget), "path"]:
+            print(
+                "[WARNING] - p99 latency of %s above the budget of %.3f ms"
+                % (path, 1000 * budget)
+            )
+    return df
+
+
+async def run_live_async(
+    strategy=TestStrategyComplete,
+    host="127.0.0.1",
+    port=8765,
+    strategy_params=None,
+    analyzers=None,
+    init_cash=100000.0,
+    commission=0.00,
+    margin=None,
+    mult=1.0,
+    budget=None,
+    qcheck=0.5,
+):
+    """
+    Runs a strategy live against an exchange: bars are streamed into a LiveFeed and orders are routed through an
+    ExchangeBroker, while backtrader runs in a worker thread. See run_live for the parameters
+    """
+    loop = asyncio.get_running_loop()
+    reader, writer = await asyncio.open_connection(host, port)
+    hello = json.loads(await reader.readline())
+    connection = ExchangeConnection(loop, writer, CallProfiler())
+
+    cerebro = bt.Cerebro(stdstats=False)
+    cerebro.addstrategy(strategy, **(strategy_params or {}))
+    feed = LiveFeed(qcheck=qcheck)
+    cerebro.adddata(feed, name=hello["symbol"])
+    broker = ExchangeBroker(connection=connection)
+    broker.setcash(init_cash)
+    broker.setcommission(commission=commission, margin=margin, mult=mult)
+    cerebro.broker = broker
+    for analyzer in analyzers or []:
+        cerebro.addanalyzer(analyzer)
+    cerebro.addanalyzer(_LatencyProbe, connection=connection)
+
+    print("[LOG] - Connected to %s:%d, %d bars of %s" % (host, port, hello["bars"], hello["symbol"]))
+    print("Starting Portfolio Value: %.2f" % broker.getvalue())
+    run = loop.run_in_executor(None, cerebro.run)
+    # If backtrader fails, closing the connection stops the exchange and the loop below
+    run.add_done_callback(lambda f: f.exception() is not None and writer.close())
+    try:
+        async for line in reader:
+            msg = json.loads(line)
+            if msg["type"] == "bar":
+                msg["received"] = time.perf_counter()
+                connection.latency.record("exchange_to_client", time.time() - msg["sent"])
+                feed.queue.put(msg)
+            elif msg["type"] in ("ack", "fill", "reject"):
+                broker.on_message(msg)
+            elif msg["type"] == "end":
+                break
+    finally:
+        feed.queue.put(None)
+    strats = await run
+    writer.close()
+    print("Final Portfolio Value: %.2f" % broker.getvalue())
+    return strats[0], latency_report(connection.latency, budget)
+
+
+def run_live(strategy=TestStrategyComplete, **kwargs):
+    """
+    Runs a strategy live against an exchange, e.g. a SimulatedExchange started with start_exchange
+    INPUTS
+    strategy: [Optional, default = TestStrategyComplete] the strategy, any bt.Strategy written for backtests
+    host: [Optional, default = "127.0.0.1"] address of the exchange
+    port: [Optional, default = 8765] port of the exchange
+    strategy_params: [Optional, default = None] dictionary with the parameters to pass to the strategy
+    analyzers: [Optional, default = None] analyzers to add, without parameters
+    init_cash, commission, margin, mult: [Optional] broker settings, as in run_backtest_full
+    budget: [Optional, default = None] per-bar latency budget (seconds) the decision paths are checked against
+    qcheck: [Optional, default = 0.5] seconds backtrader waits for a bar before checking for notifications
+    OUTPUT
+    (strategy, latency): the strategy instance after the run and the latency_report DataFrame
+    """
+    return asyncio.run(run_live_async(strategy, **kwargs))
+
+
+def run_paper(
+    strategy=TestStrategyComplete,
+    datapath="../data/us/daily/aapl.csv",
+    interval=None,
+    fill="next_open",
+    start=None,
+    end=None,
+    **kwargs
+):
+    """
+    Paper trades a strategy against a SimulatedExchange replaying a csv in its own process, see run_live.
+    With the default lockstep replay the results match run_backtest_full on the same bars
+    INPUTS
+    strategy: [Optional, default = TestStrategyComplete] the strategy
+    datapath: [Optional, default = "../data/us/daily/aapl.csv"] path of the csv to replay
+    interval, fill, start, end: [Optional] replay settings, see SimulatedExchange
+    kwargs: [Optional] the other parameters of run_live
+    """
+    process, port = start_exchange(
+        datapath, interval=interval, fill=fill, start=start, end=end
+    )
+    try:
+        return run_live(strategy, port=port, **kwargs)
+    finally:
+        process.terminate()
+        process.join()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a simulated exchange replaying a csv")
+    parser.add_argument("--datapath", default="../data/us/daily/aapl.csv")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--interval", type=float, default=None, help="seconds between bars, lockstep if not given")
+    parser.add_argument("--fill", choices=["next_open", "close"], default="next_open")
+    parser.add_argument("--start", default=None)
+    parser.add_argument("--end", default=None)
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(
+            serve_exchange(
+                args.datapath,
+                args.host,
+                args.port,
+                interval=args.interval,
+                fill=args.fill,
+                start=args.start,
+                end=args.end,
+            )
+        )
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,17 +6,33 @@ import sys, os
 from copy import deepcopy as dc
 from datetime import datetime
 import multiprocessing as mp
+import numpy as np
 
 sys.path.append("../libraries/backtrader")
 from backtrader.utils.py3 import map
-from backtrader import Analyzer, TimeFrame
+from backtrader import Analyzer, DataClone, TimeFrame
 from backtrader.mathsupport import average, standarddev
 from backtrader.analyzers import AnnualReturn
 
+sys.path.append("../")
+from utils.catalog import record_run
+
 
 class Logger01(Analyzer):
+    """
+    Logs funds, orders, trades and a summary of the backtest. With per_asset = True, for strategies with many datas,
+    it also logs a summary_<data name>.csv per asset and the summary benchmark is the equally weighted average of the assets.
+    With flush_every set, funds, orders and the summaries are written in chunks of that many rows.
+    Unless catalog = False, the run is also recorded in the catalog.sqlite of its backtests folder (see utils.catalog)
+    """
 
-    params = (("log_path", None), ("data_df", None))
+    params = (
+        ("log_path", None),
+        ("data_df", None),
+        ("flush_every", None),
+        ("per_asset", False),
+        ("catalog", True),
+    )
 
     def __init__(self):
         self.order_dict = dict()
@@ -32,29 +48,87 @@ class Logger01(Analyzer):
         else:
             self.log_path = self.params.log_path
         self.i = 1
+        self.flush_every = self.params.flush_every
+        self.per_asset = self.params.per_asset
+        self.intraday = _is_intraday(self.datas[0])
 
         pass
 
     def start(self):
+        if self.per_asset:
+            # Resampled copies of a data are not assets of their own
+            self.assets = [d for d in self.datas if not isinstance(d, DataClone)]
+            self.asset_buffers = [
+                _ColumnBuffer(_ASSET_COLUMNS, intraday=self.intraday) for d in self.assets
+            ]
+            self.value_buffer = _ColumnBuffer(_VALUE_COLUMNS, intraday=self.intraday)
+        if self.flush_every is not None:
+            if not os.path.exists(self.log_path):
+                os.makedirs(self.log_path)
+            self.fund_writer = _CsvChunkWriter(
+                os.path.join(self.log_path, "funds.csv"),
+                [name for name, dtype in _FUND_COLUMNS],
+            )
+            self.order_writer = _CsvChunkWriter(
+                os.path.join(self.log_path, "orders.csv"),
+                [name for name, dtype in _ORDER_COLUMNS]
+                + (["data"] if self.per_asset else []),
+            )
+            if self.per_asset:
+                self.asset_stream = _AssetSummaryStream(
+                    self.log_path, self.assets, self.asset_buffers, self.value_buffer
+                )
+            else:
+                self.summary_stream = _SummaryStream(
+                    os.path.join(self.log_path, "summary.csv"), intraday=self.intraday
+                )
         pass
 
+    def flush(self):
+        """Writes the buffered funds, orders and summary records when streaming"""
+        if self.fund_list:
+            self.fund_writer.write(pd.DataFrame.from_dict(self.fund_list))
+            self.fund_list = list()
+        if self.order_list:
+            self.order_writer.write(pd.DataFrame.from_dict(self.order_list))
+            self.order_list = list()
+        if self.per_asset:
+            self.asset_stream.flush()
+        else:
+            self.summary_stream.flush()
+
+    def _isodate(self):
+        # With many datas the first one may not have started yet, the strategy clock is the latest of them
+        if self.per_asset:
+            return _isoformat(self.strategy.datetime, self.intraday)
+        return _isoformat(self.datas[0].datetime, self.intraday)
+
     def next(self):
         pass
 
     def stop(self):
+        self._write_logs()
+        _catalog_run(self)
+
+    def _write_logs(self):
         if not os.path.exists(self.log_path):
             os.makedirs(self.log_path)
 
-        df = pd.DataFrame.from_dict(self.fund_list, orient="columns")
-        df.to_csv(os.path.join(self.log_path, "funds.csv"))
-        summary_df = df[["date", "value"]]
-        self.fund_list = list()
-        print("[LOG] - Funds logged")
+        if self.flush_every is not None:
+            self.flush()
+            print("[LOG] - Funds logged")
+            print("[LOG] - Orders logged")
+        else:
+            df = pd.DataFrame.from_dict(self.fund_list, orient="columns")
+            df.to_csv(os.path.join(self.log_path, "funds.csv"))
+            summary_df = df[["date", "value"]]
+            self.fund_list = list()
+            print("[LOG] - Funds logged")
 
-        df = pd.DataFrame.from_dict(self.order_list, orient="columns")
-        df.to_csv(os.path.join(self.log_path, "orders.csv"))
-        self.order_list = list()
-        print("[LOG] - Orders logged")
+            df = pd.DataFrame.from_dict(self.order_list, orient="columns")
+            df.to_csv(os.path.join(self.log_path, "orders.csv"))
+            self.order_list = list()
+            print("[LOG] - Orders logged")
 
         trades = list()
         for k1 in self.strategy._trades.keys():
@@ -72,34 +146,21 @@ class Logger01(Analyzer):
         self.trade_list = list()
         print("[LOG] - Trades logged")
 
-        if self.data_df is not None:
-            self.data_df = self.data_df[
-                ["date", "open", "high", "low", "close", "volume"]
-            ]
-            self.data_df.loc[:, "date"] = pd.to_datetime(
-                pd.DatetimeIndex(self.data_df.loc[:, "date"]).normalize()
-            )
-            self.data_df.set_index("date")
-            summary_df.loc[:, "date"] = pd.to_datetime(
-                pd.DatetimeIndex(summary_df.loc[:, "date"]).normalize()
-            )
-            summary_df.set_index("date")
-            summary_df = pd.concat(
-                [summary_df, self.data_df], join="outer", ignore_index=False, axis=1
-            )
-            summary_df = summary_df[
-                ["open", "high", "low", "close", "volume", "value", "date"]
-            ]
-            summary_df.fillna(0, inplace=True)
-            # summary_df = summary_df.reset_index(drop=True)
-        else:
-            print(
-                "[WARNING] - No data DataFrame provided. Summary log will have reduced data"
-            )
-
-        summary_df["close_returns"] = summary_df["close"].pct_change()
-        summary_df["value_returns"] = summary_df["value"].pct_change()
-        summary_df.to_csv(os.path.join(self.log_path, "summary.csv"))
+        if self.per_asset:
+            if self.flush_every is None:
+                _write_asset_summaries(
+                    self.log_path, self.assets, self.asset_buffers, self.value_buffer
+                )
+            else:
+                # The summaries were already written chunk by chunk
+                print("[LOG] - Asset summaries logged")
+            return
+
+        if self.flush_every is not None:
+            # The summary was already streamed bar by bar
+            return
+
+        _write_summary(self.log_path, summary_df, self.data_df)
         pass
 
     def notify_cashvalue(self, cash, value):
@@ -108,17 +169,38 @@ class Logger01(Analyzer):
 
     def notify_fund(self, cash, value, fundvalue, shares):
         """Receives the current cash, value, fundvalue and fund shares"""
-        self.fund_dict["date"] = self.datas[0].datetime.date(0).isoformat()
+        self.fund_dict["date"] = self._isodate()
         self.fund_dict["cash"] = cash
         self.fund_dict["value"] = value
         self.fund_dict["fundValue"] = fundvalue
         self.fund_dict["shares"] = shares
         self.fund_list.append(dc(self.fund_dict))
+        if self.per_asset:
+            date = self.strategy.datetime[0]
+            self.value_buffer.append(date, value)
+            for d, buffer in zip(self.assets, self.asset_buffers):
+                if not len(d):
+                    continue
+                buffer.append(
+                    date,
+                    d.open[0],
+                    d.high[0],
+                    d.low[0],
+                    d.close[0],
+                    d.volume[0],
+                    self.strategy.getposition(d).size,
+                    self.strategy.broker.getvalue(datas=[d]),
+                )
+        if self.flush_every is not None:
+            if not self.per_asset:
+                self.summary_stream.append(self.datas[0], value)
+            if len(self.fund_list) >= self.flush_every:
+                self.flush()
         pass
 
     def notify_order(self, order):
         """Receives order notifications before each next cycle"""
-        self.order_dict["date"] = self.datas[0].datetime.date(0).isoformat()
+        self.order_dict["date"] = self._isodate()
         self.order_dict["reference"] = order.ref
         self.order_dict["orderType"] = order.ordtypename()
         self.order_dict["status"] = order.getstatusname()
@@ -139,7 +221,11 @@ class Logger01(Analyzer):
         self.order_dict["endOfSession"] = order.dteos
         self.order_dict["broker"] = order.broker
         self.order_dict["alive"] = order.alive()
+        if self.per_asset:
+            self.order_dict["data"] = order.data._name
         self.order_list.append(dc(self.order_dict))
+        if self.flush_every is not None and len(self.order_list) >= self.flush_every:
+            self.flush()
         pass
 
     def notify_trade(self, trade):
@@ -148,7 +234,7 @@ class Logger01(Analyzer):
         pass
 
     def append_trade(self, trade):
-        self.trade_dict["date"] = self.datas[0].datetime.date(0).isoformat()
+        self.trade_dict["date"] = self._isodate()
         self.trade_dict["reference"] = trade.ref
         # self.trade_dict["status"] = ['Created', 'Open', 'Closed'][trade.status]
         # self.trade_dict['data'] = trade.data
@@ -167,6 +253,8 @@ class Logger01(Analyzer):
         # self.trade_dict["barClose"] = trade.barclose
         self.trade_dict["dateClose"] = trade.dtclose
         self.trade_dict["barDuration"] = trade.barlen
+        if self.per_asset:
+            self.trade_dict["data"] = trade.data._name
         self.trade_list.append(dc(self.trade_dict))
         pass
 
@@ -180,7 +268,12 @@ class LoggerMicro(Analyzer):
     WIP
     """
 
-    params = (("log_path", None), ("data_df", None))
+    params = (
+        ("log_path", None),
+        ("data_df", None),
+        ("flush_every", None),
+        ("catalog", True),
+    )
 
     def __init__(self):
         self.order_dict = dict()
@@ -196,19 +289,36 @@ class LoggerMicro(Analyzer):
         else:
             self.log_path = self.params.log_path
         self.i = 1
+        self.flush_every = self.params.flush_every
+        self.intraday = _is_intraday(self.datas[0])
 
         pass
 
     def start(self):
+        if self.flush_every is not None:
+            if not os.path.exists(self.log_path):
+                os.makedirs(self.log_path)
+            self.summary_stream = _SummaryStream(
+                os.path.join(self.log_path, "summary.csv"), intraday=self.intraday
+            )
         pass
 
     def next(self):
         pass
 
     def stop(self):
+        self._write_logs()
+        _catalog_run(self)
+
+    def _write_logs(self):
         if not os.path.exists(self.log_path):
             os.makedirs(self.log_path)
 
+        if self.flush_every is not None:
+            # Only the summary is logged, and it was already streamed bar by bar
+            self.summary_stream.flush()
+            return
+
         df = pd.DataFrame.from_dict(self.fund_list, orient="columns")
         # df.to_csv(os.path.join(self.log_path, "funds.csv"))
         summary_df = df[["date", "value"]]
@@ -236,34 +346,7 @@ class LoggerMicro(Analyzer):
         # self.trade_list = list()
         # print("[LOG] - Trades logged")
 
-        if self.data_df is not None:
-            self.data_df = self.data_df[
-                ["date", "open", "high", "low", "close", "volume"]
-            ]
-            self.data_df.loc[:, "date"] = pd.to_datetime(
-                pd.DatetimeIndex(self.data_df.loc[:, "date"]).normalize()
-            )
-            self.data_df.set_index("date")
-            summary_df.loc[:, "date"] = pd.to_datetime(
-                pd.DatetimeIndex(summary_df.loc[:, "date"]).normalize()
-            )
-            summary_df.set_index("date")
-            summary_df = pd.concat(
-                [summary_df, self.data_df], join="outer", ignore_index=False, axis=1
-            )
-            summary_df = summary_df[
-                ["open", "high", "low", "close", "volume", "value", "date"]
-            ]
-            summary_df.fillna(0, inplace=True)
-            # summary_df = summary_df.reset_index(drop=True)
-        else:
-            print(
-                "[WARNING] - No data DataFrame provided. Summary log will have reduced data"
-            )
-
-        summary_df["close_returns"] = summary_df["close"].pct_change()
-        summary_df["value_returns"] = summary_df["value"].pct_change()
-        summary_df.to_csv(os.path.join(self.log_path, "summary.csv"))
+        _write_summary(self.log_path, summary_df, self.data_df)
         pass
 
     def notify_cashvalue(self, cash, value):
@@ -272,12 +355,17 @@ class LoggerMicro(Analyzer):
 
     def notify_fund(self, cash, value, fundvalue, shares):
         """Receives the current cash, value, fundvalue and fund shares"""
-        self.fund_dict["date"] = self.datas[0].datetime.date(0).isoformat()
+        self.fund_dict["date"] = _isoformat(self.datas[0].datetime, self.intraday)
         self.fund_dict["cash"] = cash
         self.fund_dict["value"] = value
         self.fund_dict["fundValue"] = fundvalue
         self.fund_dict["shares"] = shares
-        self.fund_list.append(dc(self.fund_dict))
+        if self.flush_every is not None:
+            self.summary_stream.append(self.datas[0], value)
+            if len(self.summary_stream.rows) >= self.flush_every:
+                self.summary_stream.flush()
+        else:
+            self.fund_list.append(dc(self.fund_dict))
         pass
 
     def notify_order(self, order):
@@ -337,3 +425,514 @@ class LoggerMicro(Analyzer):
     def get_analysis(self):
         print("No analysis")
         pass
+
+
+def _catalog_run(logger):
+    """Records the run of a logger in the catalog of its backtests folder (see utils.catalog)"""
+    if not logger.p.catalog:
+        return
+    strategy = logger.strategy
+    n_trades = sum(
+        1
+        for trades in strategy._trades.values()
+        for data_trades in trades.values()
+        for trade in data_trades
+        if trade.isclosed
+    )
+    try:
+        record_run(
+            logger.log_path,
+            params=dict(strategy.params._getkwargs()),
+            strategy=type(strategy).__name__,
+            # Many datas are identified by the folder name
+            data=None if getattr(logger, "per_asset", False) else logger.datas[0]._name or None,
+            n_trades=n_trades,
+            final_value=strategy.broker.getvalue(),
+        )
+    except Exception as e:
+        print("[WARNING] - Could not record the run in the catalog: %s" % repr(e))
+
+
+def _write_summary(log_path, summary_df, data_df):
+    """
+    Writes the summary.csv of a logger from its date and value columns, joined with the backtest data when available
+    """
+    if data_df is not None:
+        # A run stopped early (e.g. pruned by utils.risk.RiskMonitor) has fewer bars than the data
+        data_df = data_df[["date", "open", "high", "low", "close", "volume"]].iloc[
+            : len(summary_df)
+        ].copy()
+        data_df.loc[:, "date"] = pd.to_datetime(
+            pd.DatetimeIndex(data_df.loc[:, "date"]).normalize()
+        )
+        summary_df = summary_df.copy()
+        summary_df.loc[:, "date"] = pd.to_datetime(
+            pd.DatetimeIndex(summary_df.loc[:, "date"]).normalize()
+        )
+        summary_df = pd.concat(
+            [summary_df, data_df], join="outer", ignore_index=False, axis=1
+        )
+        summary_df = summary_df[
+            ["open", "high", "low", "close", "volume", "value", "date"]
+        ]
+        summary_df.fillna(0, inplace=True)
+    else:
+        print(
+            "[WARNING] - No data DataFrame provided. Summary log will have reduced data"
+        )
+
+    summary_df["close_returns"] = summary_df["close"].pct_change()
+    summary_df["value_returns"] = summary_df["value"].pct_change()
+    summary_df.to_csv(os.path.join(log_path, "summary.csv"))
+
+
+_ASSET_SUMMARY_COLUMNS = [
+    "open",
+    "high",
+    "low",
+    "close",
+    "volume",
+    "size",
+    "position_value",
+    "date",
+    "close_returns",
+    "contribution",
+]
+
+_PORTFOLIO_SUMMARY_COLUMNS = ["date", "value", "close_returns", "value_returns"]
+
+
+def _asset_summary_path(log_path, data):
+    name = data._name.replace("/", "-").replace("\\", "-")
+    return os.path.join(log_path, "summary_%s.csv" % name)
+
+
+def _shifted(values, first):
+    """values shifted one position, with first in place of the value before them"""
+    shifted = np.empty(len(values), dtype=np.float64)
+    if len(values):
+        shifted[0] = first
+        shifted[1:] = values[:-1]
+    return shifted
+
+
+def _asset_summary_frames(asset_buffers, value_buffer, last):
+    """
+    The rows of every summary_<data name>.csv and of the portfolio summary.csv of a multi-asset backtest for the buffered
+    records. The contribution of an asset is its return times its weight in the portfolio the bar before.
+    last has the close and position value of every asset and the portfolio value of the bar before the first one
+    buffered (NaN at the start) and is updated, so that the records can be written in chunks
+    """
+    summary_df = value_buffer.to_frame()
+    value = summary_df.set_index("date")["value"]
+    prev_value = pd.Series(_shifted(value.values, last["value"]), index=value.index)
+    asset_dfs, close_returns = list(), list()
+    for i, buffer in enumerate(asset_buffers):
+        df = buffer.to_frame()
+        close = df["close"].values
+        df["close_returns"] = close / _shifted(close, last["close"][i]) - 1
+        df["contribution"] = (
+            _shifted(df["position_value"].values, last["position_value"][i])
+            * df["close_returns"].values
+            / prev_value.reindex(df["date"]).values
+        )
+        if len(df):
+            last["close"][i] = close[-1]
+            last["position_value"][i] = df["position_value"].values[-1]
+        asset_dfs.append(df[_ASSET_SUMMARY_COLUMNS])
+        close_returns.append(df.set_index("date")["close_returns"])
+    if len(value):
+        last["value"] = value.values[-1]
+
+    # Benchmark: equally weighted average of the assets trading each bar
+    benchmark = pd.concat(close_returns, axis=1).reindex(value.index).mean(axis=1)
+    summary_df["close_returns"] = benchmark.values
+    summary_df["value_returns"] = value.values / prev_value.values - 1
+    return asset_dfs, summary_df
+
+
+def _first_last(n_assets):
+    return {
+        "value": np.nan,
+        "close": [np.nan] * n_assets,
+        "position_value": [np.nan] * n_assets,
+    }
+
+
+def _write_asset_summaries(log_path, assets, asset_buffers, value_buffer):
+    """
+    Writes the summary_<data name>.csv of every asset and the portfolio summary.csv of a multi-asset backtest
+    """
+    asset_dfs, summary_df = _asset_summary_frames(
+        asset_buffers, value_buffer, _first_last(len(assets))
+    )
+    for d, df in zip(assets, asset_dfs):
+        df.to_csv(_asset_summary_path(log_path, d))
+    print("[LOG] - Asset summaries logged")
+    summary_df.to_csv(os.path.join(log_path, "summary.csv"))
+
+
+class _AssetSummaryStream(object):
+    """
+    Writes the buffered per asset and portfolio summaries of a multi-asset backtest in chunks, as _write_asset_summaries
+    does at once
+    """
+
+    def __init__(self, log_path, assets, asset_buffers, value_buffer):
+        self.asset_buffers = asset_buffers
+        self.value_buffer = value_buffer
+        self.last = _first_last(len(assets))
+        self.writers = [
+            _CsvChunkWriter(_asset_summary_path(log_path, d), _ASSET_SUMMARY_COLUMNS)
+            for d in assets
+        ]
+        self.summary_writer = _CsvChunkWriter(
+            os.path.join(log_path, "summary.csv"), _PORTFOLIO_SUMMARY_COLUMNS
+        )
+
+    def flush(self):
+        if not self.value_buffer.size:
+            return
+        asset_dfs, summary_df = _asset_summary_frames(
+            self.asset_buffers, self.value_buffer, self.last
+        )
+        for writer, df in zip(self.writers, asset_dfs):
+            writer.write(df)
+        self.summary_writer.write(summary_df)
+        for buffer in self.asset_buffers:
+            buffer.clear()
+        self.value_buffer.clear()
+
+
+def _is_intraday(data):
+    """Whether the bars of a data are shorter than a day, so that their dates are logged with the time"""
+    return data._timeframe < TimeFrame.Days
+
+
+def _isoformat(datetime_line, intraday=False):
+    """ISO date (YYYY-MM-DD) of the current bar of a datetime line, or date and time if intraday"""
+    if intraday:
+        return datetime_line.datetime(0).isoformat()
+    return datetime_line.date(0).isoformat()
+
+
+def _num2isodate(dates, intraday=False):
+    """
+    Converts an array of backtrader date numbers into ISO dates (YYYY-MM-DD), or dates and times if intraday
+    """
+    # backtrader date numbers are proleptic Gregorian ordinals, 719163 is 1970-01-01
+    days = np.asarray(dates, dtype=np.float64) - 719163
+    if intraday:
+        # float64 day numbers only resolve about 10 microseconds, rounded to the millisecond so that bars on whole
+        # seconds are not formatted one second early
+        return pd.to_datetime(np.round(days * 86400e3), unit="ms").strftime(
+            "%Y-%m-%dT%H:%M:%S"
+        )
+    return pd.to_datetime(np.floor(days), unit="D").strftime("%Y-%m-%d")
+
+
+class _ColumnBuffer(object):
+    """
+    Preallocated typed columns for the logger records. Capacity doubles when full
+    """
+
+    def __init__(self, dtypes, capacity=1024, intraday=False):
+        self.names = [name for name, dtype in dtypes]
+        self.intraday = intraday
+        self.arrays = [np.empty(capacity, dtype=dtype) for name, dtype in dtypes]
+        self.capacity = capacity
+        self.size = 0
+
+    def append(self, *values):
+        if self.size == self.capacity:
+            self.capacity *= 2
+            for i, array in enumerate(self.arrays):
+                grown = np.empty(self.capacity, dtype=array.dtype)
+                grown[: self.size] = array[: self.size]
+                self.arrays[i] = grown
+        i = self.size
+        for array, value in zip(self.arrays, values):
+            array[i] = value
+        self.size += 1
+
+    def clear(self):
+        self.size = 0
+
+    def to_frame(self, date_column="date"):
+        data = dict()
+        for name, array in zip(self.names, self.arrays):
+            column = array[: self.size]
+            if name == date_column:
+                column = _num2isodate(column, self.intraday)
+            data[name] = column
+        return pd.DataFrame(data, columns=self.names)
+
+
+class _CsvChunkWriter(object):
+    """
+    Appends chunks of records to a csv. The header is written when it is created, so a partial file is always readable
+    """
+
+    def __init__(self, path, columns):
+        self.path = path
+        self.n_rows = 0
+        with open(self.path, "w") as f:
+            f.write("," + ",".join(columns) + "\n")
+
+    def write(self, df):
+        df.index = range(self.n_rows, self.n_rows + len(df))
+        df.to_csv(self.path, mode="a", header=False)
+        self.n_rows += len(df)
+
+
+class _SummaryStream(object):
+    """
+    Builds the summary.csv rows bar by bar from the data feed, so that they can be flushed in chunks
+    """
+
+    columns = [
+        "open",
+        "high",
+        "low",
+        "close",
+        "volume",
+        "value",
+        "date",
+        "date",
+        "close_returns",
+        "value_returns",
+    ]
+
+    def __init__(self, path, intraday=False):
+        self.writer = _CsvChunkWriter(path, self.columns)
+        self.intraday = intraday
+        self.rows = list()
+        self.prev_close = None
+        self.prev_value = None
+
+    def append(self, data, value):
+        close = data.close[0]
+        date = _isoformat(data.datetime, self.intraday)
+        close_returns = close / self.prev_close - 1 if self.prev_close else None
+        value_returns = value / self.prev_value - 1 if self.prev_value else None
+        self.rows.append(
+            (
+                data.open[0],
+                data.high[0],
+                data.low[0],
+                close,
+                data.volume[0],
+                value,
+                date,
+                date,
+                close_returns,
+                value_returns,
+            )
+        )
+        self.prev_close = close
+        self.prev_value = value
+
+    def flush(self):
+        if self.rows:
+            self.writer.write(pd.DataFrame(self.rows))
+            self.rows = list()
+
+
+_FUND_COLUMNS = (
+    ("date", np.float64),
+    ("cash", np.float64),
+    ("value", np.float64),
+    ("fundValue", np.float64),
+    ("shares", np.float64),
+)
+
+_VALUE_COLUMNS = (("date", np.float64), ("value", np.float64))
+
+_ASSET_COLUMNS = (
+    ("date", np.float64),
+    ("open", np.float64),
+    ("high", np.float64),
+    ("low", np.float64),
+    ("close", np.float64),
+    ("volume", np.float64),
+    ("size", np.float64),
+    ("position_value", np.float64),
+)
+
+_ORDER_COLUMNS = (
+    ("date", np.float64),
+    ("reference", np.int64),
+    ("orderType", object),
+    ("status", object),
+    ("size", np.float64),
+    ("price", object),
+    ("priceLimit", object),
+    ("trialAmount", object),
+    ("tiralPercent", object),
+    ("executionType", object),
+    ("commisionPercentage", object),
+    ("commisionMargin", object),
+    ("commisionType", object),
+    ("endOfSession", np.float64),
+    ("broker", object),
+    ("alive", np.bool_),
+)
+
+_TRADE_COLUMNS = (
+    ("date", np.float64),
+    ("reference", np.int64),
+    ("price", np.float64),
+    ("commission", np.float64),
+    ("pnl", np.float64),
+    ("pnlNet", np.float64),
+    ("justOpened", np.bool_),
+    ("isOpen", np.bool_),
+    ("isClosed", np.bool_),
+    ("dateOpen", np.float64),
+    ("dateClose", np.float64),
+    ("barDuration", np.int64),
+)
+
+
+class LoggerColumnar(Analyzer):
+    """
+    Same logs as Logger01 (funds.csv, orders.csv, trades.csv and summary.csv) with a lower overhead per event.
+    Records are stored in preallocated typed columns instead of deep copied dictionaries, dates are kept as
+    backtrader numbers and only formatted in stop(), and trades are deduplicated by reference.
+    With flush_every set, records are flushed to disk in chunks of that many rows and memory stays flat.
+    Unless catalog = False, the run is also recorded in the catalog.sqlite of its backtests folder (see utils.catalog).
+    """
+
+    params = (
+        ("log_path", None),
+        ("data_df", None),
+        ("flush_every", None),
+        ("catalog", True),
+    )
+
+    def __init__(self):
+        self.data_df = self.params.data_df
+        if self.params.log_path is None:
+            self.log_path = f"../backtests/automatically-set_{self.strategy.__name__}_{list(self.dnames.keys())[0]}_{datetime.now().isoformat()}"
+            print("[Warning] - No log path provided")
+        else:
+            self.log_path = self.params.log_path
+
+        self.flush_every = self.params.flush_every
+        if self.flush_every is not None:
+            capacity = self.flush_every
+        elif self.data_df is not None:
+            capacity = len(self.data_df) + 1
+        else:
+            capacity = 1024
+        self.intraday = _is_intraday(self.datas[0])
+        self.funds = _ColumnBuffer(_FUND_COLUMNS, capacity=capacity, intraday=self.intraday)
+        self.orders = _ColumnBuffer(
+            _ORDER_COLUMNS, capacity=min(capacity, 1024), intraday=self.intraday
+        )
+        self.trades = _ColumnBuffer(_TRADE_COLUMNS, intraday=self.intraday)
+
+    def start(self):
+        if self.flush_every is not None:
+            if not os.path.exists(self.log_path):
+                os.makedirs(self.log_path)
+            self.fund_writer = _CsvChunkWriter(
+                os.path.join(self.log_path, "funds.csv"), self.funds.names
+            )
+            self.order_writer = _CsvChunkWriter(
+                os.path.join(self.log_path, "orders.csv"), self.orders.names
+            )
+            self.summary_stream = _SummaryStream(
+                os.path.join(self.log_path, "summary.csv"), intraday=self.intraday
+            )
+
+    def flush(self):
+        """Writes the buffered funds, orders and summary records when streaming"""
+        if self.funds.size:
+            self.fund_writer.write(self.funds.to_frame())
+            self.funds.clear()
+        if self.orders.size:
+            self.order_writer.write(self.orders.to_frame())
+            self.orders.clear()
+        self.summary_stream.flush()
+
+    def stop(self):
+        if not os.path.exists(self.log_path):
+            os.makedirs(self.log_path)
+
+        if self.flush_every is not None:
+            self.flush()
+        else:
+            df = self.funds.to_frame()
+            df.to_csv(os.path.join(self.log_path, "funds.csv"))
+            summary_df = df[["date", "value"]]
+            self.orders.to_frame().to_csv(os.path.join(self.log_path, "orders.csv"))
+        print("[LOG] - Funds logged")
+        print("[LOG] - Orders logged")
+
+        date = self.datas[0].datetime[0]
+        seen = set()
+        for k1 in self.strategy._trades.keys():
+            for k2 in self.strategy._trades[k1].keys():
+                for trade in self.strategy._trades[k1][k2]:
+                    if trade.ref not in seen:
+                        seen.add(trade.ref)
+                        self.append_trade(trade, date)
+        self.trades.to_frame().to_csv(os.path.join(self.log_path, "trades.csv"))
+        print("[LOG] - Trades logged")
+
+        if self.flush_every is None:
+            _write_summary(self.log_path, summary_df, self.data_df)
+        _catalog_run(self)
+
+    def notify_fund(self, cash, value, fundvalue, shares):
+        """Receives the current cash, value, fundvalue and fund shares"""
+        self.funds.append(self.datas[0].datetime[0], cash, value, fundvalue, shares)
+        if self.flush_every is not None:
+            self.summary_stream.append(self.datas[0], value)
+            if self.funds.size >= self.flush_every:
+                self.flush()
+
+    def notify_order(self, order):
+        """Receives order notifications before each next cycle"""
+        comminfo = order.comminfo
+        self.orders.append(
+            self.datas[0].datetime[0],
+            order.ref,
+            order.ordtypename(),
+            order.getstatusname(),
+            order.size,
+            order.price,
+            order.pricelimit,
+            order.trailamount,
+            order.trailpercent,
+            order.getordername(),
+            comminfo.p.commission if comminfo is not None else None,
+            comminfo.p.margin if comminfo is not None else None,
+            comminfo._commtype if comminfo is not None else None,
+            order.dteos,
+            order.broker,
+            order.alive(),
+        )
+        if self.flush_every is not None and self.orders.size >= self.flush_every:
+            self.flush()
+
+    def append_trade(self, trade, date):
+        self.trades.append(
+            date,
+            trade.ref,
+            trade.price,
+            trade.commission,
+            trade.pnl,
+            trade.pnlcomm,
+            trade.justopened,
+            trade.isopen,
+            trade.isclosed,
+            trade.dtopen,
+            trade.dtclose,
+            trade.barlen,
+        )
+
+    def get_analysis(self):
+        print("No analysis")
+        pass
@@ -0,0 +1,123 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import os
+
+import numpy as np
+import pandas as pd
+
+
+def _drawdown(returns):
+    """Drawdown series and longest underwater duration (in bars) of each column of a returns array"""
+    equity = np.cumprod(1 + np.nan_to_num(returns), axis=0)
+    peak = np.maximum.accumulate(equity, axis=0)
+    drawdown = equity / peak - 1
+    idx = np.arange(len(equity)).reshape((-1,) + (1,) * (equity.ndim - 1))
+    last_peak = np.maximum.accumulate(np.where(equity >= peak, idx, 0), axis=0)
+    duration = np.max(idx - last_peak, axis=0) if len(equity) else np.zeros(equity.shape[1:])
+    return drawdown, duration
+
+
+def compute_metrics(value_returns, close_returns=None, periods=252, rf=0.0):
+    """
+    Computes the headline statistics of one or many backtests in one vectorized pass
+    INPUTS
+    value_returns: [Obligatory] the per-bar returns of the strategy, as the value_returns column of summary.csv. 1-D for one run or 2-D (bars x runs) for many. NaN values are not counted as bars, so runs of different lengths can be stacked
+    close_returns: [Optional, default = None] the per-bar returns of the benchmark with the same shape, as the close_returns column of summary.csv
+    periods: [Optional, default = 252] bars per year, used to annualize
+    rf: [Optional, default = 0.0] yearly risk free rate for the Sharpe and Sortino ratios
+    OUTPUT
+    pandas Series (1-D input) or DataFrame with one row per run (2-D input) with total_return, cagr, volatility, sharpe, sortino,
+    max_drawdown, max_drawdown_duration (bars), calmar, hit_rate, exposure and, with close_returns, benchmark_total_return and benchmark_cagr
+    """
+    index = None
+    if isinstance(value_returns, pd.DataFrame):
+        index = value_returns.columns
+    r = np.asarray(value_returns, dtype=np.float64)
+    one_run = r.ndim == 1
+    if one_run:
+        r = r[:, None]
+
+    valid = ~np.isnan(r)
+    n = valid.sum(axis=0)
+    filled = np.where(valid, r, 0.0)
+    years = n / periods
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        total = np.prod(1 + filled, axis=0) - 1
+        cagr = np.where(total > -1, np.abs(1 + total) ** (1 / years) - 1, -1.0)
+        excess = np.where(valid, r - rf / periods, np.nan)
+        mean = np.nanmean(excess, axis=0)
+        std = np.nanstd(r, axis=0, ddof=1)
+        downside = np.sqrt(np.nansum(np.minimum(excess, 0) ** 2, axis=0) / n)
+        drawdown, duration = _drawdown(r)
+        max_drawdown = drawdown.min(axis=0)
+        metrics = {
+            "total_return": total,
+            "cagr": cagr,
+            "volatility": std * np.sqrt(periods),
+            "sharpe": mean / std * np.sqrt(periods),
+            "sortino": mean / downside * np.sqrt(periods),
+            "max_drawdown": max_drawdown,
+            "max_drawdown_duration": duration,
+            "calmar": cagr / np.abs(max_drawdown),
+            "hit_rate": (filled > 0).sum(axis=0) / (filled != 0).sum(axis=0),
+            "exposure": (filled != 0).sum(axis=0) / n,
+        }
+        if close_returns is not None:
+            b = np.asarray(close_returns, dtype=np.float64)
+            if one_run:
+                b = b[:, None]
+            b_total = np.nanprod(1 + b, axis=0) - 1
+            b_years = (~np.isnan(b)).sum(axis=0) / periods
+            metrics["benchmark_total_return"] = b_total
+            metrics["benchmark_cagr"] = np.abs(1 + b_total) ** (1 / b_years) - 1
+
+    df = pd.DataFrame(metrics, index=index)
+    if one_run:
+        return df.iloc[0].rename(None)
+    return df
+
+
+def get_report_metrics(log_path, periods=252, rf=0.0):
+    """
+    Computes the statistics of a backtest from its summary.csv, without building the quantstats report
+    INPUTS
+    log_path: [Obligatory] the path to the folder where the summary.csv is contained
+    periods: [Optional, default = 252] bars per year, used to annualize
+    rf: [Optional, default = 0.0] yearly risk free rate
+    """
+    df = pd.read_csv(
+        os.path.join(log_path, "summary.csv"), usecols=["value_returns", "close_returns"]
+    )
+    return compute_metrics(
+        df["value_returns"].values, df["close_returns"].values, periods=periods, rf=rf
+    )
+
+
+def get_reports_metrics(log_paths, periods=252, rf=0.0):
+    """
+    Computes the statistics of many backtests at once, stacking their summary.csv returns into a single 2-D pass
+    INPUTS
+    log_paths: [Obligatory] list of the folders where the summary.csv files are contained
+    periods: [Optional, default = 252] bars per year, used to annualize
+    rf: [Optional, default = 0.0] yearly risk free rate
+    OUTPUT
+    DataFrame with one row per log_path
+    """
+    value_returns, close_returns = list(), list()
+    for log_path in log_paths:
+        df = pd.read_csv(
+            os.path.join(log_path, "summary.csv"),
+            usecols=["value_returns", "close_returns"],
+        )
+        value_returns.append(df["value_returns"].values)
+        close_returns.append(df["close_returns"].values)
+    length = max(len(v) for v in value_returns) if value_returns else 0
+    values = np.full((length, len(log_paths)), np.nan)
+    closes = np.full((length, len(log_paths)), np.nan)
+    for i, (v, c) in enumerate(zip(value_returns, close_returns)):
+        values[: len(v), i] = v
+        closes[: len(c), i] = c
+    df = compute_metrics(values, closes, periods=periods, rf=rf)
+    df.index = log_paths
+    return df
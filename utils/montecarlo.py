@@ -0,0 +1,262 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import multiprocessing as mp
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+
+# Bootstrap log returns, set once per worker process by _init_worker
+_worker_data = dict()
+
+
+class WealthStats(object):
+    """
+    Online statistics of simulated wealth paths: per step mean and standard deviation of the wealth and of the log wealth,
+    and a fixed-range histogram of the terminal log wealth ln(W_T/W0) from which the quantiles are read.
+    Statistics of different chunks of scenarios are combined with merge, so the paths themselves are never kept
+    """
+
+    def __init__(self, T, bins, hist_range):
+        self.n = 0
+        self.mean = np.zeros(T)
+        self.m2 = np.zeros(T)
+        self.log_mean = np.zeros(T)
+        self.log_m2 = np.zeros(T)
+        self.edges = np.linspace(hist_range[0], hist_range[1], bins + 1)
+        self.counts = np.zeros(bins, dtype=np.int64)
+        self.underflow = 0
+        self.overflow = 0
+        self.min = np.inf
+        self.max = -np.inf
+
+    @staticmethod
+    def _merge_moments(n_a, mean_a, m2_a, n_b, mean_b, m2_b):
+        # Chan et al. parallel version of Welford's algorithm
+        n = n_a + n_b
+        delta = mean_b - mean_a
+        mean = mean_a + delta * (n_b / n)
+        m2 = m2_a + m2_b + delta**2 * (n_a * n_b / n)
+        return mean, m2
+
+    def update(self, log_wealth, w0, t0=0):
+        """
+        Adds a block of steps of a chunk of scenarios
+        INPUTS
+        log_wealth: [Obligatory] array (scenarios x steps) of ln(W_t/W0)
+        w0: [Obligatory] initial wealth
+        t0: [Optional, default = 0] step of the first column
+        """
+        steps = slice(t0, t0 + log_wealth.shape[1])
+        n = len(log_wealth)
+        wealth = w0 * np.exp(log_wealth)
+        for mean, m2, values in (
+            (self.mean, self.m2, wealth),
+            (self.log_mean, self.log_m2, log_wealth),
+        ):
+            block_mean = values.mean(axis=0)
+            block_m2 = ((values - block_mean) ** 2).sum(axis=0)
+            mean[steps], m2[steps] = self._merge_moments(
+                self.n, mean[steps], m2[steps], n, block_mean, block_m2
+            )
+
+    def update_terminal(self, log_wealth_T, n):
+        """
+        Adds the terminal log wealth of a chunk of n scenarios, once all its steps have been added with update
+        """
+        self.counts += np.histogram(log_wealth_T, bins=self.edges)[0]
+        self.underflow += int((log_wealth_T < self.edges[0]).sum())
+        self.overflow += int((log_wealth_T > self.edges[-1]).sum())
+        self.min = min(self.min, float(log_wealth_T.min()))
+        self.max = max(self.max, float(log_wealth_T.max()))
+        self.n += n
+
+    def merge(self, other):
+        """
+        Combines the statistics of another, disjoint, set of scenarios into these ones
+        """
+        if other.n == 0:
+            return self
+        if self.n == 0:
+            self.mean, self.m2 = other.mean.copy(), other.m2.copy()
+            self.log_mean, self.log_m2 = other.log_mean.copy(), other.log_m2.copy()
+        else:
+            self.mean, self.m2 = self._merge_moments(
+                self.n, self.mean, self.m2, other.n, other.mean, other.m2
+            )
+            self.log_mean, self.log_m2 = self._merge_moments(
+                self.n, self.log_mean, self.log_m2, other.n, other.log_mean, other.log_m2
+            )
+        self.counts += other.counts
+        self.underflow += other.underflow
+        self.overflow += other.overflow
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.n += other.n
+        return self
+
+    def quantile(self, q):
+        """
+        Quantiles of the terminal log wealth ln(W_T/W0), interpolated within the histogram bins
+        INPUTS
+        q: [Obligatory] quantile or array of quantiles between 0 and 1
+        """
+        q = np.asarray(q, dtype=np.float64)
+        cumulative = self.underflow + np.concatenate([[0], np.cumsum(self.counts)])
+        target = q * self.n
+        i = np.clip(np.searchsorted(cumulative, target, side="left"), 1, len(self.counts))
+        below, above = cumulative[i - 1], cumulative[i]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            fraction = np.where(above > below, (target - below) / (above - below), 0.0)
+        values = self.edges[i - 1] + np.clip(fraction, 0, 1) * (self.edges[i] - self.edges[i - 1])
+        # Quantiles outside of the histogram range are only known to be beyond it
+        values = np.where(target <= self.underflow, self.min, values)
+        values = np.where(target > cumulative[-1], self.max, values)
+        return values
+
+    def steps(self):
+        """
+        DataFrame indexed by step with the mean and standard deviation of the wealth and of ln(W_t/W0)
+        """
+        ddof = max(self.n - 1, 1)
+        return pd.DataFrame(
+            {
+                "wealth_mean": self.mean,
+                "wealth_std": np.sqrt(self.m2 / ddof),
+                "log_mean": self.log_mean,
+                "log_std": np.sqrt(self.log_m2 / ddof),
+            },
+            index=pd.RangeIndex(1, len(self.mean) + 1, name="step"),
+        )
+
+    def summary(self, w0, quantiles=(0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99)):
+        """
+        Dictionary with the statistics of the terminal wealth W_T: mean, std, min, max and quantiles
+        """
+        ddof = max(self.n - 1, 1)
+        result = {
+            "n_scenarios": self.n,
+            "mean": self.mean[-1],
+            "std": np.sqrt(self.m2[-1] / ddof),
+            "log_mean": self.log_mean[-1],
+            "log_std": np.sqrt(self.log_m2[-1] / ddof),
+            "min": w0 * np.exp(self.min),
+            "max": w0 * np.exp(self.max),
+        }
+        for q, value in zip(quantiles, self.quantile(quantiles)):
+            result["q%g" % (q * 100)] = w0 * np.exp(value)
+        return result
+
+
+def returns_from_summary(log_path, column="value_returns"):
+    """
+    Reads the returns of a backtest from its summary.csv, to be used as the bootstrap sample of simulate_wealth
+    INPUTS
+    log_path: [Obligatory] the path to the folder where the summary.csv is contained
+    column: [Optional, default = "value_returns"] the returns column, "close_returns" for the asset itself
+    """
+    df = pd.read_csv(os.path.join(log_path, "summary.csv"), usecols=[column])
+    return df[column].dropna().values
+
+
+def _init_worker(log_returns):
+    _worker_data["log_returns"] = log_returns
+
+
+def _simulate_chunk(task):
+    seed, n, T, w0, mu, std, time_block, bins, hist_range = task
+    rng = np.random.default_rng(seed)
+    log_returns = _worker_data.get("log_returns")
+    stats = WealthStats(T, bins, hist_range)
+    carry = np.zeros((n, 1))
+    # Only n x time_block returns are in memory at a time
+    for t0 in range(0, T, time_block):
+        width = min(time_block, T - t0)
+        if log_returns is None:
+            block = rng.normal(loc=mu, scale=std, size=(n, width))
+        else:
+            block = log_returns[rng.integers(0, len(log_returns), size=(n, width))]
+        block = np.cumsum(block, axis=1, out=block)
+        block += carry
+        stats.update(block, w0, t0=t0)
+        carry = block[:, -1:].copy()
+    stats.update_terminal(carry[:, 0], n)
+    return stats
+
+
+def simulate_wealth(
+    w0=1000,
+    mu=0.05,
+    std=0.02,
+    T=10,
+    n_scenarios=100000,
+    returns=None,
+    chunk_size=100000,
+    time_block=256,
+    bins=2000,
+    hist_range=None,
+    seed=None,
+    processes=None,
+):
+    """
+    Simulates wealth paths W_t = W0 * exp(r_1 + ... + r_t) in chunks of scenarios spread over worker processes,
+    keeping only online statistics. Each chunk has its own independent seed spawned from seed, so the results only
+    depend on seed and chunk_size, not on the number of processes
+    INPUTS
+    w0: [Optional, default = 1000] initial wealth
+    mu: [Optional, default = 0.05] mean of the normal log returns per step (parametric case)
+    std: [Optional, default = 0.02] standard deviation of the normal log returns per step (parametric case)
+    T: [Optional, default = 10] number of steps
+    n_scenarios: [Optional, default = 100000] number of simulated paths
+    returns: [Optional, default = None] if provided, array of simple returns (e.g. returns_from_summary(log_path)) resampled with replacement instead of the normal distribution
+    chunk_size: [Optional, default = 100000] scenarios simulated at a time by a worker
+    time_block: [Optional, default = 256] steps simulated at a time, memory is chunk_size x time_block floats per worker
+    bins: [Optional, default = 2000] bins of the terminal log wealth histogram
+    hist_range: [Optional, default = None] (low, high) range of the histogram of ln(W_T/W0). If None 10 standard deviations around the expected mean
+    seed: [Optional, default = None] seed for reproducible results
+    processes: [Optional, default = None] number of worker processes. If None the number of cores is used, if 1 no pool is created
+    OUTPUT
+    WealthStats with the merged statistics, see its summary, steps and quantile methods
+    """
+    log_returns = None
+    if returns is not None:
+        log_returns = np.log1p(np.asarray(returns, dtype=np.float64))
+        log_returns = log_returns[~np.isnan(log_returns)]
+        mu, std = log_returns.mean(), log_returns.std()
+    if hist_range is None:
+        width = 10 * std * np.sqrt(T) or 1.0
+        hist_range = (mu * T - width, mu * T + width)
+
+    sizes = [chunk_size] * (n_scenarios // chunk_size)
+    if n_scenarios % chunk_size:
+        sizes.append(n_scenarios % chunk_size)
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [
+        (s, n, T, w0, mu, std, time_block, bins, hist_range)
+        for s, n in zip(seeds, sizes)
+    ]
+
+    start = time.perf_counter()
+    stats = WealthStats(T, bins, hist_range)
+    if processes == 1 or len(tasks) == 1:
+        _init_worker(log_returns)
+        for task in tasks:
+            stats.merge(_simulate_chunk(task))
+        _worker_data.clear()
+    else:
+        with mp.Pool(processes, initializer=_init_worker, initargs=(log_returns,)) as pool:
+            # Ordered, so that the merged floating point results are reproducible
+            for chunk_stats in pool.imap(_simulate_chunk, tasks):
+                stats.merge(chunk_stats)
+    print(
+        "[LOG] - %d scenarios of %d steps simulated in %.2f seconds"
+        % (n_scenarios, T, time.perf_counter() - start)
+    )
+    if stats.underflow or stats.overflow:
+        print(
+            "[WARNING] - %d scenarios out of the histogram range, extreme quantiles are not accurate"
+            % (stats.underflow + stats.overflow)
+        )
+    return stats
@@ -0,0 +1,219 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import reduce
+
+import numpy as np
+import pandas as pd
+
+sys.path.append("../")
+from utils.basic import get_files
+from utils.datastore import CACHE_FOLDER, load_columns
+
+
+class Panel(object):
+    """
+    Date-aligned matrix (dates x tickers) of one column of many csvs, memory-mapped from disk. Missing values are NaN.
+    The matrix is stored column-major, so the whole history of a ticker is contiguous
+    """
+
+    def __init__(self, path):
+        """
+        INPUTS
+        path: [Obligatory] folder of a panel created by build_panel
+        """
+        self.path = path
+        with open(os.path.join(path, "meta.json"), "r") as f:
+            self.meta = json.load(f)
+        self.tickers = self.meta["tickers"]
+        self._positions = dict((t, i) for i, t in enumerate(self.tickers))
+        self.values = np.load(os.path.join(path, "values.npy"), mmap_mode="r")
+        self.dates = pd.DatetimeIndex(np.load(os.path.join(path, "dates.npy")))
+
+    def __len__(self):
+        return len(self.dates)
+
+    def column(self, ticker):
+        """
+        Returns the values of one ticker, without copying them
+        """
+        return self.values[:, self._positions[ticker]]
+
+    def to_frame(self, tickers=None):
+        """
+        Returns the panel, or some of its tickers, as a DataFrame indexed by date. The data is copied into memory
+        """
+        if tickers is None:
+            return pd.DataFrame(np.asarray(self.values), index=self.dates, columns=self.tickers)
+        idx = [self._positions[t] for t in tickers]
+        return pd.DataFrame(self.values[:, idx], index=self.dates, columns=list(tickers))
+
+
+def _sources(path, files):
+    sources = dict()
+    for f in files:
+        stat = os.stat(os.path.join(path, f))
+        sources[f] = [stat.st_size, stat.st_mtime_ns]
+    return sources
+
+
+def build_panel(
+    path="../data/stocks/nyse",
+    column="close",
+    dtype=np.float64,
+    panel_path=None,
+    max_workers=8,
+    rebuild=False,
+):
+    """
+    Loads one column of all the csvs listed by get_files(path) into a single date-aligned matrix backed by a memory map.
+    The dates are merged first and the matrix is allocated once, then each ticker is written into its column
+    INPUTS
+    path: [Optional, default = "../data/stocks/nyse"] folder with the csvs, as TICKER.csv with a date column
+    column: [Optional, default = "close"] the column to load
+    dtype: [Optional, default = np.float64] dtype of the matrix, np.float32 halves its size
+    panel_path: [Optional, default = None] folder where the panel is saved. If None path/.columnar/_panel_<column>
+    max_workers: [Optional, default = 8] threads reading the csvs' columnar caches (see utils.datastore)
+    rebuild: [Optional, default = False] whether to rebuild the panel even if the csvs did not change since it was built
+    OUTPUT
+    the Panel
+    """
+    files = sorted(f for f in get_files(path) if f.lower().endswith(".csv"))
+    if panel_path is None:
+        panel_path = os.path.join(path, CACHE_FOLDER, "_panel_%s" % column)
+    sources = _sources(path, files)
+    meta_path = os.path.join(panel_path, "meta.json")
+    if not rebuild and os.path.exists(meta_path):
+        with open(meta_path, "r") as f:
+            meta = json.load(f)
+        if meta["sources"] == sources and meta["dtype"] == np.dtype(dtype).name:
+            return Panel(panel_path)
+
+    start = time.perf_counter()
+
+    def read(f):
+        try:
+            columns = load_columns(os.path.join(path, f))
+            return f, columns["date"], columns[column]
+        except Exception as e:
+            print("[WARNING] - Could not load %s: %s" % (f, repr(e)))
+            return f, None, None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        loaded = [r for r in executor.map(read, files) if r[1] is not None]
+
+    dates = reduce(np.union1d, (d for _, d, _ in loaded), np.empty(0, dtype=np.int64))
+    tickers = [f.rsplit(".", 1)[0] for f, _, _ in loaded]
+    if not os.path.exists(panel_path):
+        os.makedirs(panel_path)
+    # Written to a temporary name and renamed when complete, so that a failed build never looks valid
+    for name in ("meta.json", "values.npy"):
+        if os.path.exists(os.path.join(panel_path, name)):
+            os.remove(os.path.join(panel_path, name))
+    values = np.lib.format.open_memmap(
+        os.path.join(panel_path, "values.tmp.npy"),
+        mode="w+",
+        dtype=dtype,
+        shape=(len(dates), len(tickers)),
+        fortran_order=True,
+    )
+
+    def write(j):
+        _, ticker_dates, ticker_values = loaded[j]
+        column_values = np.full(len(dates), np.nan, dtype=dtype)
+        column_values[np.searchsorted(dates, ticker_dates)] = ticker_values
+        values[:, j] = column_values
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(write, range(len(loaded))))
+    values.flush()
+    del values
+    os.replace(
+        os.path.join(panel_path, "values.tmp.npy"), os.path.join(panel_path, "values.npy")
+    )
+    np.save(os.path.join(panel_path, "dates.npy"), dates.astype("datetime64[ns]"))
+    with open(meta_path, "w") as f:
+        json.dump(
+            {
+                "tickers": tickers,
+                "column": column,
+                "dtype": np.dtype(dtype).name,
+                "sources": sources,
+            },
+            f,
+        )
+    print(
+        "[LOG] - Panel of %d dates x %d tickers built in %.2f seconds"
+        % (len(dates), len(tickers), time.perf_counter() - start)
+    )
+    return Panel(panel_path)
+
+
+def correlation(values, min_periods=2, block_size=256, max_workers=None, nearest=False):
+    """
+    Pearson correlation matrix of the columns of a matrix with missing values, using for each pair only the rows where
+    both are present (as pandas DataFrame.corr). It is computed in blocks of columns, in parallel threads, from matrix
+    products of the values and of their missing-data masks, so only a few blocks are in memory at a time
+    INPUTS
+    values: [Obligatory] array (observations x variables), e.g. Panel.values. NaN are missing values
+    min_periods: [Optional, default = 2] minimum number of common observations for a pair, NaN otherwise
+    block_size: [Optional, default = 256] columns per block
+    max_workers: [Optional, default = None] threads computing blocks. If None the number of cores
+    nearest: [Optional, default = False] whether to return the nearest positive semidefinite correlation matrix
+        (statsmodels corr_nearest, as in research/test-correlations.ipynb). Missing pairs are set to 0 first
+    OUTPUT
+    array (variables x variables)
+    """
+    start = time.perf_counter()
+    n = values.shape[1]
+    # Centering by the column means does not change the correlation but avoids cancellation in the sums
+    means = np.zeros(n)
+    for j in range(0, n, block_size):
+        with np.errstate(invalid="ignore"):
+            block = np.asarray(values[:, j : j + block_size], dtype=np.float64)
+            means[j : j + block_size] = np.nan_to_num(np.nanmean(block, axis=0))
+    blocks = [(j, min(j + block_size, n)) for j in range(0, n, block_size)]
+
+    def prepare(b):
+        x = np.asarray(values[:, b[0] : b[1]], dtype=np.float64) - means[b[0] : b[1]]
+        mask = ~np.isnan(x)
+        x[~mask] = 0
+        return x, mask.astype(np.float64)
+
+    result = np.full((n, n), np.nan)
+
+    def compute(pair):
+        bi, bj = pair
+        x, mx = prepare(bi)
+        y, my = (x, mx) if bi == bj else prepare(bj)
+        count = mx.T @ my
+        sum_x = x.T @ my
+        sum_y = mx.T @ y
+        sum_xx = (x * x).T @ my
+        sum_yy = mx.T @ (y * y)
+        sum_xy = x.T @ y
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cov = sum_xy - sum_x * sum_y / count
+            var_x = sum_xx - sum_x**2 / count
+            var_y = sum_yy - sum_y**2 / count
+            corr = np.clip(cov / np.sqrt(var_x * var_y), -1, 1)
+        corr[count < min_periods] = np.nan
+        result[bi[0] : bi[1], bj[0] : bj[1]] = corr
+        result[bj[0] : bj[1], bi[0] : bi[1]] = corr.T
+
+    pairs = [(bi, bj) for i, bi in enumerate(blocks) for bj in blocks[i:]]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(compute, pairs))
+    print(
+        "[LOG] - Correlation of %d variables computed in %.2f seconds"
+        % (n, time.perf_counter() - start)
+    )
+    if nearest:
+        from statsmodels.stats.correlation_tools import corr_nearest
+
+        result = corr_nearest(np.nan_to_num(result), 1e-5)
+    return result
@@ -0,0 +1,219 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import time
+
+import numpy as np
+import pandas as pd
+from scipy.linalg import cho_factor, cho_solve
+
+
+def portfolio_stats(weights, mu, cov):
+    """
+    Expected return and standard deviation of many portfolios at once
+    INPUTS
+    weights: [Obligatory] array (portfolios x assets), or a single portfolio
+    mu: [Obligatory] expected returns of the assets
+    cov: [Obligatory] covariance matrix of the assets
+    OUTPUT
+    (returns, stds) arrays, one value per portfolio
+    """
+    weights = np.atleast_2d(weights)
+    returns = weights @ mu
+    variances = np.einsum("ij,ij->i", weights @ cov, weights)
+    return returns, np.sqrt(np.maximum(variances, 0))
+
+
+def _closed_form(mu, cov):
+    """
+    Unconstrained (short selling allowed) solution of min w'Cw/2 - l*mu'w s.t. sum(w) = 1, which is affine in l:
+    w(l) = w_min_variance + l * direction
+    """
+    factor = cho_factor(cov)
+    inv_ones = cho_solve(factor, np.ones(len(mu)))
+    inv_mu = cho_solve(factor, mu)
+    w_min_variance = inv_ones / inv_ones.sum()
+    direction = inv_mu - inv_mu.sum() * w_min_variance
+    return w_min_variance, direction
+
+
+def project_simplex(v):
+    """
+    Euclidean projection of each row of v onto the simplex {w >= 0, sum(w) = 1}
+    """
+    v = np.atleast_2d(v)
+    n = v.shape[1]
+    u = -np.sort(-v, axis=1)
+    cssv = np.cumsum(u, axis=1) - 1
+    rho = np.count_nonzero(u - cssv / np.arange(1, n + 1) > 0, axis=1)
+    theta = cssv[np.arange(len(v)), rho - 1] / rho
+    return np.maximum(v - theta[:, None], 0)
+
+
+def _polish(w, lambdas, mu, cov, tol):
+    """
+    Replaces each approximate long-only solution by the exact closed form on its support, when that satisfies the KKT conditions
+    """
+    w = w.copy()
+    for i, l in enumerate(lambdas):
+        support = w[i] > tol
+        if support.sum() == 0:
+            continue
+        try:
+            w_min_variance, direction = _closed_form(mu[support], cov[np.ix_(support, support)])
+        except np.linalg.LinAlgError:
+            continue
+        exact = np.zeros_like(w[i])
+        exact[support] = w_min_variance + l * direction
+        if (exact[support] < 0).any():
+            continue
+        gradient = cov @ exact - l * mu
+        # Assets out of the support must not decrease the objective if bought
+        if (gradient[~support] < gradient[support].mean() - tol).any():
+            continue
+        w[i] = exact
+    return w
+
+
+def efficient_frontier(
+    mu,
+    cov,
+    lambdas=None,
+    long_only=True,
+    method="batch",
+    tol=1e-10,
+    max_iter=20000,
+    polish=True,
+):
+    """
+    Computes the mean-variance efficient frontier min w'Cw/2 - l*mu'w s.t. sum(w) = 1, for all the risk aversions l at once
+    INPUTS
+    mu: [Obligatory] expected returns of the assets
+    cov: [Obligatory] covariance matrix of the assets, must be positive definite
+    lambdas: [Optional, default = None] values of l. If None 100 values between 0 and 0.8, as in studies/2_genetic_markowitz.ipynb
+    long_only: [Optional, default = True] whether the weights must be positive. If False the closed form solution is used
+    method: [Optional, default = "batch"] long-only solver. "batch" runs an accelerated projected gradient on all the lambdas
+        simultaneously, as matrix products, started from the projected closed form. "slsqp" solves each lambda with scipy, warm started from the previous one
+    tol: [Optional, default = 1e-10] convergence tolerance on the weights
+    max_iter: [Optional, default = 20000] maximum iterations of the batch solver
+    polish: [Optional, default = True] whether to replace the batch solutions by the exact closed form on their support when it is optimal
+    OUTPUT
+    (frontier, weights): DataFrame with lambda, return and std per point and the weights array (points x assets)
+    """
+    mu = np.asarray(mu, dtype=np.float64)
+    cov = np.asarray(cov, dtype=np.float64)
+    lambdas = np.linspace(0, 0.8, 100) if lambdas is None else np.asarray(lambdas, dtype=np.float64)
+    start = time.perf_counter()
+
+    w_min_variance, direction = _closed_form(mu, cov)
+    weights = w_min_variance[None, :] + lambdas[:, None] * direction[None, :]
+    if long_only and method == "batch":
+        # FISTA with step 1/L, L the largest eigenvalue of the covariance
+        step = 1.0 / np.linalg.eigvalsh(cov)[-1]
+        weights = project_simplex(weights)
+        y = weights
+        t = 1.0
+        for _ in range(max_iter):
+            gradient = y @ cov - lambdas[:, None] * mu[None, :]
+            new_weights = project_simplex(y - step * gradient)
+            t_new = (1 + np.sqrt(1 + 4 * t * t)) / 2
+            y = new_weights + ((t - 1) / t_new) * (new_weights - weights)
+            change = np.abs(new_weights - weights).max()
+            weights, t = new_weights, t_new
+            if change < tol:
+                break
+        else:
+            print("[WARNING] - Frontier not converged after %d iterations" % max_iter)
+        if polish:
+            weights = _polish(weights, lambdas, mu, cov, np.sqrt(tol))
+    elif long_only and method == "slsqp":
+        from scipy.optimize import minimize
+
+        n = len(mu)
+        x0 = np.full(n, 1.0 / n)
+        constraints = (
+            {"type": "eq", "fun": lambda w: w.sum() - 1, "jac": lambda w: np.ones(n)},
+        )
+        for i, l in enumerate(lambdas):
+            solution = minimize(
+                lambda w: w @ cov @ w / 2 - l * mu @ w,
+                x0,
+                jac=lambda w: cov @ w - l * mu,
+                bounds=[(0, 1)] * n,
+                constraints=constraints,
+                method="SLSQP",
+                options={"ftol": tol, "maxiter": 1000},
+            )
+            weights[i] = x0 = solution.x
+    elif long_only:
+        raise ValueError('Parameter method can only have two values: "batch" or "slsqp"')
+
+    returns, stds = portfolio_stats(weights, mu, cov)
+    print(
+        "[LOG] - Frontier of %d points over %d assets computed in %.2f seconds"
+        % (len(lambdas), len(mu), time.perf_counter() - start)
+    )
+    frontier = pd.DataFrame({"lambda": lambdas, "return": returns, "std": stds})
+    return frontier, weights
+
+
+def make_portfolio_problem(mu, cov, **kwargs):
+    """
+    Builds the pymoo version of the two objective (risk, -return) portfolio problem of studies/2_genetic_markowitz.ipynb,
+    evaluated for the whole population with one matrix product instead of one individual at a time
+    INPUTS
+    mu: [Obligatory] expected returns of the assets
+    cov: [Obligatory] covariance matrix of the assets
+    kwargs: [Optional] passed to pymoo's Problem
+    OUTPUT
+    (problem, repair) to be passed to a pymoo algorithm, e.g. NSGA2(repair=repair)
+    """
+    from pymoo.core.problem import Problem
+    from pymoo.core.repair import Repair
+
+    class PortfolioProblem(Problem):
+        def __init__(self, mu, cov, **kwargs):
+            super().__init__(n_var=len(mu), n_obj=2, xl=0.0, xu=1.0, **kwargs)
+            self.mu = mu
+            self.cov = cov
+
+        def _evaluate(self, X, out, *args, **kwargs):
+            exp_return, exp_risk = portfolio_stats(X, self.mu, self.cov)
+            out["F"] = np.column_stack([exp_risk, -exp_return])
+
+    class PortfolioRepair(Repair):
+        def _do(self, problem, X, **kwargs):
+            X[X < 1e-3] = 0
+            return X / X.sum(axis=1, keepdims=True)
+
+    return PortfolioProblem(np.asarray(mu), np.asarray(cov), **kwargs), PortfolioRepair()
+
+
+def genetic_frontier(mu, cov, pop_size=100, n_gen=None, seed=42, verbose=False):
+    """
+    Approximates the long-only frontier with NSGA2 on the vectorized PortfolioProblem
+    INPUTS
+    mu: [Obligatory] expected returns of the assets
+    cov: [Obligatory] covariance matrix of the assets
+    pop_size: [Optional, default = 100] population size
+    n_gen: [Optional, default = None] number of generations. If None pymoo's default termination is used
+    seed: [Optional, default = 42] seed of the algorithm
+    verbose: [Optional, default = False] whether pymoo prints its progress
+    OUTPUT
+    (frontier, weights): DataFrame with return and std per solution and the weights array (solutions x assets)
+    """
+    from pymoo.algorithms.moo.nsga2 import NSGA2
+    from pymoo.optimize import minimize
+
+    problem, repair = make_portfolio_problem(mu, cov)
+    termination = ("n_gen", n_gen) if n_gen is not None else None
+    res = minimize(
+        problem,
+        NSGA2(pop_size=pop_size, repair=repair),
+        termination,
+        seed=seed,
+        verbose=verbose,
+    )
+    X, F = res.opt.get("X", "F")
+    frontier = pd.DataFrame({"return": -F[:, 1], "std": F[:, 0]})
+    order = np.argsort(frontier["std"].values)
+    return frontier.iloc[order].reset_index(drop=True), X[order]
@@ -0,0 +1,144 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import os
+import sys
+import time
+from array import array
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+sys.path.append("../libraries/backtrader")
+from backtrader import Analyzer
+
+STRATEGY_METHODS = ("_next", "next", "prenext", "nextstart", "notify_order", "notify_trade")
+ANALYZER_METHODS = (
+    "next",
+    "notify_cashvalue",
+    "notify_fund",
+    "notify_order",
+    "notify_trade",
+    "stop",
+)
+SIZER_METHODS = ("_getsizing",)
+INDICATOR_METHODS = ("_next", "_once")
+
+
+class CallProfiler(object):
+    """
+    Records the call count and the duration of every call of the callbacks it instruments
+    """
+
+    def __init__(self):
+        self.timings = OrderedDict()
+
+    def wrap(self, name, func):
+        """
+        Returns func wrapped so that the duration of each call is recorded under name
+        """
+        timings = self.timings.setdefault(name, array("d"))
+        perf_counter = time.perf_counter
+
+        def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                timings.append(perf_counter() - start)
+
+        return wrapper
+
+    def record(self, name, duration):
+        """
+        Records a duration (seconds) measured elsewhere under name, e.g. a latency
+        """
+        self.timings.setdefault(name, array("d")).append(duration)
+
+    def instrument(self, obj, prefix, methods):
+        """
+        Replaces the given methods of an object, only for that instance, by timed versions
+        INPUTS
+        obj: [Obligatory] the strategy, analyzer, sizer or indicator to instrument
+        prefix: [Obligatory] name under which its callbacks are reported
+        methods: [Obligatory] names of the methods to time. Missing ones are skipped
+        """
+        for method in methods:
+            func = getattr(obj, method, None)
+            if func is not None and callable(func):
+                setattr(obj, method, self.wrap("%s.%s" % (prefix, method), func))
+
+    def to_frame(self):
+        """
+        Returns a DataFrame with the count, total, mean, percentiles and max duration (seconds) of every callback
+        """
+        rows = list()
+        for name, timings in self.timings.items():
+            if not len(timings):
+                continue
+            values = np.frombuffer(timings, dtype=np.float64)
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            rows.append(
+                {
+                    "callback": name,
+                    "calls": len(values),
+                    "total": values.sum(),
+                    "mean": values.mean(),
+                    "p50": p50,
+                    "p95": p95,
+                    "p99": p99,
+                    "max": values.max(),
+                }
+            )
+        df = pd.DataFrame(
+            rows,
+            columns=["callback", "calls", "total", "mean", "p50", "p95", "p99", "max"],
+        )
+        return df.sort_values("total", ascending=False).reset_index(drop=True)
+
+
+class Profiler(Analyzer):
+    """
+    Instruments the strategy, its indicators, sizer and the other analyzers when the run starts, and writes
+    profile.csv in log_path when it stops. It must be added after the other analyzers so that they are already
+    created, which run_backtest_full(profile=True) does. Nothing is instrumented if it is not added.
+    """
+
+    params = (("log_path", None),)
+
+    def __init__(self):
+        self.profiler = CallProfiler()
+
+    def start(self):
+        strategy = self.strategy
+        self.profiler.instrument(
+            strategy, "strategy.%s" % strategy.__class__.__name__, STRATEGY_METHODS
+        )
+        for i, indicator in enumerate(strategy.getindicators()):
+            self.profiler.instrument(
+                indicator,
+                "indicator.%d.%s" % (i, indicator.__class__.__name__),
+                INDICATOR_METHODS,
+            )
+        sizer = strategy.getsizer()
+        self.profiler.instrument(
+            sizer, "sizer.%s" % sizer.__class__.__name__, SIZER_METHODS
+        )
+        for analyzer in strategy.analyzers:
+            if analyzer is not self:
+                self.profiler.instrument(
+                    analyzer,
+                    "analyzer.%s" % analyzer.__class__.__name__,
+                    ANALYZER_METHODS,
+                )
+
+    def stop(self):
+        if self.p.log_path is None:
+            return
+        if not os.path.exists(self.p.log_path):
+            os.makedirs(self.p.log_path)
+        self.get_analysis().to_csv(os.path.join(self.p.log_path, "profile.csv"))
+        print("[LOG] - Profile logged")
+
+    def get_analysis(self):
+        return self.profiler.to_frame()
@@ -0,0 +1,125 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import math
+import sys
+
+sys.path.append("../libraries/backtrader")
+import backtrader as bt
+
+sys.path.append("../")
+from utils.rolling import WindowMoments
+
+
+class RiskMonitor(bt.Analyzer):
+    """
+    Keeps the equity, drawdown, rolling Sharpe ratio and trade statistics of a run up to date bar by bar, in O(1) per bar,
+    and stops the run as soon as one of its pruning rules is broken. A stopped run is marked as pruned in get_analysis().
+    Rules are checked every bar:
+    - max_drawdown_frac: the drawdown from the highest equity exceeds this fraction, e.g. 0.4 for 40%. The max_drawdown
+      column of run_backtest_metrics and run_sweep is a percentage instead (40 for 40%)
+    - min_equity: the equity is below this fraction of the initial one at or after bar min_equity_bar, e.g. 0.8 and 252
+    - rules: functions receiving the RiskMonitor that return a reason (str) to stop the run, or None to continue
+    """
+
+    params = (
+        ("max_drawdown_frac", None),
+        ("min_equity", None),
+        ("min_equity_bar", 0),
+        ("rules", None),
+        ("window", 252),
+        ("periods", 252),
+        ("stop", True),
+    )
+
+    def start(self):
+        self.initial = self.strategy.broker.getvalue()
+        self.equity = self.initial
+        self.peak = self.initial
+        self.drawdown = 0.0
+        self.max_drawdown = 0.0
+        self.bars = 0
+        self.returns = WindowMoments(1, self.p.window)
+        self.n_trades = 0
+        self.n_won = 0
+        self.gross_profit = 0.0
+        self.gross_loss = 0.0
+        self.pruned = False
+        self.reason = None
+        self.pruned_bar = None
+
+    @property
+    def sharpe(self):
+        """Annualized Sharpe ratio of the last window bars, with no risk free rate"""
+        if self.returns.count < 2:
+            return float("nan")
+        std = math.sqrt(max(self.returns.cov[0, 0], 0.0))
+        if std == 0:
+            return float("nan")
+        return self.returns.mean[0] / std * math.sqrt(self.p.periods)
+
+    def next(self):
+        if self.pruned:
+            return
+        value = self.strategy.broker.getvalue()
+        if self.bars:
+            self.returns.update((value / self.equity - 1 if self.equity else 0.0,))
+        self.bars += 1
+        self.equity = value
+        self.peak = max(self.peak, value)
+        self.drawdown = 1 - value / self.peak if self.peak > 0 else 0.0
+        self.max_drawdown = max(self.max_drawdown, self.drawdown)
+
+        reason = self._check()
+        if reason is not None:
+            self.pruned = True
+            self.reason = reason
+            self.pruned_bar = self.bars
+            if self.p.stop:
+                self.strategy.env.runstop()
+
+    def _check(self):
+        if self.p.max_drawdown_frac is not None and self.drawdown > self.p.max_drawdown_frac:
+            return "drawdown %.4g%% > %.4g%%" % (100 * self.drawdown, 100 * self.p.max_drawdown_frac)
+        if (
+            self.p.min_equity is not None
+            and self.bars >= self.p.min_equity_bar
+            and self.equity < self.p.min_equity * self.initial
+        ):
+            return "equity %.2f < %.4g%% of %.2f at bar %d" % (
+                self.equity,
+                100 * self.p.min_equity,
+                self.initial,
+                self.bars,
+            )
+        for rule in self.p.rules or ():
+            reason = rule(self)
+            if reason is not None:
+                return reason
+        return None
+
+    def notify_trade(self, trade):
+        if not trade.isclosed:
+            return
+        self.n_trades += 1
+        if trade.pnlcomm > 0:
+            self.n_won += 1
+            self.gross_profit += trade.pnlcomm
+        else:
+            self.gross_loss -= trade.pnlcomm
+
+    def get_analysis(self):
+        return {
+            "equity": self.equity,
+            "drawdown_frac": self.drawdown,
+            "max_drawdown_frac": self.max_drawdown,
+            "rolling_sharpe": self.sharpe,
+            "bars": self.bars,
+            "n_trades": self.n_trades,
+            "win_rate": self.n_won / self.n_trades if self.n_trades else float("nan"),
+            "profit_factor": self.gross_profit / self.gross_loss
+            if self.gross_loss
+            else float("nan"),
+            "pruned": self.pruned,
+            "reason": self.reason,
+            "pruned_bar": self.pruned_bar,
+        }
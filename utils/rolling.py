@@ -0,0 +1,249 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import time
+
+import numpy as np
+import pandas as pd
+
+
+class ExpandingMoments(object):
+    """
+    Mean and covariance of all the observations seen so far, updated in O(n_assets^2) per observation (Welford)
+    """
+
+    def __init__(self, n_assets, covariance=True):
+        """
+        INPUTS
+        n_assets: [Obligatory] length of each observation
+        covariance: [Optional, default = True] whether to track the covariance. If False updates are O(n_assets)
+        """
+        self.n_assets = n_assets
+        self.covariance = covariance
+        self.count = 0
+        self.mean = np.zeros(n_assets)
+        self._m2 = np.zeros((n_assets, n_assets)) if covariance else None
+
+    def _add(self, x):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        if self.covariance:
+            self._m2 += np.outer(delta, x - self.mean)
+
+    def update(self, x):
+        """
+        Adds a new observation
+        """
+        self._add(np.asarray(x, dtype=np.float64))
+
+    @property
+    def cov(self):
+        """Sample covariance (ddof = 1) of the tracked observations"""
+        if self.count < 2:
+            return np.full((self.n_assets, self.n_assets), np.nan)
+        return self._m2 / (self.count - 1)
+
+
+class WindowMoments(ExpandingMoments):
+    """
+    Mean and covariance of the last window observations, updated in O(n_assets^2) per observation by adding the new one and
+    removing the oldest. They are recomputed from the window every window updates so that rounding errors do not accumulate
+    """
+
+    def __init__(self, n_assets, window, covariance=True):
+        """
+        INPUTS
+        n_assets: [Obligatory] length of each observation
+        window: [Obligatory] number of observations kept
+        covariance: [Optional, default = True] whether to track the covariance
+        """
+        super(WindowMoments, self).__init__(n_assets, covariance=covariance)
+        self.window = window
+        self._buffer = np.zeros((window, n_assets))
+        self._position = 0
+        self._updates = 0
+
+    def _remove(self, x):
+        self.count -= 1
+        if self.count == 0:
+            self.mean[:] = 0
+            if self.covariance:
+                self._m2[:] = 0
+            return
+        delta = x - self.mean
+        self.mean -= delta / self.count
+        if self.covariance:
+            self._m2 -= np.outer(delta, x - self.mean)
+
+    def update(self, x):
+        x = np.asarray(x, dtype=np.float64)
+        if self.count == self.window:
+            self._remove(self._buffer[self._position])
+        self._buffer[self._position] = x
+        self._position = (self._position + 1) % self.window
+        self._add(x)
+        self._updates += 1
+        if self._updates % self.window == 0:
+            self.mean = self._buffer.mean(axis=0)
+            if self.covariance:
+                centered = self._buffer - self.mean
+                self._m2 = centered.T @ centered
+
+
+class EWMAMoments(ExpandingMoments):
+    """
+    Exponentially weighted mean and covariance, updated in O(n_assets^2) per observation
+    """
+
+    def __init__(self, n_assets, halflife=None, alpha=None, covariance=True):
+        """
+        INPUTS
+        n_assets: [Obligatory] length of each observation
+        halflife: [Optional, default = None] number of observations after which the weight of an observation halves
+        alpha: [Optional, default = None] smoothing factor, used if halflife is not given
+        covariance: [Optional, default = True] whether to track the covariance
+        """
+        super(EWMAMoments, self).__init__(n_assets, covariance=covariance)
+        if halflife is not None:
+            alpha = 1 - np.exp(np.log(0.5) / halflife)
+        if alpha is None or not 0 < alpha <= 1:
+            raise ValueError("Either halflife or alpha in (0, 1] must be provided")
+        self.alpha = alpha
+        self._cov = np.zeros((n_assets, n_assets))
+
+    def _add(self, x):
+        self.count += 1
+        if self.count == 1:
+            self.mean[:] = x
+            return
+        delta = x - self.mean
+        self.mean += self.alpha * delta
+        if self.covariance:
+            self._cov = (1 - self.alpha) * (self._cov + self.alpha * np.outer(delta, delta))
+
+    @property
+    def cov(self):
+        if self.count < 2:
+            return np.full((self.n_assets, self.n_assets), np.nan)
+        return self._cov
+
+
+def make_estimator(n_assets, estimator="expanding", window=None, halflife=None, covariance=True):
+    """
+    Creates one of the moment estimators by name: "expanding", "window" (needs window) or "ewma" (needs halflife)
+    """
+    if estimator == "expanding":
+        return ExpandingMoments(n_assets, covariance=covariance)
+    if estimator == "window":
+        return WindowMoments(n_assets, window, covariance=covariance)
+    if estimator == "ewma":
+        return EWMAMoments(n_assets, halflife=halflife, covariance=covariance)
+    raise ValueError('Parameter estimator can only be "expanding", "window" or "ewma"')
+
+
+def max_sharpe_portfolio(expected_returns, cov_matrix, risk_free_rate, x0=None):
+    """
+    Long-only maximum Sharpe ratio portfolio, as calculate_mean_variance_portfolio in
+    studies/4_1_over_N_vs_Markowitz_vs_Continuous_Markowitz.ipynb, with an analytic gradient and a starting point
+    INPUTS
+    expected_returns: [Obligatory] expected returns of the assets
+    cov_matrix: [Obligatory] covariance matrix of the assets
+    risk_free_rate: [Obligatory] risk free rate, in the same units as the returns
+    x0: [Optional, default = None] starting weights, usually the previous solution. If None 1/N
+    OUTPUT
+    (optimal_weights, optimal_sharpe_ratio)
+    """
+    from scipy.optimize import minimize
+
+    num_assets = len(expected_returns)
+    excess = np.asarray(expected_returns) - risk_free_rate
+
+    def objective(weights):
+        variance = weights @ cov_matrix @ weights
+        std = np.sqrt(variance)
+        ret = weights @ excess
+        gradient = -(excess * std - ret * (cov_matrix @ weights) / std) / variance
+        return -ret / std, gradient
+
+    initial_weights = np.ones(num_assets) / num_assets if x0 is None else x0
+    result = minimize(
+        objective,
+        initial_weights,
+        jac=True,
+        method="SLSQP",
+        bounds=[(0, 1)] * num_assets,
+        constraints=(
+            {
+                "type": "eq",
+                "fun": lambda weights: np.sum(weights) - 1,
+                "jac": lambda weights: np.ones(num_assets),
+            },
+        ),
+    )
+    return result.x, -result.fun
+
+
+def run_rebalancing(
+    log_returns,
+    start_investing=None,
+    estimator="expanding",
+    window=None,
+    halflife=None,
+    rebalance_every=1,
+    risk_free_rate=0.02,
+    trading_days=252,
+    min_periods=2,
+):
+    """
+    Backtests a maximum Sharpe portfolio rebalanced as new data arrives ("continuous Markowitz").
+    The annualized expected returns and covariance are updated incrementally instead of recomputed from the whole history,
+    and each optimization starts from the previous weights
+    INPUTS
+    log_returns: [Obligatory] DataFrame of daily log returns, one column per asset, indexed by date
+    start_investing: [Optional, default = None] date from which the portfolio is invested. Before it the weights are 0. If None as soon as min_periods observations are available
+    estimator: [Optional, default = "expanding"] "expanding", "window" or "ewma", see make_estimator
+    window: [Optional, default = None] observations used by the "window" estimator
+    halflife: [Optional, default = None] halflife in observations of the "ewma" estimator
+    rebalance_every: [Optional, default = 1] observations between two rebalances
+    risk_free_rate: [Optional, default = 0.02] yearly risk free rate
+    trading_days: [Optional, default = 252] observations per year, used to annualize
+    min_periods: [Optional, default = 2] observations needed before the first optimization
+    OUTPUT
+    (wealth_evolution, weights): the wealth Series starting at 1 and the weights DataFrame, as calculate_dynamic_wealth_evolution in the notebook
+    """
+    values = log_returns.values.astype(np.float64)
+    n_obs, n_assets = values.shape
+    # As in the notebook: returns from the log returns mean, covariance from the simple returns
+    mean_estimator = make_estimator(n_assets, estimator, window, halflife, covariance=False)
+    cov_estimator = make_estimator(n_assets, estimator, window, halflife)
+    first = 0 if start_investing is None else log_returns.index.searchsorted(start_investing)
+
+    start = time.perf_counter()
+    weights = np.zeros((n_obs, n_assets))
+    current = np.zeros(n_assets)
+    previous = None
+    since_rebalance = rebalance_every
+    for t in range(n_obs):
+        if t >= first and cov_estimator.count >= max(min_periods, 2):
+            if since_rebalance >= rebalance_every:
+                expected_returns = np.exp(mean_estimator.mean * trading_days) - 1
+                current, _ = max_sharpe_portfolio(
+                    expected_returns,
+                    cov_estimator.cov * trading_days,
+                    risk_free_rate,
+                    x0=previous,
+                )
+                previous = current
+                since_rebalance = 0
+            since_rebalance += 1
+        weights[t] = current
+        mean_estimator.update(values[t])
+        cov_estimator.update(np.expm1(values[t]))
+    print(
+        "[LOG] - %d observations of %d assets rebalanced in %.2f seconds"
+        % (n_obs, n_assets, time.perf_counter() - start)
+    )
+
+    weights = pd.DataFrame(weights, index=log_returns.index, columns=log_returns.columns)
+    wealth_evolution = np.exp((log_returns * weights).sum(axis=1).cumsum())
+    return wealth_evolution, weights
@@ -0,0 +1,130 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import sys
+
+sys.path.append("../")
+from utils.datastore import _atomic_write
+
+RUN_CACHE_PATH = "../backtests/.runcache"
+
+# Content hashes of the files already read by this process, keyed by (path, size, mtime)
+_file_hashes = dict()
+
+
+def file_fingerprint(path):
+    """
+    Hash of the contents of a file. It is only read again if its size or modification time changed
+    INPUTS
+    path: [Obligatory] path of the file, usually the csv of a backtest
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    signature = (path, stat.st_size, stat.st_mtime_ns)
+    if signature not in _file_hashes:
+        digest = hashlib.blake2b(digest_size=16)
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        _file_hashes[signature] = digest.hexdigest()
+    return _file_hashes[signature]
+
+
+def _class_source(cls):
+    try:
+        return inspect.getsource(cls)
+    except (OSError, TypeError):
+        # Classes defined in a notebook cell may have no retrievable source, their bytecode is used instead
+        parts = [cls.__name__]
+        for name, value in sorted(vars(cls).items()):
+            code = getattr(value, "__code__", None)
+            if code is not None:
+                parts.append("%s %s %r" % (name, code.co_code.hex(), code.co_consts))
+        return "\n".join(parts)
+
+
+def class_fingerprint(cls):
+    """
+    Hash of the source of a class and of the classes it inherits from, except backtrader's own, and of its params.
+    Changing the code of a strategy, sizer or analyzer therefore changes its fingerprint. Module level functions
+    it calls are not included
+    INPUTS
+    cls: [Obligatory] the class, e.g. a strategy
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for base in inspect.getmro(cls):
+        module = getattr(base, "__module__", "")
+        if base is object or module == "builtins" or module.startswith("backtrader"):
+            continue
+        digest.update(_class_source(base).encode("utf-8"))
+    params = getattr(cls, "params", None)
+    if params is not None and hasattr(params, "_gettuple"):
+        digest.update(repr(params._gettuple()).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def run_key(strategy, datapath, strategy_params=None, analyzers=None, **settings):
+    """
+    Key of a backtest: a hash of the strategy's code and parameters, the analyzers' code, the contents of the data
+    file and any other setting that changes the results (init_cash, commission, margin, mult...)
+    INPUTS
+    strategy: [Obligatory] the strategy class
+    datapath: [Obligatory] path of the data file
+    strategy_params: [Optional, default = None] dictionary with the parameters passed to the strategy
+    analyzers: [Optional, default = None] list of analyzer classes
+    settings: [Optional] other settings of the run, they must be representable with repr
+    """
+    inputs = {
+        "strategy": [strategy.__name__, class_fingerprint(strategy)],
+        "strategy_params": sorted((k, repr(v)) for k, v in (strategy_params or {}).items()),
+        "analyzers": [[a.__name__, class_fingerprint(a)] for a in (analyzers or [])],
+        "data": file_fingerprint(datapath),
+        "settings": sorted((k, repr(v)) for k, v in settings.items()),
+    }
+    return hashlib.blake2b(
+        json.dumps(inputs, sort_keys=True).encode("utf-8"), digest_size=16
+    ).hexdigest()
+
+
+def _entry_path(key, kind, cache_path):
+    return os.path.join(cache_path, kind, key + ".json")
+
+
+def load_entry(key, kind="full", cache_path=RUN_CACHE_PATH):
+    """
+    Returns what was saved for a run key, or None if it was never run
+    INPUTS
+    key: [Obligatory] the key, see run_key
+    kind: [Optional, default = "full"] "full" for run_backtest_full (the log_path), "metrics" for run_backtest_metrics
+    cache_path: [Optional, default = "../backtests/.runcache"] folder of the cache
+    """
+    try:
+        with open(_entry_path(key, kind, cache_path), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_entry(key, value, kind="full", cache_path=RUN_CACHE_PATH):
+    """
+    Saves the result of a run under its key, see load_entry. The value must be serializable as json
+    """
+    folder = os.path.join(cache_path, kind)
+    if not os.path.exists(folder):
+        os.makedirs(folder, exist_ok=True)
+    _atomic_write(
+        _entry_path(key, kind, cache_path),
+        lambda f: f.write(json.dumps(value).encode("utf-8")),
+    )
+
+
+def clear_run_cache(cache_path=RUN_CACHE_PATH):
+    """
+    Forgets all the cached runs. The backtest folders themselves are not removed
+    """
+    if os.path.exists(cache_path):
+        shutil.rmtree(cache_path)
@@ -11,7 +11,13 @@ import backtrader as bt
 
 
 class Ludopata(bt.Sizer):
-    params = (("percent", 0.5),)
+    """
+    Buys with a percent of the cash when there is no position and sells the whole position.
+    With split = True, for strategies trading many datas, each asset gets an equal share: percent of the portfolio value
+    divided by the number of assets (resampled copies of a data are not counted), limited by the available cash
+    """
+
+    params = (("percent", 0.5), ("split", False))
 
     def __init__(self):
         self.percent = self.params.percent
@@ -23,7 +29,11 @@ class Ludopata(bt.Sizer):
         position = self.strategy.getposition(data)
         if isbuy == True and not position:
             # size = cash * (self.percent - comminfo.commission)
-            size = self.percent * cash / data[0]
+            if self.params.split:
+                budget = self.percent * self.broker.getvalue() / self._n_assets()
+                size = min(budget, cash) / data[0]
+            else:
+                size = self.percent * cash / data[0]
         elif isbuy == False and position:
             # size = self.position
             size = position.size
@@ -32,6 +42,14 @@ class Ludopata(bt.Sizer):
 
         return size
 
+    def _n_assets(self):
+        # Resampled copies of a data (DataClone) are the same asset
+        if getattr(self, "n_assets", None) is None:
+            self.n_assets = len(
+                [d for d in self.strategy.datas if not isinstance(d, bt.DataClone)]
+            )
+        return self.n_assets
+
 
 class FixedSize(bt.Sizer):
     params = (("stake", 1),)
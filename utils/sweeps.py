@@ -0,0 +1,153 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import itertools
+import multiprocessing as mp
+import sys
+import time
+
+import pandas as pd
+
+sys.path.append("../")
+from utils.basic import load_data, run_backtest_metrics
+from utils.indicators import configure_cache
+from utils.runcache import load_entry, run_key, save_entry
+from utils.testers import TestStrategyComplete
+
+
+# Data loaded once per worker process by _init_worker
+_worker_data = dict()
+
+
+def expand_grid(param_grid):
+    """
+    Expands a parameter grid into the list of parameter combinations
+    INPUTS
+    param_grid: [Obligatory] dictionary of parameter name to list of values, or a list of such dictionaries, or a list of already expanded combinations
+    """
+    if isinstance(param_grid, dict):
+        param_grid = [param_grid]
+    combinations = list()
+    for grid in param_grid:
+        if all(isinstance(v, (list, tuple, range)) for v in grid.values()):
+            keys = list(grid.keys())
+            for values in itertools.product(*[grid[k] for k in keys]):
+                combinations.append(dict(zip(keys, values)))
+        else:
+            combinations.append(dict(grid))
+    return combinations
+
+
+def _init_worker(datapath, indicator_cache_path=None):
+    _worker_data["df"] = load_data(datapath)
+    if indicator_cache_path is not None:
+        configure_cache(path=indicator_cache_path)
+
+
+def _run_combination(task):
+    strategy, params, run_kwargs = task
+    row = dict(params)
+    try:
+        row.update(
+            run_backtest_metrics(
+                strategy=strategy,
+                data_df=_worker_data["df"],
+                strategy_params=params,
+                **run_kwargs,
+            )
+        )
+        row["error"] = None
+    except Exception as e:
+        row["error"] = repr(e)
+    return row
+
+
+def run_sweep(
+    strategy=TestStrategyComplete,
+    param_grid=None,
+    datapath="../data/us/daily/aapl.csv",
+    processes=None,
+    chunksize=1,
+    init_cash=100000.0,
+    commission=0.00,
+    margin=None,
+    mult=1.0,
+    results_path=None,
+    indicator_cache_path=None,
+    cache=False,
+    prune=None,
+):
+    """
+    Runs a strategy over a grid of parameters in parallel and returns a table with the results of every combination
+    INPUTS
+    strategy: [Optional, default = TestStrategyComplete] the strategy to test
+    param_grid: [Obligatory] dictionary of parameter name to list of values, e.g. {"maperiodf": range(5, 30), "maperiods": range(30, 100, 5)}. A list of dictionaries is also accepted
+    datapath: [Optional, defalut = "../data/us/daily/aapl.csv"] path of the csv where the backtest data is. It is loaded once per worker
+    processes: [Optional, default = None] number of worker processes. If None the number of cores is used
+    chunksize: [Optional, default = 1] number of combinations sent to a worker at a time. Increase it for many very short runs
+    init_cash, commission, margin, mult: [Optional] broker settings, as in run_backtest_full
+    results_path: [Optional, default = None] if provided, path of a .csv where the results table is also saved
+    indicator_cache_path: [Optional, default = None] folder where the workers share the indicators of strategies using utils.indicators.cached_indicator (e.g. TaLib_SMACross with use_cache = True). If None each worker keeps its own in memory
+    cache: [Optional, default = False] whether to reuse the results of combinations already run with the same strategy code, data file and broker settings (see utils.runcache), running only the new ones. Failed combinations are always run again
+    prune: [Optional, default = None] dictionary with the pruning rules of utils.risk.RiskMonitor, e.g. {"max_drawdown_frac": 0.4} for a 40% drawdown. Combinations breaking one are stopped early and marked in the pruned and pruned_bar columns. Custom rules must be module level functions, so that they can be sent to the workers
+    OUTPUT
+    DataFrame with one row per combination: the parameters, final_value, sharpe, max_drawdown (percentage, 40 for 40%), n_trades, runtime and error, plus cached if cache is True
+    """
+    if param_grid is None:
+        raise ValueError("Parameter param_grid must be provided")
+    combinations = expand_grid(param_grid)
+    run_kwargs = dict(
+        init_cash=init_cash, commission=commission, margin=margin, mult=mult
+    )
+    if prune is not None:
+        run_kwargs["prune"] = prune
+
+    rows = list()
+    pending = combinations
+    keys = list()
+    if cache:
+        pending = list()
+        for params in combinations:
+            key = run_key(strategy, datapath, params, **run_kwargs)
+            entry = load_entry(key, kind="metrics")
+            if entry is None:
+                pending.append(params)
+                keys.append(key)
+            else:
+                rows.append(dict(params, **entry))
+                rows[-1]["cached"] = True
+        if rows:
+            print("[LOG] - %d combinations found in cache" % len(rows))
+    tasks = [(strategy, params, run_kwargs) for params in pending]
+
+    start = time.perf_counter()
+    if tasks:
+        with mp.Pool(
+            processes, initializer=_init_worker, initargs=(datapath, indicator_cache_path)
+        ) as pool:
+            results = pool.imap(_run_combination, tasks, chunksize=chunksize)
+            for i, row in enumerate(results):
+                if cache:
+                    row["cached"] = False
+                    if row["error"] is None:
+                        metrics = {
+                            k: v for k, v in row.items() if k not in pending[i] and k != "cached"
+                        }
+                        save_entry(keys[i], metrics, kind="metrics")
+                rows.append(row)
+    print(
+        "[LOG] - %d combinations run in %.2f seconds"
+        % (len(tasks), time.perf_counter() - start)
+    )
+
+    df = pd.DataFrame(rows)
+    params = list(dict.fromkeys(k for c in combinations for k in c))
+    if params:
+        df = df.sort_values(params).reset_index(drop=True)
+    if prune is not None and "pruned" in df:
+        print("[LOG] - %d combinations pruned" % df["pruned"].eq(True).sum())
+    n_errors = df["error"].notna().sum() if len(df) else 0
+    if n_errors:
+        print("[WARNING] - %d combinations failed, see the error column" % n_errors)
+    if results_path is not None:
+        df.to_csv(results_path)
+    return df
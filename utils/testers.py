@@ -116,4 +116,37 @@ class TestStrategyComplete(bt.Strategy):
                 self.log('SELL CREATE, %.2f' % self.dataclose[0])
 
                 # Keep track of the created order to avoid a 2nd order
-                self.order = self.sell()
\ No newline at end of file
+                self.order = self.sell()
+
+# Create a Stratey trading every data with its own moving average
+class TestStrategyMulti(bt.Strategy):
+    params = (
+        ('maperiod', 15),
+    )
+
+    def __init__(self):
+        # Resampled copies of a data are not assets of their own, they are not traded
+        self.assets = [d for d in self.datas if not isinstance(d, bt.DataClone)]
+        # One moving average and one pending order per asset
+        self.smas = [bt.indicators.SimpleMovingAverage(
+            d, period=self.params.maperiod) for d in self.assets]
+        self.orders = dict()
+
+    def notify_order(self, order):
+        if order.status in [order.Submitted, order.Accepted]:
+            return
+        self.orders[order.data._name] = None
+
+    def prenext(self):
+        # Assets start trading at different dates, do not wait for all of them
+        self.next()
+
+    def next(self):
+        for d, sma in zip(self.assets, self.smas):
+            if len(d) < self.params.maperiod or self.orders.get(d._name):
+                continue
+            if not self.getposition(d):
+                if d.close[0] > sma[0]:
+                    self.orders[d._name] = self.buy(data=d)
+            elif d.close[0] < sma[0]:
+                self.orders[d._name] = self.sell(data=d)
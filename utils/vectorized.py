@@ -0,0 +1,292 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.append("../libraries/backtrader")
+import backtrader as bt
+
+sys.path.append("../")
+from utils.basic import load_data
+
+
+def sma(values, period):
+    """
+    Simple moving average of the columns of an array. The first period - 1 values are NaN, as in backtrader
+    INPUTS
+    values: [Obligatory] 1-D or 2-D (bars x series) array
+    period: [Obligatory] number of bars of the average
+    """
+    values = np.asarray(values, dtype=np.float64)
+    out = np.full(values.shape, np.nan)
+    if period > len(values):
+        return out
+    csum = np.cumsum(values, axis=0)
+    out[period - 1] = csum[period - 1]
+    out[period:] = csum[period:] - csum[:-period]
+    out[period - 1 :] /= period
+    return out
+
+
+def _ffill_index(mask):
+    """For every bar, the index of the last bar where mask was True (0 if none yet)"""
+    idx = np.arange(mask.shape[0]).reshape((-1,) + (1,) * (mask.ndim - 1))
+    return np.maximum.accumulate(np.where(mask, idx, 0), axis=0)
+
+
+def crossover(fast, slow):
+    """
+    Same as backtrader's CrossOver: 1 when fast crosses slow upwards, -1 downwards and 0 otherwise.
+    Equal values do not reset the previous side of the cross
+    INPUTS
+    fast, slow: [Obligatory] 1-D or 2-D arrays of the same shape
+    """
+    diff = np.asarray(fast, dtype=np.float64) - np.asarray(slow, dtype=np.float64)
+    # Non zero difference: zeros keep the sign of the previous difference
+    nonzero = diff != 0
+    nzd = np.take_along_axis(diff, _ffill_index(nonzero), axis=0)
+    prev = np.full(nzd.shape, np.nan)
+    prev[1:] = nzd[:-1]
+    cross = np.zeros(diff.shape)
+    cross[(prev < 0) & (diff > 0)] = 1.0
+    cross[(prev > 0) & (diff < 0)] = -1.0
+    return cross
+
+
+def sma_signals(close, period):
+    """
+    Entry and exit signals of TestStrategyComplete and Sample01: buy when close is above its SMA, sell when below
+    INPUTS
+    close: [Obligatory] 1-D array of close prices
+    period: [Obligatory] int or list of ints (maperiod). A list returns one column per period
+    """
+    close = np.asarray(close, dtype=np.float64)
+    periods = np.atleast_1d(period)
+    average = np.column_stack([sma(close, p) for p in periods])
+    close = close[:, None]
+    entries, exits = close > average, close < average
+    if np.ndim(period) == 0:
+        return entries[:, 0], exits[:, 0]
+    return entries, exits
+
+
+def sma_cross_signals(close, fast_period, slow_period):
+    """
+    Entry and exit signals of TaLib_SMACross: buy when the fast SMA crosses the slow one upwards, sell when downwards
+    INPUTS
+    close: [Obligatory] 1-D array of close prices
+    fast_period, slow_period: [Obligatory] ints (maperiodf, maperiods) or lists of ints of the same length. Lists return one column per pair
+    """
+    close = np.asarray(close, dtype=np.float64)
+    fast_periods = np.atleast_1d(fast_period)
+    slow_periods = np.atleast_1d(slow_period)
+    # Each distinct period is computed once, however many pairs use it
+    cache = dict()
+    for p in set(fast_periods) | set(slow_periods):
+        cache[p] = sma(close, p)
+    fast = np.column_stack([cache[p] for p in fast_periods])
+    slow = np.column_stack([cache[p] for p in slow_periods])
+    cross = crossover(fast, slow)
+    entries, exits = cross > 0, cross < 0
+    if np.ndim(fast_period) == 0:
+        return entries[:, 0], exits[:, 0]
+    return entries, exits
+
+
+def run_vectorized(
+    data_df,
+    entries,
+    exits,
+    stake=1,
+    init_cash=100000.0,
+    commission=0.00,
+    mult=1.0,
+):
+    """
+    Simulates long-only signal strategies with whole-array operations. Orders decided on the close of a bar
+    are filled at the open of the next one, and commission and mult follow backtrader's stock-like scheme,
+    as in run_backtest_full with margin = None. Orders are always assumed to have enough cash
+    INPUTS
+    data_df: [Obligatory] DataFrame as returned by load_data
+    entries: [Obligatory] boolean array, True where the strategy buys if it is flat. 2-D (bars x sets) runs one parameter set per column
+    exits: [Obligatory] boolean array of the same shape, True where the strategy sells if it is in the market
+    stake: [Optional, default = 1] number of shares bought, as the default backtrader sizer
+    init_cash, commission, mult: [Optional] broker settings, as in run_backtest_full
+    OUTPUT
+    dictionary with the equity curve (bars x sets), positions, final_value and n_trades (closed trades) per set
+    """
+    entries = np.asarray(entries, dtype=bool)
+    exits = np.asarray(exits, dtype=bool)
+    squeeze = entries.ndim == 1
+    if squeeze:
+        entries, exits = entries[:, None], exits[:, None]
+    opens = data_df["open"].values.astype(np.float64)[:, None]
+    closes = data_df["close"].values.astype(np.float64)[:, None]
+
+    # Desired state after each bar's decision: 1 after an entry, 0 after an exit, else unchanged
+    decided = entries | exits
+    state = np.where(entries, 1.0, 0.0)
+    state = np.take_along_axis(state, _ffill_index(decided), axis=0)
+    state[~np.maximum.accumulate(decided, axis=0)] = 0.0
+
+    # The decision of bar t is filled at the open of bar t + 1
+    held = np.zeros(state.shape)
+    held[1:] = state[:-1] * stake
+    traded = np.diff(held, axis=0, prepend=0.0)
+    buys, sells = traded > 0, traded < 0
+
+    entry_price = np.take_along_axis(
+        np.broadcast_to(opens, held.shape), _ffill_index(buys), axis=0
+    )
+    fill_cost = np.abs(traded) * opens * commission
+    flows = np.where(buys, -traded * opens, 0.0)
+    flows += np.where(
+        sells, -traded * (entry_price + (opens - entry_price) * mult), 0.0
+    )
+    cash = init_cash + np.cumsum(flows - fill_cost, axis=0)
+    equity = cash + held * closes
+
+    result = {
+        "equity": equity,
+        "positions": held,
+        "final_value": equity[-1],
+        "n_trades": sells.sum(axis=0),
+    }
+    if squeeze:
+        result = {k: v[..., 0] for k, v in result.items()}
+        result["final_value"] = float(result["final_value"])
+        result["n_trades"] = int(result["n_trades"])
+    return result
+
+
+def screen_sma_cross(
+    data_df,
+    fast_periods,
+    slow_periods,
+    stake=1,
+    init_cash=100000.0,
+    commission=0.00,
+    mult=1.0,
+):
+    """
+    Screens every (maperiodf, maperiods) pair of TaLib_SMACross in one vectorized pass
+    INPUTS
+    data_df: [Obligatory] DataFrame as returned by load_data
+    fast_periods, slow_periods: [Obligatory] lists of periods, every combination with fast < slow is tested
+    stake, init_cash, commission, mult: [Optional] as in run_vectorized
+    OUTPUT
+    DataFrame with maperiodf, maperiods, final_value and n_trades, sorted by final_value
+    """
+    pairs = [(f, s) for f in fast_periods for s in slow_periods if f < s]
+    fast, slow = zip(*pairs)
+    entries, exits = sma_cross_signals(data_df["close"].values, fast, slow)
+    result = run_vectorized(
+        data_df,
+        entries,
+        exits,
+        stake=stake,
+        init_cash=init_cash,
+        commission=commission,
+        mult=mult,
+    )
+    df = pd.DataFrame(
+        {
+            "maperiodf": fast,
+            "maperiods": slow,
+            "final_value": result["final_value"],
+            "n_trades": result["n_trades"],
+        }
+    )
+    return df.sort_values("final_value", ascending=False).reset_index(drop=True)
+
+
+# Vectorized signals of the strategies in the repo, by strategy class name
+SIGNALS = {
+    "TestStrategyComplete": lambda close, p: sma_signals(close, p.get("maperiod", 15)),
+    "Sample01": lambda close, p: sma_signals(close, p.get("maperiod", 15)),
+    "TaLib_SMACross": lambda close, p: sma_cross_signals(
+        close, p.get("maperiodf", 15), p.get("maperiods", 50)
+    ),
+}
+
+
+class _ValueRecorder(bt.Analyzer):
+    def start(self):
+        self.values = list()
+
+    def notify_fund(self, cash, value, fundvalue, shares):
+        self.values.append(value)
+
+    def get_analysis(self):
+        return self.values
+
+
+def check_consistency(
+    strategy,
+    datapath="../data/us/daily/aapl.csv",
+    strategy_params=None,
+    signals=None,
+    init_cash=100000.0,
+    commission=0.00,
+    mult=1.0,
+    rtol=1e-6,
+):
+    """
+    Runs a strategy both with backtrader and with the vectorized engine on the same data and compares the equity curves
+    INPUTS
+    strategy: [Obligatory] the backtrader strategy
+    datapath: [Optional, defalut = "../data/us/daily/aapl.csv"] path of the csv with the data
+    strategy_params: [Optional, default = None] dictionary with the parameters to pass to the strategy
+    signals: [Optional, default = None] function (close, strategy_params) -> (entries, exits). If None it is looked up in SIGNALS by strategy name
+    init_cash, commission, mult: [Optional] broker settings, as in run_backtest_full
+    rtol: [Optional, default = 1e-6] relative tolerance on the equity curve
+    OUTPUT
+    dictionary with both final values, the maximum relative difference of the equity curves, both runtimes and whether they are consistent
+    """
+    strategy_params = strategy_params or dict()
+    if signals is None:
+        if strategy.__name__ not in SIGNALS:
+            raise ValueError(
+                "No vectorized signals known for %s, provide them with the parameter signals"
+                % strategy.__name__
+            )
+        signals = SIGNALS[strategy.__name__]
+    df = load_data(datapath)
+
+    start = time.perf_counter()
+    cerebro = bt.Cerebro(stdstats=False)
+    cerebro.addstrategy(strategy, **strategy_params)
+    cerebro.adddata(
+        bt.feeds.PandasData(
+            dataname=df, datetime=0, open=1, high=2, low=3, close=4, volume=5
+        )
+    )
+    cerebro.addanalyzer(_ValueRecorder, _name="values")
+    cerebro.broker.setcash(init_cash)
+    cerebro.broker.setcommission(commission=commission, mult=mult)
+    strat = cerebro.run(exactbars=1)[0]
+    bt_equity = np.asarray(strat.analyzers.values.get_analysis())
+    bt_runtime = time.perf_counter() - start
+
+    start = time.perf_counter()
+    entries, exits = signals(df["close"].values, strategy_params)
+    result = run_vectorized(
+        df, entries, exits, init_cash=init_cash, commission=commission, mult=mult
+    )
+    vec_runtime = time.perf_counter() - start
+
+    n = min(len(bt_equity), len(result["equity"]))
+    difference = np.max(
+        np.abs(bt_equity[-n:] - result["equity"][-n:]) / np.abs(bt_equity[-n:])
+    )
+    return {
+        "backtrader_final_value": bt_equity[-1],
+        "vectorized_final_value": result["final_value"],
+        "max_relative_difference": difference,
+        "backtrader_runtime": bt_runtime,
+        "vectorized_runtime": vec_runtime,
+        "consistent": bool(len(bt_equity) == len(result["equity"]) and difference <= rtol),
+    }
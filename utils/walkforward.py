@@ -0,0 +1,272 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import multiprocessing as mp
+import os
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+sys.path.append("../libraries/backtrader")
+import backtrader as bt
+
+sys.path.append("../")
+from utils.basic import load_data, run_backtest_metrics
+from utils.sweeps import expand_grid
+from utils.testers import TestStrategyComplete
+
+
+# Data loaded once per worker process by _init_worker, folds are slices of it
+_worker_data = dict()
+
+
+def make_folds(n_bars, train_size, test_size, step=None, anchored=False):
+    """
+    Splits a series of bars into consecutive train/test windows
+    INPUTS
+    n_bars: [Obligatory] number of bars of the data
+    train_size: [Obligatory] bars of each train window. When anchored it is the size of the first one
+    test_size: [Obligatory] bars of each test window
+    step: [Optional, default = None] bars between the start of two consecutive test windows. If None test_size, so that the test windows are contiguous
+    anchored: [Optional, default = False] if True every train window starts at the first bar and grows, otherwise it rolls with a fixed size
+    OUTPUT
+    list of (train_start, train_end, test_start, test_end) positions, ends excluded
+    """
+    step = test_size if step is None else step
+    if step < test_size:
+        raise ValueError("Parameter step can not be smaller than test_size, test windows would overlap")
+    folds = list()
+    test_start = train_size
+    while test_start + test_size <= n_bars:
+        train_start = 0 if anchored else test_start - train_size
+        folds.append((train_start, test_start, test_start, test_start + test_size))
+        test_start += step
+    return folds
+
+
+class _ValueRecorder(bt.Analyzer):
+    params = (("skip", 0),)
+
+    def start(self):
+        self.values = list()
+
+    def notify_fund(self, cash, value, fundvalue, shares):
+        # The warm-up bars before the test window are not recorded
+        if len(self.strategy) > self.p.skip:
+            self.values.append(value)
+
+    def get_analysis(self):
+        return self.values
+
+
+def _trading_after(strategy, skip):
+    """
+    Subclass of strategy whose next does nothing in its first skip bars, they only warm up its indicators
+    """
+
+    class WarmedUp(strategy):
+        def next(self):
+            if len(self) > skip:
+                super(WarmedUp, self).next()
+
+    WarmedUp.__name__ = strategy.__name__
+    return WarmedUp
+
+
+def _init_worker(datapath):
+    _worker_data["df"] = load_data(datapath)
+
+
+def _slice(start, end):
+    return _worker_data["df"].iloc[start:end].reset_index(drop=True)
+
+
+def _run_train(task):
+    fold, strategy, params, broker_kwargs = task
+    train_start, train_end = fold[:2]
+    row = {"fold": fold, "params": params}
+    try:
+        row.update(
+            run_backtest_metrics(
+                strategy=strategy,
+                data_df=_slice(train_start, train_end),
+                strategy_params=params,
+                **broker_kwargs,
+            )
+        )
+        row["error"] = None
+    except Exception as e:
+        row["error"] = repr(e)
+    return row
+
+
+def _run_test(task):
+    fold, strategy, params, broker_kwargs, warmup = task
+    test_start, test_end = fold[2:]
+    # The bars before the test window are fed first, so that the indicators are ready on its first bar
+    start = max(0, test_start - warmup)
+    skip = test_start - start
+    cerebro = bt.Cerebro(stdstats=False)
+    cerebro.addstrategy(_trading_after(strategy, skip), **params)
+    data = bt.feeds.PandasData(
+        dataname=_slice(start, test_end),
+        datetime=0,
+        open=1,
+        high=2,
+        low=3,
+        close=4,
+        volume=5,
+    )
+    cerebro.adddata(data)
+    cerebro.addanalyzer(_ValueRecorder, _name="values", skip=skip)
+    cerebro.broker.setcash(broker_kwargs["init_cash"])
+    cerebro.broker.setcommission(
+        commission=broker_kwargs["commission"],
+        margin=broker_kwargs["margin"],
+        mult=broker_kwargs["mult"],
+    )
+    strat = cerebro.run(exactbars=1)[0]
+    if strat._minperiod - 1 > skip:
+        print(
+            "[WARNING] - Only %d bars of warm-up before the test window starting at bar %d, the strategy needs %d"
+            % (skip, test_start, strat._minperiod - 1)
+        )
+    return fold, np.asarray(strat.analyzers.values.get_analysis(), dtype=np.float64)
+
+
+def _select(rows, metric, maximize):
+    """Best train row of a fold. Rows that failed or have no value for the metric are never chosen"""
+    valid = [r for r in rows if r["error"] is None and r.get(metric) is not None]
+    if not valid:
+        return None
+    return (max if maximize else min)(valid, key=lambda r: r[metric])
+
+
+def run_walkforward(
+    strategy=TestStrategyComplete,
+    param_grid=None,
+    datapath="../data/us/daily/aapl.csv",
+    train_size=756,
+    test_size=252,
+    step=None,
+    anchored=False,
+    metric="sharpe",
+    maximize=True,
+    processes=None,
+    init_cash=100000.0,
+    commission=0.00,
+    margin=None,
+    mult=1.0,
+    custom_log_prefix=None,
+    warmup=None,
+):
+    """
+    Walk-forward optimization: the parameters are optimized on each train window and evaluated on the following test window.
+    The out-of-sample equity curves are stitched into a summary.csv that get_report_complete can read.
+    All the train runs of all the folds, and then all the test runs, are spread over a pool of processes
+    INPUTS
+    strategy: [Optional, default = TestStrategyComplete] the strategy to test
+    param_grid: [Obligatory] dictionary of parameter name to list of values, as in utils.sweeps.run_sweep
+    datapath: [Optional, defalut = "../data/us/daily/aapl.csv"] path of the csv where the backtest data is. It is loaded once per worker and the folds are slices of it
+    train_size, test_size, step, anchored: [Optional] the windows, in bars, see make_folds. By default 3 years of training and 1 of test, rolling
+    metric: [Optional, default = "sharpe"] result of run_backtest_metrics used to choose the parameters
+    maximize: [Optional, default = True] whether the best metric is the highest or the lowest one
+    processes: [Optional, default = None] number of worker processes. If None the number of cores is used
+    init_cash, commission, margin, mult: [Optional] broker settings, as in run_backtest_full. Every test window starts with init_cash
+    custom_log_prefix: [Optional, default = None] a prefix for the folder where the results are saved
+    warmup: [Optional, default = None] bars before each test window that its run is also fed, without trading, so that the indicators start warm. It must be at least the minimum period of the strategy. If None train_size
+    OUTPUT
+    the log_path where summary.csv and folds.csv (windows, chosen parameters, in-sample metric and out-of-sample return per fold) are saved
+    """
+    if param_grid is None:
+        raise ValueError("Parameter param_grid must be provided")
+    combinations = expand_grid(param_grid)
+    broker_kwargs = dict(
+        init_cash=init_cash, commission=commission, margin=margin, mult=mult
+    )
+    warmup = train_size if warmup is None else warmup
+    df = load_data(datapath)
+    folds = make_folds(len(df), train_size, test_size, step=step, anchored=anchored)
+    if not folds:
+        raise ValueError(
+            "Not enough data for a single fold: %d bars, %d needed"
+            % (len(df), train_size + test_size)
+        )
+
+    start = time.perf_counter()
+    with mp.Pool(processes, initializer=_init_worker, initargs=(datapath,)) as pool:
+        train_rows = dict((fold, list()) for fold in folds)
+        tasks = [
+            (fold, strategy, params, broker_kwargs)
+            for fold in folds
+            for params in combinations
+        ]
+        for row in pool.imap_unordered(_run_train, tasks):
+            train_rows[row["fold"]].append(row)
+
+        best = dict()
+        for fold in folds:
+            row = _select(train_rows[fold], metric, maximize)
+            if row is None:
+                print(
+                    "[WARNING] - No valid train run for the fold starting at %s, using the first combination"
+                    % df["date"].iloc[fold[2]]
+                )
+                row = {"params": combinations[0], metric: None}
+            best[fold] = row
+
+        tasks = [
+            (fold, strategy, best[fold]["params"], broker_kwargs, warmup)
+            for fold in folds
+        ]
+        values = dict(pool.imap_unordered(_run_test, tasks))
+    print(
+        "[LOG] - %d folds, %d runs, in %.2f seconds"
+        % (len(folds), len(folds) * (len(combinations) + 1), time.perf_counter() - start)
+    )
+
+    # Each test window starts with init_cash, so the curves are stitched by their returns
+    summaries, fold_rows = list(), list()
+    for fold in folds:
+        test_start, test_end = fold[2:]
+        fold_values = values[fold]
+        summary = df.iloc[test_start:test_end][
+            ["open", "high", "low", "close", "volume"]
+        ].copy()
+        summary["date"] = df["date"].iloc[test_start:test_end].values
+        summary["value_returns"] = np.diff(fold_values, prepend=init_cash) / np.r_[
+            init_cash, fold_values[:-1]
+        ]
+        summaries.append(summary)
+        fold_rows.append(
+            dict(
+                train_start=df["date"].iloc[fold[0]],
+                train_end=df["date"].iloc[fold[1] - 1],
+                test_start=df["date"].iloc[test_start],
+                test_end=df["date"].iloc[test_end - 1],
+                **best[fold]["params"],
+                **{
+                    "train_" + metric: best[fold][metric],
+                    "test_return": fold_values[-1] / init_cash - 1,
+                }
+            )
+        )
+    summary = pd.concat(summaries).reset_index(drop=True)
+    summary["value"] = init_cash * np.cumprod(1 + summary["value_returns"].values)
+    summary["close_returns"] = summary["close"].pct_change()
+    summary = summary[
+        ["open", "high", "low", "close", "volume", "value", "date", "close_returns", "value_returns"]
+    ]
+
+    name = f'walkforward_{strategy.__name__}_{datapath.replace("/","-").replace(chr(92),"-")}_{datetime.now().isoformat()}'
+    if custom_log_prefix is not None:
+        name = f"{custom_log_prefix}_{name}"
+    log_path = os.path.join("../backtests", name)
+    if not os.path.exists(log_path):
+        os.makedirs(log_path)
+    summary.to_csv(os.path.join(log_path, "summary.csv"))
+    pd.DataFrame(fold_rows).to_csv(os.path.join(log_path, "folds.csv"))
+    print("[LOG] - Walk-forward logged")
+    return log_path